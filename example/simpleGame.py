@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-from nonblock import nonblock_read
+from nonblock import nonblock_read_until
 import os
 import time
 import sys
@@ -131,11 +131,13 @@ if __name__ == '__main__':
         # Take the current time, and subtract from last time we were here. This gives us a constant game speed no matter what processing we do.
         now = time.time()
 
-        # Sleep such that we retain the "one cycle per GAME_SPEED"
-        time.sleep(max(GAME_SPEED - (now - lastTime), 0))
+        # Wait for a single command for the rest of the cycle, such that we retain the "one cycle per GAME_SPEED" if no key is pressed.
+        #  This returns as soon as a key is pressed, or an empty string once the time is up.
+        data = nonblock_read_until(sys.stdin, size=1, timeout=max(GAME_SPEED - (now - lastTime), 0), forceMode='t')
 
         # Increment the monster timer to see if he moves
-        monsterTimeElapsed += GAME_SPEED
+        now = time.time()
+        monsterTimeElapsed += now - lastTime
         lastTime = now
 
         if monsterTimeElapsed >= monsterSpeed:
@@ -171,8 +173,10 @@ if __name__ == '__main__':
             keepGoing = False
             break
 
-        # Check for any input, and process a single command.
-        data = nonblock_read(sys.stdin, 1, 't')
+        # Process the command read above, if any.
+        if not data:
+            # stdin closed, or no key was pressed
+            data = ''
 
         # We have a loop here so we can break, it will only ever have 1 element per the limit above
         for character in data:
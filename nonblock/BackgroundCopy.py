@@ -0,0 +1,280 @@
+'''
+    Copyright (c) 2015-2016 Timothy Savannah under terms of LGPLv2. You should have received a copy of this LICENSE with this distribution.
+
+    BackgroundCopy.py Contains functions for copying one stream into another in the background (a "pump"), without the data passing through python where possible.
+
+
+'''
+# vim: ts=4 sw=4 expandtab
+
+import errno
+import os
+import stat
+import threading
+import time
+
+from collections import deque
+
+from .BackgroundWrite import BackgroundWriteProcess, _ChunkThrottle, _get_io_priority, _write_all, _flush_all, _WOULD_BLOCK_ERRNOS
+
+from .common import get_stream_fd, get_raw_stream_fd
+
+from .metrics import get_metrics_registry
+
+from .read import _peek_buffered
+
+__all__ = ('BackgroundCopyProcess', 'bgcopy')
+
+# Errnos with which a zero-copy call reports it does not support the given fds, in which case the copy continues through a buffer
+_UNSUPPORTED_ERRNOS = tuple( [ getattr(errno, name) for name in ('EINVAL', 'ENOSYS', 'EXDEV', 'EOPNOTSUPP', 'ENOTSOCK', 'EBADF') if hasattr(errno, name) ] )
+
+
+def bgcopy(src, dst, closeWhenFinished=False, chainAfter=None, ioPrio=4, closeSource=False):
+    '''
+        bgcopy - Start a background process copying everything from one stream into another, until the source is closed on the other side.
+
+            When both streams are raw files or sockets (or BufferedReader / BufferedWriter directly over one, @see nonblock.common.get_raw_stream_fd),
+              the data is copied by the kernel, without passing through python:
+              copy_file_range between regular files, splice when either end is a pipe, or sendfile from a regular file.
+              Otherwise (or if the kernel does not support the given fds), data is copied through a single reused buffer.
+
+            The copy is done in chunks of the #BackgroundIOPriority's defaultChunkSize, and throttled to its bandwidthPct, as with bgwrite.
+
+            @param src <stream> - A binary stream to read from (file, pipe, socket, etc)
+
+            @param dst <stream> - A binary stream to write into (file, pipe, socket, etc)
+
+            @param closeWhenFinished <bool> - If True, #dst will be closed after all the data has been copied. Default False.
+
+            @param chainAfter  <None/BackgroundWriteProcess> - If a BackgroundWriteProcess object is provided (the return of bgwrite* or bgcopy functions),
+              copying will not start until the associated data has completed writing. @see bgwrite
+
+            @param ioPrio <int/BackgroundIOPriority> - Default 4. The priority profile. @see BackgroundWriteProcess
+
+            @param closeSource <bool> - If True, #src will be closed after all the data has been copied. Default False.
+
+
+            @return - BackgroundCopyProcess - An object representing the state of this operation. @see BackgroundCopyProcess
+    '''
+    thread = BackgroundCopyProcess(src, dst, closeWhenFinished, chainAfter, ioPrio, closeSource)
+    thread.start()
+
+    return thread
+
+
+class BackgroundCopyProcess(BackgroundWriteProcess):
+    '''
+        BackgroundCopyProcess - A thread and data store representing a background copy task. You should probably use bgcopy and not this directly.
+
+          This is a BackgroundWriteProcess, so it can be chained with background writes in either direction.
+
+        Attributes:
+
+            src            <stream> - The stream being copied from
+
+            fileObj        <stream> - The stream being copied into
+
+            startedWriting <bool>  - Starts False, changes to True when copying has started (thread has started and any pending prior chain has completed)
+
+            finished       <bool>  - Starts False, changes to True after all data has been copied, and closeWhenFinished / closeSource streams are closed.
+                                     Will remain False if there is an exception raised during I/O
+
+            error          <None/Exception> - Starts None, and is set to any exception raised while copying (which will also terminate the thread)
+
+            bytesCopied    <int>   - The number of bytes copied so far
+
+            copyMethod     <None/str> - Once started, how the data is being copied: "copy_file_range", "splice", "sendfile", or "buffer"
+
+            metrics        <None/IOMetrics> - None, or the metrics for this copy if metrics were enabled when it was created. @see nonblock.metrics
+                Counters: "writes" (chunks copied), and "bytesWritten".
+                Timing histograms: "writeTime" (copy of each chunk), "waitTime" (waiting on a non-blocking stream), "sleepTime", and "chainWaitTime".
+    '''
+
+    def __init__(self, src, dst, closeWhenFinished=False, chainAfter=None, ioPrio=4, closeSource=False):
+        '''
+            __init__ - Create the BackgroundCopyProcess thread. You should probably use bgcopy instead of calling this directly.
+
+                @see bgcopy for the parameters
+
+            @raises ValueError - If ioPrio is neither a BackgroundIOPriority nor integer 1-10 inclusive
+                               - If chainAfter is not a BackgroundWriteProcess or None
+        '''
+        threading.Thread.__init__(self)
+        self.src = src
+        self.fileObj = dst
+
+        self.backgroundIOPriority = _get_io_priority(ioPrio)
+
+        # Nothing is queued, data comes from #src
+        self.remainingData = deque()
+
+        self.closeWhenFinished = closeWhenFinished
+        self.closeSource = closeSource
+
+        if chainAfter and not isinstance(chainAfter, BackgroundWriteProcess):
+            raise ValueError('chainAfter must be a BackgroundWriteProcess instance')
+
+        self.chainAfter = chainAfter
+
+        self.startedWriting = False
+        self.finished = False
+        self.error = None
+
+        self.bytesCopied = 0
+        self.copyMethod = None
+
+        self._initCompletion()
+
+        self.metrics = get_metrics_registry().create('bgcopy')
+
+    def run(self):
+        '''
+            run - Starts the thread. bgcopy automatically starts the thread.
+        '''
+        try:
+            if self._waitForChain() is False:
+                return
+
+            self.startedWriting = True
+
+            self._copy()
+
+            if self.closeSource is True:
+                self.src.close()
+            if self.closeWhenFinished is True:
+                self.fileObj.close()
+
+            self.finished = True
+        except Exception as e:
+            self.error = e
+        finally:
+            self._setCompleted()
+
+    def _copy(self):
+        '''
+            _copy - Copy all the data from #src to #fileObj, in chunks, applying the priority
+        '''
+        src = self.src
+        dst = self.fileObj
+        metrics = self.metrics
+
+        chunkSize = int(self.backgroundIOPriority.defaultChunkSize)
+        throttle = _ChunkThrottle(self.backgroundIOPriority, metrics)
+
+        try:
+            srcFd = get_stream_fd(src)
+            dstFd = get_stream_fd(dst)
+
+            # Only copy between the fds if each stream's data is exactly the bytes of its fd (e.x. not a gzip.GzipFile)
+            copyFunc = None
+            if get_raw_stream_fd(src) is not None and get_raw_stream_fd(dst) is not None:
+                (self.copyMethod, copyFunc) = _get_zero_copy_func(srcFd, dstFd)
+
+            if copyFunc is not None:
+                # Data already held in python's buffers must go first, in order
+                if hasattr(src, 'peek') and hasattr(src, 'raw'):
+                    held = _peek_buffered(src)
+                    if held:
+                        _write_all(dst, dstFd, memoryview(src.read(held)), throttle)
+                if hasattr(dst, 'flush'):
+                    dst.flush()
+            else:
+                self.copyMethod = 'buffer'
+
+            buf = None
+
+            while True:
+                if copyFunc is not None:
+                    before = time.time()
+                    try:
+                        count = copyFunc(chunkSize)
+                    except (OSError, IOError) as e:
+                        if e.errno in _WOULD_BLOCK_ERRNOS:
+                            count = None
+                        elif e.errno in _UNSUPPORTED_ERRNOS:
+                            # Nothing was copied by the failed call, continue through a buffer
+                            copyFunc = None
+                            self.copyMethod = 'buffer'
+                            continue
+                        else:
+                            raise
+
+                    if count is None:
+                        # One of the fds is non-blocking, wait for both to be ready
+                        throttle.wait(srcFd, dstFd)
+                        continue
+                else:
+                    if buf is None:
+                        buf = memoryview(bytearray(chunkSize))
+                    before = time.time()
+                    count = _read_into(src, srcFd, buf, throttle)
+                    if count:
+                        _write_all(dst, dstFd, buf[:count], throttle)
+                        if hasattr(dst, 'flush'):
+                            _flush_all(dst, dstFd, throttle)
+
+                if not count:
+                    # Source has been closed
+                    break
+
+                self.bytesCopied += count
+                if metrics is not None:
+                    metrics.time('writeTime', time.time() - before)
+                    metrics.count('writes')
+                    metrics.count('bytesWritten', count)
+
+                throttle.afterChunk(count)
+        finally:
+            throttle.stop()
+
+
+def _get_zero_copy_func(srcFd, dstFd):
+    '''
+        _get_zero_copy_func - Determine how the kernel can copy between the given fds.
+
+        @return tuple( <None/str>, <None/function> ) - The name of the method, and a function which takes a max count, and copies up to that many bytes
+            returning the number copied (0 at end of stream). (None, None) if there is no method for these fds.
+    '''
+    srcMode = os.fstat(srcFd).st_mode
+    dstMode = os.fstat(dstFd).st_mode
+
+    if stat.S_ISREG(srcMode) and stat.S_ISREG(dstMode) and hasattr(os, 'copy_file_range'):
+        return ('copy_file_range', lambda count : os.copy_file_range(srcFd, dstFd, count))
+
+    if (stat.S_ISFIFO(srcMode) or stat.S_ISFIFO(dstMode)) and hasattr(os, 'splice'):
+        return ('splice', lambda count : os.splice(srcFd, dstFd, count))
+
+    if stat.S_ISREG(srcMode) and hasattr(os, 'sendfile'):
+        return ('sendfile', lambda count : os.sendfile(dstFd, srcFd, None, count))
+
+    return (None, None)
+
+
+def _read_into(src, srcFd, view, throttle):
+    '''
+        _read_into - Read up to len(#view) bytes from #src into #view, waiting if #src is non-blocking and has no data.
+
+        @return <int> - The number of bytes read, 0 at end of stream
+    '''
+    while True:
+        try:
+            if hasattr(src, 'readinto1'):
+                # Buffered readers, returns what is available rather than waiting to fill #view
+                count = src.readinto1(view)
+            elif hasattr(src, 'readinto'):
+                count = src.readinto(view)
+            elif hasattr(src, 'recv_into'):
+                count = src.recv_into(view)
+            else:
+                data = src.read(len(view))
+                count = len(data)
+                view[:count] = data
+        except (OSError, IOError) as e:
+            if e.errno not in _WOULD_BLOCK_ERRNOS:
+                raise
+            count = None
+
+        if count is not None:
+            return count
+
+        throttle.wait(srcFd, None)
@@ -0,0 +1,186 @@
+'''
+    Copyright (c) 2015-2016 Timothy Savannah under terms of LGPLv2. You should have received a copy of this LICENSE with this distribution.
+
+    BackgroundProcess.py Contains functions for capturing the output of subprocesses in the background.
+
+      The stdout and stderr of any number of children are read by a single BackgroundReadReactor, and process exit is
+      collected on the same selector with a pidfd (Linux 5.3+, python 3.9+), so no threads are used per child.
+'''
+# vim: ts=4 sw=4 expandtab
+
+import os
+import threading
+import time
+
+from .BackgroundRead import get_default_reactor, _check_bgread_args, _create_results
+
+__all__ = ('BackgroundProcessData', 'bgread_process')
+
+
+def bgread_process(popen, blockSizeLimit=65535, closeStreams=True, teeStdout=None, teeStderr=None, reactor=None):
+    '''
+        bgread_process - Capture the stdout and stderr of a subprocess in the background, and collect its exit status.
+
+            Call this on each child process to capture many at once, they are all served by the same reactor.
+
+            @param popen <subprocess.Popen> - The child process. Whichever of its stdout and stderr are pipes are read.
+
+            @param blockSizeLimit <None/int> - Default 65535. Max number of bytes read from a pipe each time it becomes readable. @see bgread
+
+            @param closeStreams <bool> - Default True. If True, the pipes are closed after all data has been read from them.
+
+            @param teeStdout <None/file> - Default None. If provided, stdout data is also written to this file (and flushed) as it is read.
+
+            @param teeStderr <None/file> - Default None. If provided, stderr data is also written to this file (and flushed) as it is read.
+
+            @param reactor <None/BackgroundReadReactor> - Default None. The reactor which reads the pipes. If None, the shared default reactor is used. @see get_default_reactor
+
+        @return <BackgroundProcessData> - An object holding the output, which is marked finished once all output has been read and the process has exited.
+
+            If pidfd is unavailable, a thread is started for each child to wait on its exit.
+    '''
+    if reactor is None:
+        reactor = get_default_reactor()
+
+    results = BackgroundProcessData(popen)
+
+    streams = []
+    for (stream, teeFile, attrName) in ( (popen.stdout, teeStdout, 'stdout'), (popen.stderr, teeStderr, 'stderr') ):
+        if stream is None:
+            continue
+
+        blockSizeLimit = _check_bgread_args(stream, blockSizeLimit)[0]
+
+        streamResults = _create_results(stream, None, None, None)
+        streamResults.teeFile = teeFile
+        streamResults._onFinish = results._streamDone
+
+        setattr(results, attrName, streamResults)
+        streams.append( (stream, streamResults) )
+
+    results._numStreamsRemaining = len(streams)
+
+    for (stream, streamResults) in streams:
+        reactor._addStream(stream, streamResults, blockSizeLimit, closeStreams)
+
+    pidfd = None
+    if hasattr(os, 'pidfd_open'):
+        try:
+            pidfd = os.pidfd_open(popen.pid)
+        except (OSError, IOError):
+            # Kernel without pidfd support, or the process was already reaped
+            pidfd = None
+
+    if pidfd is not None:
+        reactor._watchFd(pidfd, lambda : results._pidfdReady(pidfd))
+    else:
+        results._startWaitThread()
+
+    return results
+
+
+class BackgroundProcessData(object):
+    '''
+        BackgroundProcessData - An object returned by bgread_process, which is populated in the background with a child process's output and exit status.
+
+        It contains the following attributes:
+
+            popen - The subprocess.Popen object
+
+            stdout - A BackgroundReadData with the data read from stdout, or None if stdout is not a pipe. @see BackgroundReadData
+
+            stderr - A BackgroundReadData with the data read from stderr, or None if stderr is not a pipe.
+
+            returncode - Starts None, and is set to the process's exit status once it has exited.
+
+            isFinished - Starts False, and becomes True after all output has been read and the process has exited.
+
+            error - Starts None, and is set to any exception raised reading the output, or waiting on the process.
+    '''
+
+    def __init__(self, popen):
+        self.popen = popen
+        self.stdout = None
+        self.stderr = None
+        self.returncode = None
+
+        self.isFinished = False
+        self.error = None
+
+        self._lock = threading.Condition()
+        self._numStreamsRemaining = 0
+        self._hasExited = False
+
+    def wait(self, timeout=None):
+        '''
+            wait - Block until all output has been read and the process has exited (or an error occurs), or the timeout expires.
+
+                @param timeout <None/float> - Default None. Max number of seconds to wait, or None to wait forever.
+
+            @return <bool> - The value of isFinished
+        '''
+        with self._lock:
+            if timeout is not None:
+                endTime = time.time() + timeout
+
+            while self.isFinished is False and self.error is None:
+                if timeout is None:
+                    self._lock.wait()
+                else:
+                    remaining = endTime - time.time()
+                    if remaining <= 0:
+                        break
+                    self._lock.wait(remaining)
+
+            return self.isFinished
+
+    def _streamDone(self, streamResults):
+        with self._lock:
+            self._numStreamsRemaining -= 1
+            if streamResults.error is not None and self.error is None:
+                self.error = streamResults.error
+            self._checkFinished()
+
+    def _processExited(self, error=None):
+        with self._lock:
+            self._hasExited = True
+            self.returncode = self.popen.returncode
+            if error is not None and self.error is None:
+                self.error = error
+            self._checkFinished()
+
+    def _checkFinished(self):
+        # Must hold self._lock
+        if self._numStreamsRemaining == 0 and self._hasExited is True and self.error is None:
+            self.isFinished = True
+        self._lock.notify_all()
+
+    def _pidfdReady(self, pidfd):
+        '''
+            _pidfdReady - Called from the reactor thread when the pidfd is readable, i.e. the process has exited
+        '''
+        os.close(pidfd)
+        try:
+            returncode = self.popen.poll()
+        except Exception as e:
+            self._processExited(e)
+            return
+
+        if returncode is None:
+            # Should not happen, but don't hang if it does.
+            self._startWaitThread()
+        else:
+            self._processExited()
+
+    def _startWaitThread(self):
+        thread = threading.Thread(target=self._waitForExit)
+        thread.daemon = True
+        thread.start()
+
+    def _waitForExit(self):
+        try:
+            self.popen.wait()
+        except Exception as e:
+            self._processExited(e)
+            return
+        self._processExited()
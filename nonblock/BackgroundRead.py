@@ -7,16 +7,43 @@
 '''
 # vim: ts=4 sw=4 expandtab
 
+import array
+import mmap
+import os
+import socket
+import tempfile
 import time
 import threading
 
-from .read import nonblock_read
+from collections import deque
 
-from .common import detect_stream_mode
+try:
+    import selectors
+except ImportError:
+    # python < 3.4, BackgroundReadReactor is unavailable
+    selectors = None
 
-__all__ = ('BackgroundReadData', 'bgread' )
+from .read import NonblockReader
 
-def bgread(stream, blockSizeLimit=65535, pollTime=.03, closeStream=True):
+from .common import detect_stream_mode, get_stream_fd, wait_for_fds
+
+from .metrics import get_metrics_registry
+
+__all__ = ('BackgroundReadData', 'BackgroundReadRingBuffer', 'BackgroundReadReactor', 'BackgroundReadPriority', 'bgread', 'get_default_reactor' )
+
+# Smallest allocation for the buffer backing binary BackgroundReadData
+_MIN_BUFFER_SIZE = 4096
+
+# Typecode for the array of block offsets, 64-bit where available so captures over 4GB are fine
+try:
+    array.array('q')
+    _OFFSET_TYPECODE = 'q'
+except ValueError:
+    _OFFSET_TYPECODE = 'l'
+
+_HAS_READONLY_VIEWS = hasattr(memoryview, 'toreadonly')
+
+def bgread(stream, blockSizeLimit=65535, pollTime=.03, closeStream=True, reactor=None, eventDriven=False, highWaterMark=None, framer=None, ringBufferSize=None, spillThreshold=None, ioPrio=None, batchDelay=None):
     '''
         bgread - Start a thread which will read from the given stream in a non-blocking fashion, and automatically populate data in the returned object.
 
@@ -32,6 +59,38 @@ def bgread(stream, blockSizeLimit=65535, pollTime=.03, closeStream=True):
 
             @param closeStream <bool> - Default True. If True, the "close" method on the stream object will be called when the other side has closed and all data has been read.
 
+            @param reactor <None/bool/BackgroundReadReactor> - Default None. If None or False, a new thread is started to read this stream.
+
+                If True, the stream is instead read by the shared BackgroundReadReactor ( @see get_default_reactor ), which reads any number of streams from a single thread.
+                You may also pass your own BackgroundReadReactor. The stream must be backed by a file descriptor. pollTime is not used in this mode, data is read as soon as it is available.
+
+            @param eventDriven <bool> - Default False. If True, instead of sleeping #pollTime between reads, the thread blocks until the stream is readable,
+                so data is collected as soon as it arrives and an idle stream costs no CPU time. The stream must be backed by a file descriptor.
+
+                #pollTime is not used in this mode. Data is read as soon as the stream becomes readable, unless a #batchDelay is given.
+
+            @param highWaterMark <None/int> - Default None. If set, the max number of bytes (or characters) held in the returned object before reading pauses.
+
+                Use this along with the consuming methods of BackgroundReadData ( popData, popBlock, iterBlocks ) to bound memory usage on long-running streams.
+                While paused, unread data stays in the kernel buffer, so a producer on the other side of a pipe or socket will block (backpressure).
+
+            @param framer <None/framer> - Default None. If provided, the data is split into records (lines, fixed-length, or length-prefixed) as it is read,
+                which are then available as the "blocks" of the returned object. @see nonblock.framing , @see BackgroundReadData
+
+            @param ringBufferSize <None/int> - Default None. If provided, data is read into a fixed-size ring buffer of this many bytes, allocated up front,
+                and a BackgroundReadRingBuffer is returned. Reading pauses while the ring is full. Binary streams only, and cannot be used with highWaterMark or framer.
+
+            @param spillThreshold <None/int> - Default None. If provided, once more than this many bytes are held, the data is moved to an unlinked
+                temporary file which is memory-mapped, instead of the python heap, so captures of any size keep memory usage flat.
+                "data" then returns a read-only memoryview of the mapping rather than a copy. Binary streams only, and cannot be used with ringBufferSize.
+
+            @param ioPrio <None/int/BackgroundReadPriority> - Default None. If provided, reading is throttled according to this priority profile,
+                so a busy stream gets a bounded share of CPU time and memory bandwidth. If an integer (1-10), a predefined BackgroundReadPriority is used.
+                1 is highest throughput, 10 is most interactivity. The profile's pollTime and blockSizeLimit are used in place of those arguments.
+                Cannot be used with a reactor. @see BackgroundReadPriority
+
+            @param batchDelay <None/float> - Default None. Only with eventDriven=True. If provided, after the stream becomes readable, wait this many seconds
+                for more data to accumulate before reading, so a stream written in many small pieces is read in fewer, larger blocks, at the cost of latency.
 
 
         NOTES --
@@ -47,11 +106,71 @@ def bgread(stream, blockSizeLimit=65535, pollTime=.03, closeStream=True):
 
 
     '''
+    if ioPrio is not None:
+        readPriority = _get_read_priority(ioPrio)
+        pollTime = readPriority.pollTime
+        blockSizeLimit = readPriority.blockSizeLimit
+
     try:
         pollTime = float(pollTime)
     except ValueError:
         raise ValueError('Provided poll time must be a float.')
 
+    if batchDelay is not None:
+        if not eventDriven:
+            raise ValueError('batchDelay can only be used with eventDriven=True.')
+        try:
+            batchDelay = float(batchDelay)
+        except ValueError:
+            raise ValueError('Provided batchDelay must be a float.')
+        if batchDelay < 0:
+            raise ValueError('Provided batchDelay must be >= 0.')
+
+    if reactor:
+        if ioPrio is not None:
+            raise ValueError('ioPrio cannot be used with a reactor.')
+        if reactor is True:
+            reactor = get_default_reactor()
+        return reactor.bgread(stream, blockSizeLimit, closeStream, highWaterMark, framer, ringBufferSize, spillThreshold)
+
+    (blockSizeLimit, highWaterMark) = _check_bgread_args(stream, blockSizeLimit, highWaterMark)
+
+    results = _create_results(stream, highWaterMark, framer, ringBufferSize, spillThreshold)
+
+    # Resolve how to read the stream once, not on every read
+    reader = NonblockReader(stream, results._forceMode)
+
+    if ioPrio is not None:
+        throttle = _ReadThrottle(readPriority, pollTime, results.metrics)
+        blockSizeLimit = throttle.getBlockSizeLimit(blockSizeLimit)
+    else:
+        throttle = None
+
+    if eventDriven:
+        fd = reader.fd
+        if fd is None:
+            raise ValueError('eventDriven bgread can only read streams backed by a file descriptor, %s is not.' %(repr(stream),))
+
+        # Socket pair used to wake the thread when stop is requested
+        (wakeRecv, wakeSend) = socket.socketpair()
+        results._stopFunc = lambda : _wakeup_socket(wakeSend)
+
+        thread = threading.Thread(target=_do_bgread_events, args=(stream, reader, blockSizeLimit, batchDelay, closeStream, results, wakeRecv, wakeSend, throttle))
+    else:
+        thread = threading.Thread(target=_do_bgread, args=(stream, reader, blockSizeLimit, pollTime, closeStream, results, throttle))
+    thread.daemon = True # Automatically terminate this thread if program closes
+    thread.start()
+
+    return results
+
+def _check_bgread_args(stream, blockSizeLimit, highWaterMark=None):
+    '''
+        _check_bgread_args - Validate the stream, block size limit, and high water mark given to a bgread function.
+
+        @return tuple( <None/int>, <None/int> ) - The block size limit and high water mark, converted to int
+
+        @raises ValueError - If the stream cannot be read from, or the blockSizeLimit or highWaterMark is invalid
+    '''
     if not hasattr(stream, 'read') and not hasattr(stream, 'recv'):
         raise ValueError('Cannot read off provided stream, does not implement "read" or "recv"')
 
@@ -63,14 +182,199 @@ def bgread(stream, blockSizeLimit=65535, pollTime=.03, closeStream=True):
         except ValueError:
             raise ValueError('Provided block size limit must be "None" for no limit, or a positive integer.')
 
+    if highWaterMark is not None:
+        try:
+            highWaterMark = int(highWaterMark)
+            if highWaterMark <= 0:
+                raise ValueError()
+        except ValueError:
+            raise ValueError('Provided high water mark must be "None" for no limit, or a positive integer.')
+
+    return (blockSizeLimit, highWaterMark)
+
+
+def _create_results(stream, highWaterMark, framer, ringBufferSize, spillThreshold=None):
+    '''
+        _create_results - Create the BackgroundReadData (or BackgroundReadRingBuffer) for a bgread function.
+
+        @raises ValueError - If ringBufferSize or spillThreshold is used with a text stream, ringBufferSize is used along with a highWaterMark,
+            framer or spillThreshold, or spillThreshold is invalid
+    '''
     streamMode = detect_stream_mode(stream)
-    results = BackgroundReadData(streamMode)
 
-    thread = threading.Thread(target=_do_bgread, args=(stream, blockSizeLimit, pollTime, closeStream, results))
-    thread.daemon = True # Automatically terminate this thread if program closes
-    thread.start()
+    if spillThreshold is not None:
+        try:
+            spillThreshold = int(spillThreshold)
+            if spillThreshold <= 0:
+                raise ValueError()
+        except ValueError:
+            raise ValueError('Provided spill threshold must be "None" to never spill, or a positive integer.')
+        if streamMode is not bytes:
+            raise ValueError('spillThreshold can only be used with binary streams.')
+
+    if ringBufferSize is None:
+        return BackgroundReadData(streamMode, highWaterMark, framer, spillThreshold)
+
+    if streamMode is not bytes:
+        raise ValueError('ringBufferSize can only be used with binary streams.')
+    if highWaterMark is not None or framer is not None or spillThreshold is not None:
+        raise ValueError('ringBufferSize cannot be used along with highWaterMark, framer, or spillThreshold.')
+
+    return BackgroundReadRingBuffer(ringBufferSize)
+
+
+class BackgroundReadPriority(object):
+    '''
+        BackgroundReadPriority - Priority Profile for doing background reads. The read-side counterpart of BackgroundIOPriority.
+
+            See __init__ for fields
+    '''
+
+    __slots__ = ('pollTime', 'blockSizeLimit', 'bandwidthPct', 'maxBytesPerSec', 'numBlocksRateSmoothing')
+
+    def __init__(self, pollTime, blockSizeLimit, bandwidthPct, maxBytesPerSec=None, numBlocksRateSmoothing=5):
+        '''
+            __init__ - Create a BackgroundReadPriority.
+
+            @param pollTime - float >= 0, The time to wait between reads. @see bgread
+
+            @param blockSizeLimit - None or integer > 0, The max number of bytes read at once. @see bgread
+                Lower reads less at a time, and spends less time at once reading, increasing interactivity at a cost of throughput.
+
+            @param bandwidthPct - integer > 0 and <= 100. This is the percentage of the time spent reading that this task will attempt to use.
+
+              As with BackgroundIOPriority, the average time to read a block is calculated over #numBlocksRateSmoothing blocks,
+              and ( 100 - bandwidthPct )% of that time is slept after every block. 100 means no throttling is performed.
+
+            @param maxBytesPerSec - None or integer > 0, Default None. If provided, reading is limited to this many bytes per second.
+              The blockSizeLimit is also reduced so that a single read does not exceed what may be read in one pollTime (or 10ms, if longer).
+
+            @param numBlocksRateSmoothing - integer >= 1, Default 5. The number of blocks used to calculate the average read time. @see BackgroundIOPriority
+        '''
+        self.pollTime = pollTime
+        self.blockSizeLimit = blockSizeLimit
+        self.bandwidthPct = float(bandwidthPct)
+        if bandwidthPct <= 0 or bandwidthPct > 100:
+            raise ValueError('Given bandwidthPct %f must be > 0 and <= 100' %(bandwidthPct,))
+
+        if maxBytesPerSec is not None and maxBytesPerSec <= 0:
+            raise ValueError('Given maxBytesPerSec %s must be None or > 0' %(str(maxBytesPerSec),))
+        self.maxBytesPerSec = maxBytesPerSec
+
+        self.numBlocksRateSmoothing = numBlocksRateSmoothing
+
+    def __getitem__(self, key):
+        if key in BackgroundReadPriority.__slots__:
+            return getattr(self, key)
+        raise KeyError('Unknown key: %s\n' %(key,))
+
+    def __setitem__(self, key, value):
+        if key in BackgroundReadPriority.__slots__:
+            return setattr(self, key, value)
+        raise KeyError('Unknown key: %s\n' %(key,))
+
+
+_SIZE_KB = 1024
+
+# BG_READ_PRIOS - Predefined read priorities, 1-10. The lower the number, the more throughput at the cost of interactivity
+BG_READ_PRIOS = {
+    1  : BackgroundReadPriority(.001,  _SIZE_KB * 4096, 100), # Maximum throughput, no regard for interactivity.
+    2  : BackgroundReadPriority(.002,  _SIZE_KB * 2048,  90),
+    3  : BackgroundReadPriority(.005,  _SIZE_KB * 1024,  78),
+    4  : BackgroundReadPriority(.01,   _SIZE_KB * 512,   72),
+    5  : BackgroundReadPriority(.015,  _SIZE_KB * 256,   65),
+    6  : BackgroundReadPriority(.02,   _SIZE_KB * 128,   55),
+    7  : BackgroundReadPriority(.03,   _SIZE_KB * 64,    45),
+    8  : BackgroundReadPriority(.04,   _SIZE_KB * 64,    35),
+    9  : BackgroundReadPriority(.05,   _SIZE_KB * 48,    30),
+    10 : BackgroundReadPriority(.05,   _SIZE_KB * 32,    20), # Least throughput, most interactivity
+}
+
+
+def _get_read_priority(ioPrio):
+    '''
+        _get_read_priority - Get the BackgroundReadPriority for an "ioPrio" argument
+
+        @raises ValueError - If ioPrio is neither a BackgroundReadPriority nor integer 1-10 inclusive
+    '''
+    if isinstance(ioPrio, BackgroundReadPriority):
+        return ioPrio
+    try:
+        return BG_READ_PRIOS[ioPrio]
+    except KeyError:
+        raise ValueError('Invalid ioPrio: %s. Available priority levels are: %s' %(str(ioPrio), str(list(BG_READ_PRIOS.keys()))) )
+
+
+class _ReadThrottle(object):
+    '''
+        _ReadThrottle - Applies a BackgroundReadPriority to a background read thread. Used by a single thread.
+    '''
+
+    def __init__(self, readPriority, pollTime, metrics=None):
+        self.readPriority = readPriority
+        self.pollTime = pollTime
+        self.metrics = metrics
+
+        self.bandwidthPctDec = readPriority.bandwidthPct / 100.0
+        self.numBlocksRateSmoothing = readPriority.numBlocksRateSmoothing
+        self.maxBytesPerSec = readPriority.maxBytesPerSec
+
+        # Time spent reading over the last (up to) numBlocksRateSmoothing blocks, and the resulting sleep after each block
+        self.numBlocks = 0
+        self.readTime = 0
+        self.sleepTime = 0
+
+        # Start of the current maxBytesPerSec period, and bytes read within it
+        self.periodStart = None
+        self.periodBytes = 0
+
+    def getBlockSizeLimit(self, blockSizeLimit):
+        '''
+            getBlockSizeLimit - Reduce #blockSizeLimit so a single read does not exceed maxBytesPerSec over one pollTime (or 10ms, if longer)
+        '''
+        if self.maxBytesPerSec is None:
+            return blockSizeLimit
+
+        maxBlockSize = max( int(self.maxBytesPerSec * max(self.pollTime, .01)), 1 )
+        if blockSizeLimit is None or maxBlockSize < blockSizeLimit:
+            return maxBlockSize
+        return blockSizeLimit
+
+    def throttle(self, readTime, numRead):
+        '''
+            throttle - Called after each read which found data, sleeps as needed to apply the priority.
+
+                @param readTime <float> - The time spent in the read
+
+                @param numRead <int> - The number of bytes (or characters) read
+        '''
+        sleepTime = 0
+
+        if self.bandwidthPctDec < 1:
+            self.readTime += readTime
+            self.numBlocks += 1
+            if (self.numBlocks == 1 and not self.sleepTime) or self.numBlocks >= self.numBlocksRateSmoothing:
+                # Calculate how much time we should give up on each block to other tasks
+                self.sleepTime = (self.readTime / self.numBlocks) * (1.00 - self.bandwidthPctDec)
+                self.readTime = 0
+                self.numBlocks = 0
+            sleepTime = self.sleepTime
+
+        maxBytesPerSec = self.maxBytesPerSec
+        if maxBytesPerSec is not None:
+            now = time.time()
+            if self.periodStart is None or self.periodStart + (self.periodBytes / maxBytesPerSec) < now:
+                # Caught up (or idle), start a new period rather than allowing a burst
+                self.periodStart = now
+                self.periodBytes = 0
+            self.periodBytes += numRead
+            sleepTime = max( sleepTime, self.periodStart + (self.periodBytes / maxBytesPerSec) - now )
+
+        if sleepTime > 0:
+            time.sleep(sleepTime)
+            if self.metrics is not None:
+                self.metrics.time('throttleTime', sleepTime)
 
-    return results
 
 class BackgroundReadData(object):
     '''
@@ -79,25 +383,248 @@ class BackgroundReadData(object):
 
         It contains the following attributes:
 
-            blocks - The raw non-zero length blocks read from the stream, in order.
+            blocks - The raw non-zero length blocks read from the stream, in order. This is a snapshot list, cached and extended with only the new blocks as data arrives.
 
             data - A calculated property, which is a bytes/str (depending on stream mode). It is the joining of all the read blocks, and contains all the data read to-date.
+                This is cached, and only rebuilt when new data has been read since the last access. Once spilled to disk, this is a read-only memoryview instead.
 
             isFinished - starts False, and becomes True after all data has been read from the stream. Will remain False if there is an exception raised during I/O
 
             error - starts None, and is set to any exception that is raised during reading (which will also terminate the thread)
+
+            highWaterMark - None, or the max amount of data held before the background reader pauses. @see bgread
+
+            framer - None, or the framer splitting the data into records. @see nonblock.framing
+
+            teeFile - None, or a file-like object to which each block is also written (and flushed) as it is read.
+
+            spillThreshold - None, or the number of bytes held above which data is spilled to disk. @see bgread
+
+            isSpilled - True once the data has been spilled to disk
+
+            metrics - None, or an IOMetrics if metrics were enabled when this object was created. @see nonblock.metrics
+                Counters: "reads" (read attempts), "emptyReads" (attempts which found no data), "bytesRead", and "pauses" (for the highWaterMark).
+                Timing histograms: "readTime" (time spent in each read), and "dataAge" (the time since the previous read attempt, when a read finds data,
+                  i.e. the longest the data could have been waiting to be picked up).
+
+        len(obj) gives the amount of data (bytes or characters) currently held.
+
+        Binary data is stored in a single growable buffer, of which a zero-copy snapshot can be taken with #getDataView
+
+        If a spillThreshold is set, once the buffer must grow beyond it, the buffer becomes a memory-mapped, unlinked temporary file.
+          The kernel can then write the data out and drop it from memory as needed, and the file is removed once this object (and any views) are released.
+
+
+        Consuming data --
+
+            By default all data read is kept. For long-running streams, use #popData / #popBlock / #iterBlocks to consume the data instead,
+            which discards it from this object. After consuming, "data", "blocks", "getDataView" and len only cover data which has not yet been consumed.
+
+            #waitForData will block until data is available to consume.
+
+            If a highWaterMark is set, the background reader stops reading from the stream once that much data is held, leaving it in the kernel
+            buffer (which applies backpressure to the producer). Reading resumes once the held data is consumed down to half the highWaterMark.
+
+
+        Records --
+
+            If a framer is given ( @see nonblock.framing ), data is split into records (lines, fixed-length records, or length-prefixed records) as it
+            arrives, instead of the blocks read. "blocks", #popBlock and #iterBlocks then give complete records, and a partial trailing record stays
+            held until it is completed. Each byte is scanned only once. #popData also consumes any partial trailing record.
+
+            If a highWaterMark is used with a framer, it must be larger than the largest record.
+
+
+        Call #stop to stop reading early.
     '''
 
-    def __init__(self, dataType):
-        self.blocks = []
+    def __init__(self, dataType, highWaterMark=None, framer=None, spillThreshold=None):
         self.dataType = dataType
         self.emptyStr = dataType()
 
         self.isFinished = False
         self.error = None
 
+        self.highWaterMark = highWaterMark
+
+        # Used to create the NonblockReader, so the mode is not detected again
+        self._forceMode = dataType is bytes and 'b' or 't'
+
+        self.teeFile = None
+
+        # If set, called with this object after reading has ended (finished or error)
+        self._onFinish = None
+
+        self.framer = framer
+        if framer is not None:
+            framer.validate(dataType)
+            framer.reset(0)
+            # Number of bytes at the start of each record not included when the record is returned (i.e. a length prefix)
+            self._headerSize = framer.headerSize
+        else:
+            self._headerSize = 0
+
+        # Guards all the data below, and is notified when data arrives, is consumed, or reading ends
+        self._lock = threading.Condition()
+
+        # Set by the reader to a function which interrupts it when stop is requested
+        self._stopRequested = False
+        self._stopFunc = None
+
+        # Set when the reader has paused for the highWaterMark. _resumeFunc, if set by the reader, is called upon resuming.
+        self._isPaused = False
+        self._resumeFunc = None
+
+        # End offset of each block (or record, if there is a framer), so #blocks can be rebuilt without holding an object per block.
+        #   Entries before _blockIdx have been consumed.
+        self._blockEnds = array.array(_OFFSET_TYPECODE)
+        self._blockIdx = 0
+
+        # _start is the offset of the first data held (everything prior has been consumed), _length the offset of the end of the data.
+        #   These count from the start of the stream.
+        self._start = 0
+        self._length = 0
+
+        if dataType is bytes:
+            # Grown by swapping in a larger copy, never resized in place, so outstanding memoryviews remain valid.
+            #   _bufferBase is the stream offset of buffer[0]
+            self._buffer = bytearray()
+            self._bufferBase = 0
+            self._chunks = None
+        elif spillThreshold is not None:
+            raise ValueError('spillThreshold can only be used with binary data.')
+        else:
+            # str - Blocks are compacted into one string upon access of #data. _chunkOffset is the amount of _chunks[0] already consumed.
+            self._buffer = None
+            self._chunks = deque()
+            self._chunkOffset = 0
+
+        # The temporary file backing _buffer, once spilled to disk
+        self.spillThreshold = spillThreshold
+        self._spillFile = None
+
+        self.metrics = get_metrics_registry().create('bgread')
+        if self.metrics is not None:
+            # When the last read attempt ended, for "dataAge"
+            self._lastReadTime = self.metrics.startTime
+
+        self._dataCache = self.emptyStr
+        self._dataCacheKey = (0, 0)
+
+        # The list last returned by #blocks, and the value of _start it was built at
+        self._blocksCache = []
+        self._blocksCacheStart = 0
+
+    def __len__(self):
+        return self._length - self._start
+
+    def __bool__(self):
+        # Don't let an empty result evaluate as False, as it did not before __len__ was defined
+        return True
+
+    __nonzero__ = __bool__
+
+    def stop(self):
+        '''
+            stop - Stop reading the stream in the background. The stream will not be closed, and isFinished will remain False.
+        '''
+        with self._lock:
+            self._stopRequested = True
+            self._lock.notify_all()
+
+        if self._stopFunc is not None:
+            self._stopFunc()
+
     def addBlock(self, block):
-        self.blocks.append(block)
+        blockLen = len(block)
+        if not blockLen:
+            return
+
+        with self._lock:
+            start = self._length
+            end = start + blockLen
+
+            if self._buffer is not None:
+                buf = self._buffer
+                base = self._bufferBase
+                if end - base > len(buf):
+                    # Out of room. Copy only the data not yet consumed into a larger buffer.
+                    held = start - self._start
+                    newSize = max( (held + blockLen) * 2, _MIN_BUFFER_SIZE )
+                    if self.spillThreshold is not None and newSize > self.spillThreshold:
+                        buf = self._growSpillBuffer(newSize, end)
+                    else:
+                        newBuf = bytearray( newSize )
+                        newBuf[:held] = memoryview(buf)[self._start - base : start - base]
+                        buf = self._buffer = newBuf
+                        self._bufferBase = self._start
+                    base = self._bufferBase
+                buf[start - base : end - base] = block
+            else:
+                self._chunks.append(block)
+
+            if self.framer is not None:
+                self._blockEnds.extend( self.framer.feed(block, start) )
+            else:
+                self._blockEnds.append(end)
+            self._length = end
+
+            self._lock.notify_all()
+
+        if self.teeFile is not None:
+            self._tee(block)
+
+    def _growSpillBuffer(self, newSize, end):
+        '''
+            _growSpillBuffer - Must hold self._lock. Grow the buffer into a memory-mapped temporary file, large enough to hold the data up to #end.
+
+                If already spilled and at most half the file has been consumed, the same file is extended and mapped again, so nothing is copied.
+                  Otherwise the data not yet consumed is copied into a new file. Either way, the previous mapping stays valid for outstanding views.
+
+            @return <mmap.mmap> - The new buffer
+        '''
+        oldBuf = self._buffer
+        oldBase = self._bufferBase
+        start = self._start
+        held = self._length - start
+
+        spillFile = self._spillFile
+        if spillFile is not None and start - oldBase <= held:
+            newSize = max(newSize, (end - oldBase) * 2)
+            os.ftruncate(spillFile.fileno(), newSize)
+            buf = self._buffer = mmap.mmap(spillFile.fileno(), newSize)
+            return buf
+
+        # mmap holds its own reference to the file, so the old file can be closed even while old views remain.
+        newFile = tempfile.TemporaryFile(prefix='nonblock-bgread-')
+        try:
+            os.ftruncate(newFile.fileno(), newSize)
+            buf = mmap.mmap(newFile.fileno(), newSize)
+        except Exception:
+            newFile.close()
+            raise
+
+        buf[:held] = memoryview(oldBuf)[start - oldBase : start - oldBase + held]
+
+        if spillFile is not None:
+            spillFile.close()
+        self._spillFile = newFile
+        self._buffer = buf
+        self._bufferBase = start
+        return buf
+
+    @property
+    def isSpilled(self):
+        '''
+            isSpilled - property, True once the data has been spilled to a file on disk. @see spillThreshold
+        '''
+        return self._spillFile is not None
+
+    def _tee(self, block):
+        teeFile = self.teeFile
+        teeFile.write(block)
+        if hasattr(teeFile, 'flush'):
+            teeFile.flush()
 
     @property
     def data(self):
@@ -105,37 +632,970 @@ class BackgroundReadData(object):
             data - property to get the data as a string or bytes.
                 Use "blocks" to access the individual blocks of data
 
-            @return <str or bytes> - All data currently read, as a string or bytes (depending on the dataType)
+                Once spilled to disk, this is a read-only memoryview of the mapped file, so the data is not copied onto the heap. @see getDataView
+
+            @return <str or bytes or memoryview> - All data currently read, as a string or bytes (depending on the dataType)
+        '''
+        if self._spillFile is not None:
+            return self.getDataView()
+
+        with self._lock:
+            return self._getData()
+
+    def _getData(self):
+        # Must hold self._lock
+        key = (self._start, self._length)
+        if key == self._dataCacheKey:
+            return self._dataCache
+
+        if self._buffer is not None:
+            base = self._bufferBase
+            data = memoryview(self._buffer)[self._start - base : self._length - base].tobytes()
+        else:
+            chunks = self._chunks
+            if self._chunkOffset:
+                chunks[0] = chunks[0][self._chunkOffset:]
+                self._chunkOffset = 0
+            if len(chunks) > 1:
+                data = self.emptyStr.join(chunks)
+                chunks.clear()
+                chunks.append(data)
+            elif chunks:
+                data = chunks[0]
+            else:
+                data = self.emptyStr
+
+        self._dataCache = data
+        self._dataCacheKey = key
+        return data
+
+    def getDataView(self):
+        '''
+            getDataView - Get a zero-copy, read-only snapshot of all data currently read. Only available for binary streams.
+
+                The view remains valid and unchanged as more data is read, until data is consumed with #popData , #popBlock or #iterBlocks.
+
+            @return <memoryview> - A view of the data read to-date
+
+            @raises TypeError - If the stream is not binary
+        '''
+        with self._lock:
+            buf = self._buffer
+            if buf is None:
+                raise TypeError('getDataView is only available for binary streams. Use "data" instead.')
+
+            base = self._bufferBase
+            view = memoryview(buf)[self._start - base : self._length - base]
+
+        if _HAS_READONLY_VIEWS:
+            view = view.toreadonly()
+        return view
+
+    @property
+    def blocks(self):
+        '''
+            blocks - property to get the individual non-zero length blocks read from the stream, in order.
+
+                This is a snapshot, not the live list: later reads are not added to it, nor consumed blocks removed. Do not modify it.
+                It is cached, and upon access after new blocks have been read, only the new blocks are copied.
+
+            @return list<str or bytes> - The blocks read
+        '''
+        with self._lock:
+            start = self._start
+            blocks = self._blocksCache
+            if self._blocksCacheStart != start:
+                # Data has been consumed since, rebuild
+                blocks = []
+
+            blockIdx = self._blockIdx
+            blockEnds = self._blockEnds
+            firstNew = blockIdx + len(blocks)
+            if firstNew >= len(blockEnds):
+                return blocks
+
+            if self._buffer is not None:
+                data = memoryview(self._buffer)
+                offset = self._bufferBase
+                convert = lambda block : block.tobytes()
+            else:
+                data = self._getData()
+                offset = start
+                convert = lambda block : block
+
+            newBlocks = []
+            if firstNew > blockIdx:
+                blockStart = blockEnds[firstNew - 1]
+            else:
+                blockStart = start
+            headerSize = self._headerSize
+            for i in range(firstNew, len(blockEnds)):
+                end = blockEnds[i]
+                newBlocks.append( convert(data[blockStart + headerSize - offset : end - offset]) )
+                blockStart = end
+
+            # A new list, so snapshots already returned are unchanged
+            blocks = blocks + newBlocks
+            self._blocksCache = blocks
+            self._blocksCacheStart = start
+
+        return blocks
+
+    def popData(self):
+        '''
+            popData - Consume and return all data read since the last pop. This data is discarded from this object.
+
+            @return <str or bytes> - The data, which may be empty
+        '''
+        with self._lock:
+            data = self._getData()
+
+            end = self._length
+            self._start = end
+            del self._blockEnds[:]
+            self._blockIdx = 0
+
+            if self._buffer is not None:
+                # Buffer is empty, start filling from the beginning again
+                self._bufferBase = end
+            else:
+                self._chunks.clear()
+                self._chunkOffset = 0
+
+            if self.framer is not None:
+                # Any partial record was consumed, start framing again from here.
+                self.framer.reset(end)
+
+            self._dataCache = self.emptyStr
+            self._dataCacheKey = (end, end)
+
+            resumeFunc = self._checkResume()
+
+        if resumeFunc is not None:
+            resumeFunc()
+
+        return data
+
+    def popBlock(self):
+        '''
+            popBlock - Consume and return the next block read from the stream. The block is discarded from this object.
+
+            @return <None/str/bytes> - The next block, or None if no blocks are available
+        '''
+        with self._lock:
+            blockIdx = self._blockIdx
+            blockEnds = self._blockEnds
+            if blockIdx >= len(blockEnds):
+                return None
+
+            start = self._start
+            end = blockEnds[blockIdx]
+            blockLen = end - start
+
+            if self._buffer is not None:
+                base = self._bufferBase
+                block = memoryview(self._buffer)[start + self._headerSize - base : end - base].tobytes()
+            else:
+                chunks = self._chunks
+                if len(chunks[0]) - self._chunkOffset < blockLen:
+                    # A record which spans several blocks read, compact them.
+                    self._getData()
+                chunkOffset = self._chunkOffset
+                block = chunks[0][chunkOffset : chunkOffset + blockLen]
+                chunkOffset += blockLen
+                if chunkOffset >= len(chunks[0]):
+                    chunks.popleft()
+                    chunkOffset = 0
+                self._chunkOffset = chunkOffset
+
+            self._start = end
+            blockIdx += 1
+            if blockIdx == len(blockEnds):
+                del blockEnds[:]
+                blockIdx = 0
+                if self._buffer is not None and end == self._length:
+                    # Buffer is empty, start filling from the beginning again
+                    self._bufferBase = end
+            elif blockIdx >= 1024 and blockIdx * 2 >= len(blockEnds):
+                # Trim the consumed offsets every so often
+                del blockEnds[:blockIdx]
+                blockIdx = 0
+            self._blockIdx = blockIdx
+
+            resumeFunc = self._checkResume()
+
+        if resumeFunc is not None:
+            resumeFunc()
+
+        return block
+
+    def waitForData(self, timeout=None):
+        '''
+            waitForData - Block until there is data to consume, reading has ended (stream finished, error, or stopped), or the timeout expires.
+
+                If there is a framer, this waits for a complete record.
+
+                @param timeout <None/float> - Default None. Max number of seconds to wait, or None to wait forever.
+
+            @return <bool> - True if data is available, otherwise False
+        '''
+        with self._lock:
+            if timeout is not None:
+                endTime = time.time() + timeout
+
+            while not self._hasData():
+                if self.isFinished or self.error is not None or self._stopRequested:
+                    return False
+
+                if timeout is None:
+                    self._lock.wait()
+                else:
+                    remaining = endTime - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._lock.wait(remaining)
+
+            return True
+
+    def iterBlocks(self, timeout=None):
+        '''
+            iterBlocks - Iterate over the blocks as they are read, consuming each one. @see popBlock
+
+                Iteration ends after the stream is finished and all blocks have been consumed (or reading fails or is stopped),
+                  or if no block arrives within #timeout seconds.
+
+                @param timeout <None/float> - Default None. Max number of seconds to wait for each block, or None to wait forever.
+        '''
+        while True:
+            block = self.popBlock()
+            if block is None:
+                if not self.waitForData(timeout):
+                    return
+                continue
+            yield block
+
+    def _hasData(self):
+        '''
+            _hasData - Must hold self._lock. Check if there is a block (or record) available to consume.
+        '''
+        return self._blockIdx < len(self._blockEnds)
+
+    def _readFrom(self, reader, limit):
+        '''
+            _readFrom - Called by the background reader to read the data available on the stream into this object.
+
+                @param reader <NonblockReader> - The reader for the stream
+
+                @param limit <None/int> - Max number of bytes to read. @see _getReadLimit
+
+            @return <bool> - False if the stream has been closed on the other side and all data has been read, otherwise True
+        '''
+        metrics = self.metrics
+        if metrics is None:
+            nextData = reader.read(limit)
+        else:
+            before = time.time()
+            nextData = reader.read(limit)
+            self._recordRead(metrics, before, nextData and len(nextData))
+
+        if nextData is None:
+            return False
+        if nextData:
+            self.addBlock(nextData)
+        return True
+
+    def _recordRead(self, metrics, before, numRead):
+        '''
+            _recordRead - Record the metrics for a read attempt which started at #before, and read #numRead bytes (None if the stream was closed).
+        '''
+        now = time.time()
+        metrics.count('reads')
+        metrics.time('readTime', now - before)
+        if numRead:
+            metrics.count('bytesRead', numRead)
+            metrics.time('dataAge', before - self._lastReadTime)
+        elif numRead is not None:
+            metrics.count('emptyReads')
+        self._lastReadTime = now
+
+    def _checkResume(self):
+        '''
+            _checkResume - Must hold self._lock. Unpause the reader if enough data has been consumed.
+
+            @return <None/function> - A function to call (after releasing the lock) to resume the reader
+        '''
+        if self._isPaused and (self._length - self._start) * 2 <= self.highWaterMark:
+            self._isPaused = False
+            self._lock.notify_all()
+            return self._resumeFunc
+        return None
+
+    def _getReadLimit(self, blockSizeLimit):
+        '''
+            _getReadLimit - Called by the reader before each read, to apply the highWaterMark.
+
+            @return <None/int> - The limit for the next read, or 0 if the reader must pause (in which case #_isPaused is now set)
+        '''
+        highWaterMark = self.highWaterMark
+        if highWaterMark is None:
+            return blockSizeLimit
+
+        with self._lock:
+            room = highWaterMark - (self._length - self._start)
+            if room <= 0:
+                self._isPaused = True
+                if self.metrics is not None:
+                    self.metrics.count('pauses')
+                return 0
+
+        if blockSizeLimit is None or room < blockSizeLimit:
+            return room
+        return blockSizeLimit
+
+    def _waitWhilePaused(self):
+        '''
+            _waitWhilePaused - Called by reader threads to block until resumed, or stop is requested.
+        '''
+        with self._lock:
+            while self._isPaused and not self._stopRequested:
+                self._lock.wait()
+
+    def _finish(self, error=None):
+        '''
+            _finish - Called by the reader when reading has ended. Sets #isFinished, or #error if an error is given, and wakes any waiters.
+        '''
+        with self._lock:
+            if error is not None:
+                self.error = error
+            else:
+                self.isFinished = True
+            self._lock.notify_all()
+
+        if self._onFinish is not None:
+            self._onFinish(self)
+
+
+class BackgroundReadRingBuffer(BackgroundReadData):
+    '''
+        BackgroundReadRingBuffer - A BackgroundReadData for binary streams, backed by a fixed-size ring buffer which is allocated up front.
+
+          Data is read from the stream directly into the ring (with nonblock_readinto), and can be copied out with #popInto,
+          so steady-state reading and consuming allocates nothing.
+
+          When the ring is full, reading pauses until data is consumed, i.e. the capacity is the highWaterMark. @see BackgroundReadData
+
+          Individual blocks are not tracked, "blocks", #popBlock and #iterBlocks treat all the data held as a single block.
+
+          Use bgread(..., ringBufferSize=N) to read into one.
+    '''
+
+    def __init__(self, capacity):
+        '''
+            __init__ - Create a BackgroundReadRingBuffer
+
+                @param capacity <int> - The size of the ring buffer, in bytes
+        '''
+        try:
+            capacity = int(capacity)
+            if capacity <= 0:
+                raise ValueError()
+        except ValueError:
+            raise ValueError('Ring buffer capacity must be a positive integer.')
+
+        BackgroundReadData.__init__(self, bytes, highWaterMark=capacity)
+
+        self.capacity = capacity
+        self._ring = bytearray(capacity)
+        self._ringView = memoryview(self._ring)
+
+    def _getViews(self, start, size):
+        '''
+            _getViews - Get views of the ring covering #size bytes from stream offset #start. There are two views when this wraps around the end.
+        '''
+        if size <= 0:
+            return []
+
+        capacity = self.capacity
+        ringStart = start % capacity
+        firstSize = min(size, capacity - ringStart)
+
+        views = [ self._ringView[ringStart : ringStart + firstSize] ]
+        if firstSize < size:
+            views.append( self._ringView[ : size - firstSize] )
+        return views
+
+    def _hasData(self):
+        return self._length > self._start
+
+    def _readFrom(self, reader, limit):
+        with self._lock:
+            room = self.capacity - (self._length - self._start)
+            if limit is not None and limit < room:
+                room = limit
+            # Only the reader writes into the free space, so the read itself can be done without holding the lock
+            freeViews = self._getViews(self._length, room)
+
+        metrics = self.metrics
+        if metrics is not None:
+            before = time.time()
+
+        bytesRead = 0
+        isOpen = True
+        for view in freeViews:
+            count = reader.readinto(view)
+            if count is None:
+                # Closed. If some data was read, return it now and report closed on the next call.
+                isOpen = bytesRead > 0
+                break
+            bytesRead += count
+            if count and self.teeFile is not None:
+                self._tee(view[:count])
+            if count < len(view):
+                break
+
+        if metrics is not None:
+            self._recordRead(metrics, before, bytesRead if isOpen else None)
+
+        if bytesRead:
+            with self._lock:
+                self._length += bytesRead
+                self._lock.notify_all()
+
+        return isOpen
+
+    def addBlock(self, block):
+        '''
+            addBlock - Copy a block into the ring buffer
+
+            @raises ValueError - If there is not enough room in the ring
+        '''
+        blockLen = len(block)
+        with self._lock:
+            if blockLen > self.capacity - (self._length - self._start):
+                raise ValueError('Not enough room in ring buffer for block of %d bytes.' %(blockLen,))
+
+            offset = 0
+            for view in self._getViews(self._length, blockLen):
+                viewLen = len(view)
+                view[:] = block[offset : offset + viewLen]
+                offset += viewLen
+
+            self._length += blockLen
+            self._lock.notify_all()
+
+    def _getData(self):
+        key = (self._start, self._length)
+        if key != self._dataCacheKey:
+            self._dataCache = b''.join( self._getViews(self._start, self._length - self._start) )
+            self._dataCacheKey = key
+        return self._dataCache
+
+    def getDataView(self):
+        '''
+            getDataView - Get a view of all data currently held. This is zero-copy unless the data wraps around the end of the ring.
+
+                Unlike BackgroundReadData, the view is only valid until data is consumed, after which the ring space may be reused. @see getDataViews
+        '''
+        with self._lock:
+            views = self._getViews(self._start, self._length - self._start)
+            if len(views) == 1:
+                view = views[0]
+            else:
+                view = memoryview(self._getData())
+
+        if _HAS_READONLY_VIEWS:
+            view = view.toreadonly()
+        return view
+
+    def getDataViews(self):
+        '''
+            getDataViews - Get zero-copy views of all data currently held, in order. There are two views when the data wraps around the end of the ring.
+
+                These are only valid until data is consumed, after which the ring space may be reused.
+
+            @return list<memoryview>
+        '''
+        with self._lock:
+            views = self._getViews(self._start, self._length - self._start)
+
+        if _HAS_READONLY_VIEWS:
+            views = [ view.toreadonly() for view in views ]
+        return views
+
+    @property
+    def blocks(self):
+        with self._lock:
+            if self._length == self._start:
+                return []
+            return [ self._getData() ]
+
+    def popInto(self, buffer):
         '''
+            popInto - Consume data, copying it into a caller-provided buffer. Nothing is allocated.
 
-        return self.emptyStr.join(self.blocks)
+                @param buffer <bytearray/memoryview/etc> - A writable buffer. Data is copied in from the beginning, up to its size.
 
+            @return <int> - The number of bytes copied
+        '''
+        target = memoryview(buffer)
+        if target.itemsize != 1 or target.ndim != 1:
+            target = target.cast('B')
+
+        with self._lock:
+            size = min(len(target), self._length - self._start)
+
+            offset = 0
+            for view in self._getViews(self._start, size):
+                viewLen = len(view)
+                target[offset : offset + viewLen] = view
+                offset += viewLen
+
+            self._start += size
+            resumeFunc = self._checkResume()
+
+        if resumeFunc is not None:
+            resumeFunc()
+
+        return size
+
+    def popData(self):
+        with self._lock:
+            data = self._getData()
+            self._start = self._length
+            resumeFunc = self._checkResume()
 
+        if resumeFunc is not None:
+            resumeFunc()
 
+        return data
 
-def _do_bgread(stream, blockSizeLimit, pollTime, closeStream, results):
+    def popBlock(self):
+        with self._lock:
+            if self._length == self._start:
+                return None
+        return self.popData()
+
+
+def _do_bgread(stream, reader, blockSizeLimit, pollTime, closeStream, results, throttle=None):
     '''
         _do_bgread - Worker functon for the background read thread.
 
         @param stream <object> - Stream to read until closed
+        @param reader <NonblockReader> - The reader for #stream
         @param results <BackgroundReadData>
+        @param throttle <None/_ReadThrottle> - Applies the ioPrio, if one was given
     '''
 
     # Put the whole function in a try instead of just the read portion for performance reasons.
     try:
         while True:
-            nextData = nonblock_read(stream, limit=blockSizeLimit)
-            if nextData is None:
-                break
-            elif nextData:
-                results.addBlock(nextData)
+            limit = results._getReadLimit(blockSizeLimit)
+            if limit == 0:
+                results._waitWhilePaused()
+            else:
+                if throttle is None:
+                    if not results._readFrom(reader, limit):
+                        break
+                elif not _throttled_read(results, reader, limit, throttle):
+                    break
+
+                time.sleep(pollTime)
 
-            time.sleep(pollTime)
+            if results._stopRequested is True:
+                return
     except Exception as e:
-        results.error = e
+        results._finish(e)
         return
 
     if closeStream and hasattr(stream, 'close'):
         stream.close()
 
-    results.isFinished = True
+    results._finish()
+
+
+def _do_bgread_events(stream, reader, blockSizeLimit, batchDelay, closeStream, results, wakeRecv, wakeSend, throttle=None):
+    '''
+        _do_bgread_events - Worker function for the background read thread, when eventDriven=True.
+            Blocks until either the stream is readable, or #wakeRecv is written to by BackgroundReadData.stop
+
+        @param stream <object> - Stream to read until closed
+        @param reader <NonblockReader> - The reader for #stream
+        @param batchDelay <None/float> - Batching delay after the stream becomes readable
+        @param results <BackgroundReadData>
+        @param wakeRecv / wakeSend <socket.socket> - The pair used for waking this thread. Both are closed when it finishes.
+        @param throttle <None/_ReadThrottle> - Applies the ioPrio, if one was given
+    '''
+    waitFds = [reader.fd, wakeRecv.fileno()]
+
+    try:
+        while results._stopRequested is False:
+            limit = results._getReadLimit(blockSizeLimit)
+            if limit == 0:
+                results._waitWhilePaused()
+                continue
+
+            if not reader.hasBufferedData():
+                wait_for_fds(waitFds)
+                if results._stopRequested is True:
+                    return
+
+            if batchDelay:
+                time.sleep(batchDelay)
+
+            if throttle is None:
+                if not results._readFrom(reader, limit):
+                    break
+            elif not _throttled_read(results, reader, limit, throttle):
+                break
+        else:
+            return
+
+        if closeStream and hasattr(stream, 'close'):
+            stream.close()
+    except Exception as e:
+        results._finish(e)
+        return
+    finally:
+        results._stopFunc = None
+        wakeRecv.close()
+        wakeSend.close()
+
+    results._finish()
+
+
+def _throttled_read(results, reader, limit, throttle):
+    '''
+        _throttled_read - Read into #results, then sleep as required by #throttle. @see BackgroundReadData._readFrom
+    '''
+    before = time.time()
+    # Data may be consumed concurrently, so count what was read by the change in the end offset
+    startLength = results._length
+
+    isOpen = results._readFrom(reader, limit)
+
+    numRead = results._length - startLength
+    if numRead > 0:
+        throttle.throttle(time.time() - before, numRead)
+
+    return isOpen
+
+
+def _wakeup_socket(wakeSend):
+    '''
+        _wakeup_socket - Wake a thread waiting on the other end of a socket pair
+    '''
+    try:
+        wakeSend.send(b'\0')
+    except (OSError, IOError, socket.error):
+        # Buffer full (already plenty of wakeups pending) or the thread has finished and closed it
+        pass
+
+
+class BackgroundReadReactor(object):
+    '''
+        BackgroundReadReactor - Reads any number of streams in the background from a single thread.
+
+          Rather than a thread per stream polling on an interval, all registered streams are waited upon at once using
+          the "selectors" module (epoll on Linux), so idle streams cost nothing and data is read as soon as it arrives.
+
+          Use #bgread to register a stream, which returns a BackgroundReadData just like the bgread function.
+
+          The thread is started upon the first registration, and runs until #stop is called (or the program exits).
+
+          Streams must be backed by a file descriptor. Regular files, which cannot be waited on, are read until exhausted.
+
+          Requires python 3.4+ (the "selectors" module)
+    '''
+
+    def __init__(self):
+        '''
+            __init__ - Create a BackgroundReadReactor
+
+            @raises NotImplementedError - If the "selectors" module is not available
+        '''
+        if selectors is None:
+            raise NotImplementedError('BackgroundReadReactor requires the "selectors" module (python 3.4+)')
+
+        self._selector = selectors.DefaultSelector()
+
+        # Socket pair used to wake the thread from select when new streams are registered, or on stop
+        (self._wakeRecv, self._wakeSend) = socket.socketpair()
+        self._wakeRecv.setblocking(False)
+        self._wakeSend.setblocking(False)
+        self._selector.register(self._wakeRecv, selectors.EVENT_READ, None)
+
+        # Streams waiting to be registered by the reactor thread ( selectors are not thread-safe )
+        self._pending = deque()
+        self._pendingRemove = deque()
+        self._lock = threading.Lock()
+
+        # Streams which cannot be selected on (i.e. regular files), and are always considered ready
+        self._alwaysReady = {}
+
+        # Streams with data held in their python buffer, which must be read again without waiting on their fd. @see NonblockReader.hasBufferedData
+        self._hasBuffered = {}
+
+        self._thread = None
+        self._keepRunning = True
+
+    def bgread(self, stream, blockSizeLimit=65535, closeStream=True, highWaterMark=None, framer=None, ringBufferSize=None, spillThreshold=None):
+        '''
+            bgread - Register a stream to be read in the background by this reactor.
+
+                @param stream <object> - A stream backed by a file descriptor. Socket, pipe, file, etc.
+
+                @param blockSizeLimit <None/int> - Default 65535. Max number of bytes read from this stream each time it becomes readable,
+                    so a single busy stream cannot starve the others.
+
+                @param closeStream <bool> - Default True. If True, the "close" method on the stream object will be called when the other side has closed and all data has been read.
+
+                @param highWaterMark <None/int> - Default None. If set, the stream stops being read while this much data is held in the returned object. @see bgread function
+
+                @param framer <None/framer> - Default None. If provided, the data is split into records as it is read. @see bgread function
+
+                @param ringBufferSize <None/int> - Default None. If provided, data is read into a fixed-size ring buffer. @see bgread function
+
+                @param spillThreshold <None/int> - Default None. If provided, data held beyond this many bytes is spilled to disk. @see bgread function
+
+            @return <BackgroundReadData> - The object which will be populated with the data read. @see bgread function
+
+            @raises ValueError - If the stream is not readable or not backed by a file descriptor, or the blockSizeLimit or highWaterMark is invalid
+        '''
+        (blockSizeLimit, highWaterMark) = _check_bgread_args(stream, blockSizeLimit, highWaterMark)
+
+        if get_stream_fd(stream) is None:
+            raise ValueError('BackgroundReadReactor can only read streams backed by a file descriptor, %s is not.' %(repr(stream),))
+
+        results = _create_results(stream, highWaterMark, framer, ringBufferSize, spillThreshold)
+
+        self._addStream(stream, results, blockSizeLimit, closeStream)
+
+        return results
+
+    def stop(self):
+        '''
+            stop - Stop the reactor thread. Streams still being read will not be marked finished, nor closed.
+        '''
+        with self._lock:
+            self._keepRunning = False
+            thread = self._thread
+
+        self._wakeup()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _addStream(self, stream, results, blockSizeLimit, closeStream):
+        '''
+            _addStream - Start reading #stream into an already-created #results
+        '''
+        streamData = (NonblockReader(stream, results._forceMode), blockSizeLimit, closeStream, results)
+
+        results._stopFunc = lambda : self._cancel(stream)
+        results._resumeFunc = lambda : self._resume(stream, streamData)
+
+        self._addPending(stream, streamData)
+
+    def _watchFd(self, fd, callback):
+        '''
+            _watchFd - Call #callback (from the reactor thread) once #fd becomes readable. If the fd cannot be waited on, #callback is called right away.
+
+                The callback is responsible for handling its own errors.
+        '''
+        self._addPending(fd, _FdWatch(callback))
+
+    def _addPending(self, fileObj, data):
+        with self._lock:
+            if self._keepRunning is False:
+                raise ValueError('BackgroundReadReactor has been stopped.')
+
+            self._pending.append( (fileObj, data) )
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True # Automatically terminate this thread if program closes
+                self._thread.start()
+
+        self._wakeup()
+
+    def _wakeup(self):
+        _wakeup_socket(self._wakeSend)
+
+    def _cancel(self, stream):
+        '''
+            _cancel - Stop reading the given stream. Called by BackgroundReadData.stop
+        '''
+        with self._lock:
+            self._pendingRemove.append(stream)
+        self._wakeup()
+
+    def _resume(self, stream, streamData):
+        '''
+            _resume - Start reading a stream again, after it was paused for its highWaterMark. Called by BackgroundReadData
+        '''
+        with self._lock:
+            self._pending.append( (stream, streamData) )
+        self._wakeup()
+
+    def _drainWakeup(self):
+        try:
+            while self._wakeRecv.recv(4096):
+                pass
+        except (OSError, IOError, socket.error):
+            pass
+
+    def _registerPending(self):
+        with self._lock:
+            pending = list(self._pending)
+            self._pending.clear()
+            pendingRemove = list(self._pendingRemove)
+            self._pendingRemove.clear()
+
+        for (stream, streamData) in pending:
+            if not isinstance(streamData, _FdWatch) and streamData[0].hasBufferedData():
+                self._hasBuffered[stream] = streamData
+            try:
+                self._selector.register(stream, selectors.EVENT_READ, streamData)
+            except Exception as e:
+                if isinstance(streamData, _FdWatch):
+                    # Cannot wait on it, so let the callback check now.
+                    streamData.run()
+                elif isinstance(e, (OSError, IOError)):
+                    # epoll cannot wait on regular files (EPERM), they are always readable.
+                    self._alwaysReady[stream] = streamData
+                else:
+                    streamData[3]._finish(e)
+
+        for stream in pendingRemove:
+            self._removeStream(stream)
+
+    def _removeStream(self, stream):
+        '''
+            _removeStream - Stop watching #stream. Does nothing if it is not being watched (i.e. already finished, or since closed).
+        '''
+        self._hasBuffered.pop(stream, None)
+        if stream in self._alwaysReady:
+            del self._alwaysReady[stream]
+        else:
+            try:
+                self._selector.unregister(stream)
+            except (KeyError, ValueError, OSError, IOError):
+                pass
+
+    def _serviceStream(self, stream, streamData):
+        '''
+            _serviceStream - Read #stream, finishing its results with the error if anything goes wrong, so one stream cannot stop the reactor thread.
+        '''
+        try:
+            self._readStream(stream, streamData)
+        except Exception as e:
+            self._removeStream(stream)
+            results = streamData[3]
+            if not results.isFinished and results.error is None:
+                results._finish(e)
+
+    def _readStream(self, stream, streamData):
+        (reader, blockSizeLimit, closeStream, results) = streamData
+        if results._stopRequested is True:
+            # Stop was requested, but the removal has not yet been processed
+            return
+
+        limit = results._getReadLimit(blockSizeLimit)
+        if limit == 0:
+            # Paused for the highWaterMark. results will call _resume once enough data is consumed.
+            self._removeStream(stream)
+            return
+
+        try:
+            isOpen = results._readFrom(reader, limit)
+        except Exception as e:
+            self._removeStream(stream)
+            results._finish(e)
+            return
+
+        if not isOpen:
+            self._removeStream(stream)
+            try:
+                if closeStream and hasattr(stream, 'close'):
+                    stream.close()
+            except Exception as e:
+                results._finish(e)
+                return
+            results._finish()
+        elif reader.hasBufferedData():
+            self._hasBuffered[stream] = streamData
+
+    def _run(self):
+        '''
+            _run - The reactor thread
+        '''
+        selector = self._selector
+        alwaysReady = self._alwaysReady
+        hasBuffered = self._hasBuffered
+
+        self._registerPending()
+
+        while self._keepRunning is True:
+            if alwaysReady or hasBuffered:
+                events = selector.select(0)
+            else:
+                events = selector.select()
+
+            if hasBuffered:
+                # Read these whether or not their fd is readable. Each is added back by _readStream while data is still buffered.
+                buffered = list(hasBuffered.items())
+                hasBuffered.clear()
+                for (stream, streamData) in buffered:
+                    self._serviceStream(stream, streamData)
+
+            for (key, mask) in events:
+                data = key.data
+                if data is None:
+                    self._drainWakeup()
+                    self._registerPending()
+                elif isinstance(data, _FdWatch):
+                    self._removeStream(key.fileobj)
+                    data.run()
+                else:
+                    self._serviceStream(key.fileobj, data)
+
+            for (stream, streamData) in list(alwaysReady.items()):
+                self._serviceStream(stream, streamData)
+
+        selector.close()
+        self._wakeRecv.close()
+        self._wakeSend.close()
+
+
+class _FdWatch(object):
+    '''
+        _FdWatch - A one-shot callback registered with BackgroundReadReactor._watchFd
+    '''
+
+    __slots__ = ('callback', )
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def run(self):
+        try:
+            self.callback()
+        except Exception:
+            # Callbacks handle their own errors, this just protects the reactor thread.
+            pass
+
+
+_defaultReactor = None
+_defaultReactorLock = threading.Lock()
+
+def get_default_reactor():
+    '''
+        get_default_reactor - Get the shared BackgroundReadReactor, used by bgread(..., reactor=True). It is created upon first call.
+
+        @return <BackgroundReadReactor>
+    '''
+    global _defaultReactor
+
+    with _defaultReactorLock:
+        if _defaultReactor is None:
+            _defaultReactor = BackgroundReadReactor()
+        return _defaultReactor
@@ -7,11 +7,19 @@
 '''
 # vim: ts=4 sw=4 expandtab
 
+import errno
+import heapq
+import io
+import os
 import threading
 import time
 
 from collections import deque
 
+from .common import get_stream_fd, get_raw_stream_fd, is_fd_nonblocking, wait_for_fds
+
+from .metrics import get_metrics_registry
+
 # TODO: I'd like to maybe remove defaultChunkSize from BACKGROUND_IO_PRIO and instead keep it strictly priority,
 #  and forcing chunk size to be specified every time (basically, making "bgwrite_chunk" the prototype ).
 #
@@ -20,7 +28,25 @@ from collections import deque
 #    much less meaning.
 
 
-__all__ = ('BackgroundWriteProcess', 'BackgroundIOPriority', 'bgwrite', 'bgwrite_chunk', 'chunk_data')
+__all__ = ('BackgroundWriteProcess', 'BackgroundWriteScheduler', 'BackgroundWriter', 'BackgroundIOBudget', 'BackgroundIOPriority', 'DataChunks', 'bgwrite', 'bgwrite_chunk', 'chunk_data', 'get_default_scheduler', 'get_io_budget', 'set_io_budget', 'wait_all')
+
+# The max number of buffers for a single os.writev
+try:
+    _IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    _IOV_MAX = -1
+if _IOV_MAX <= 0:
+    _IOV_MAX = 1024
+
+_TEXT_TYPE = type(u'')
+
+# Default targetChunkLatency, and the bounds of the chunk size, for writes with adaptiveChunkSize
+_DEFAULT_TARGET_CHUNK_LATENCY = .05
+_MIN_CHUNK_SIZE = 4096
+_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Errnos which mean "can't complete right now" on a non-blocking fd
+_WOULD_BLOCK_ERRNOS = (errno.EAGAIN, errno.EWOULDBLOCK)
 
 # Uncomment the "DEBUG" sections you want to see below. Search for DEBUG.
 #DEBUG = False
@@ -28,13 +54,16 @@ __all__ = ('BackgroundWriteProcess', 'BackgroundIOPriority', 'bgwrite', 'bgwrite
 #    import sys
 
 
-def bgwrite(fileObj, data, closeWhenFinished=False, chainAfter=None, ioPrio=4):
+def bgwrite(fileObj, data, closeWhenFinished=False, chainAfter=None, ioPrio=4, scheduler=None, batchSize=None, adaptiveChunkSize=False):
     '''
         bgwrite - Start a background writing process
 
-            @param fileObj <stream> - A stream backed by an fd
+            @param fileObj <stream> - A stream backed by an fd. Non-blocking streams (e.x. sockets or pipes set non-blocking) are supported: after a partial write the rest
+               is written from where it stopped, waiting (with poll/select) for the stream to be writable instead of spinning. Sockets may be given directly, and are written with "send".
 
-            @param data    <str/bytes/list> - The data to write. If a list is given, each successive element will be written to the fileObj and flushed. If a string/bytes is provided, it will be chunked according to the #BackgroundIOPriority chosen. If you would like a different chunking than the chosen ioPrio provides, use #bgwrite_chunk function instead.
+            @param data    <str/bytes/list/DataChunks> - The data to write. If a list is given, each successive element will be written to the fileObj and flushed. If a string/bytes is provided, it will be chunked according to the #BackgroundIOPriority chosen. If you would like a different chunking than the chosen ioPrio provides, use #bgwrite_chunk function instead.
+
+               Chunks are sliced lazily as they are written ( @see DataChunks ), binary data as memoryviews, so the data is never copied. Do not modify the data until writing has finished.
 
                Chunking makes the data available quicker on the other side, reduces iowait on this side, and thus increases interactivity (at penalty of throughput).
 
@@ -43,16 +72,31 @@ def bgwrite(fileObj, data, closeWhenFinished=False, chainAfter=None, ioPrio=4):
             @param chainAfter  <None/BackgroundWriteProcess> - If a BackgroundWriteProcess object is provided (the return of bgwrite* functions), this data will be held for writing until the data associated with the provided object has completed writing.
             Use this to queue several background writes, but retain order within the resulting stream.
 
+            @param scheduler <None/bool/BackgroundWriteScheduler> - Default None. If None or False, a new thread is started for this write.
+
+                If True, the write is instead queued on the shared BackgroundWriteScheduler ( @see get_default_scheduler ), whose pool of worker
+                threads serves writes in priority order. You may also pass your own BackgroundWriteScheduler.
+
+            @param batchSize <None/int> - Default None. If provided, blocks are gathered into batches of up to this many bytes, each written with a single os.writev
+                and flushed once. Use this for a list of many small blocks. @see BackgroundWriteProcess.__init__
+
+            @param adaptiveChunkSize <bool> - Default False. If True and a str/bytes is given, the chunk size is tuned as it is written, toward the ioPrio's targetChunkLatency
+                per chunk, instead of staying at its defaultChunkSize. @see BackgroundWriteProcess.__init__
+
 
             @return - BackgroundWriteProcess - An object representing the state of this operation. @see BackgroundWriteProcess
     '''
+    if scheduler:
+        if scheduler is True:
+            scheduler = get_default_scheduler()
+        return scheduler.bgwrite(fileObj, data, closeWhenFinished, chainAfter, ioPrio, batchSize, adaptiveChunkSize)
 
-    thread = BackgroundWriteProcess(fileObj, data, closeWhenFinished, chainAfter, ioPrio)
+    thread = BackgroundWriteProcess(fileObj, data, closeWhenFinished, chainAfter, ioPrio, batchSize, adaptiveChunkSize)
     thread.start()
 
     return thread
 
-def bgwrite_chunk(fileObj, data, chunkSize, closeWhenFinished=False, chainAfter=None, ioPrio=4):
+def bgwrite_chunk(fileObj, data, chunkSize, closeWhenFinished=False, chainAfter=None, ioPrio=4, scheduler=None, batchSize=None):
     '''
         bgwrite_chunk - Chunk up the data into even #chunkSize blocks, and then pass it onto #bgwrite.
             Use this to break up a block of data into smaller segments that can be written and flushed.
@@ -62,13 +106,57 @@ def bgwrite_chunk(fileObj, data, chunkSize, closeWhenFinished=False, chainAfter=
 
             @see bgwrite
 
-        @param data <string/bytes> - The data to chunk up
+        @param data <string/bytes> - The data to chunk up. This is not copied, chunks are sliced as they are written. @see DataChunks
 
         @param chunkSize <integer> - The max siZe of each chunk.
     '''
-    chunks = chunk_data(data, chunkSize)
+    chunks = DataChunks(data, chunkSize)
+
+    return bgwrite(fileObj, chunks, closeWhenFinished, chainAfter, ioPrio, scheduler, batchSize)
+
+
+class _TokenBucket(object):
+    '''
+        _TokenBucket - Tokens (bytes) shared by every write drawing from it, for a rate limit. Thread-safe.
+
+          The rate and size are given with each draw, so changes to the limit apply right away.
+    '''
+
+    __slots__ = ('tokens', 'lastRefill', '_lock')
 
-    return bgwrite(fileObj, chunks, closeWhenFinished, chainAfter, ioPrio)
+    def __init__(self):
+        # Tokens available as of #lastRefill. Negative is a debt, to be slept off by the writes which drew it. None until the first draw, which starts full.
+        self.tokens = None
+        self.lastRefill = time.time()
+        self._lock = threading.Lock()
+
+    def take(self, numBytes, bytesPerSec, burstSize):
+        '''
+            take - Refill for the time since the last draw, then take #numBytes tokens
+
+                @param numBytes <int> - The number of bytes written
+
+                @param bytesPerSec <float> - The rate tokens refill
+
+                @param burstSize <int> - The max number of tokens held
+
+            @return <float> - The number of tokens owed after taking, or 0 if there is no debt
+        '''
+        with self._lock:
+            now = time.time()
+            tokens = self.tokens
+            if tokens is None:
+                tokens = burstSize
+            else:
+                tokens = min(tokens + (now - self.lastRefill) * bytesPerSec, burstSize)
+
+            tokens -= numBytes
+            self.tokens = tokens
+            self.lastRefill = now
+
+        if tokens < 0:
+            return -tokens
+        return 0
 
 
 class BackgroundIOPriority(object):
@@ -78,17 +166,19 @@ class BackgroundIOPriority(object):
             See __init__ for fields
     '''
 
-    __slots__ = ('chainPollTime', 'defaultChunkSize', 'bandwidthPct', 'numChunksRateSmoothing')
+    _FIELDS = ('chainPollTime', 'defaultChunkSize', 'bandwidthPct', 'numChunksRateSmoothing', 'maxBytesPerSec', 'burstSize', 'targetChunkLatency')
 
-    def __init__(self, chainPollTime, defaultChunkSize, bandwidthPct, numChunksRateSmoothing=5):
+    __slots__ = _FIELDS + ('_tokenBucket', )
+
+    def __init__(self, chainPollTime, defaultChunkSize, bandwidthPct, numChunksRateSmoothing=5, maxBytesPerSec=None, burstSize=None, targetChunkLatency=None):
         '''
             __init__ - Create a BackgroundIOPriority.
 
             Some terms: throughput - Bandwidth out (Megs per second)
                         interactivity - CPU time available for other tasks (calculations, other I/O, etc)
 
-            @param chainPollTime - float > 0, When chaining, this is the sleep time between checking if prior is finished.
-                Too low and the polling takes up CPU time, too high and you'll lose a little time in between chained writes, while gaining interactivity elsewhere.
+            @param chainPollTime - float > 0, No longer used. Chained writes now start as soon as the prior write completes, without polling.
+                Kept for compatibility.
 
             @param defaultChunkSize - integer > 0, When providing a straight string/bytes to bgwrite (instead of chunking yourself, or using bgwrite_chunk) this will
                 be used as the max size of each chunk. Each chunk is written and a flush is issued (if the stream supports it).
@@ -111,6 +201,22 @@ class BackgroundIOPriority(object):
               Also, consider that this is related to the #defaultChunkSize, as it is not a constant period of time. The default of "5" should be okay,
               but you may want to tune it if you use really large or really small chunk sizes.
 
+            @param maxBytesPerSec - None or number > 0, Default None. If provided, an absolute limit on the write rate in bytes per second, regardless of how fast
+              the device is, applied with a token bucket: each chunk written takes its size in tokens, which refill at this rate, and once they run out the write
+              sleeps after each chunk until the debt is repaid. So the rate holds however the data is chunked.
+
+              The bucket belongs to this profile, so the limit is on the total of all writes using it at once (and one after another), not on each write.
+              For example, ten concurrent bgwrite calls with ioPrio=BG_IO_PRIOS[4] share that profile's limit. Use a separate BackgroundIOPriority for a separate limit.
+
+              This works alongside #bandwidthPct (after each chunk, the longer of the two sleeps is taken), or instead of it, with a bandwidthPct of 100.
+
+            @param burstSize - None or integer > 0, Default None. With #maxBytesPerSec , the max number of tokens (bytes) which may build up while the profile is idle,
+              and so be written at full speed before the limit applies. If None, #defaultChunkSize is used.
+
+            @param targetChunkLatency - None or float > 0, Default None. For writes with adaptiveChunkSize, the time in seconds each chunk should take to write and flush.
+              The chunk size starts at #defaultChunkSize, and is grown or shrunk as writing goes toward the size which takes this long, given the measured rate.
+              Lower means more interactivity, higher means more throughput. If None, .05 seconds is used. @see BackgroundWriteProcess.__init__
+
 
             An "interactivity score" is defined to be (number of calculations) / (time to write data).
         '''
@@ -124,13 +230,28 @@ class BackgroundIOPriority(object):
 
         self.numChunksRateSmoothing = numChunksRateSmoothing
 
+        if maxBytesPerSec is not None and maxBytesPerSec <= 0:
+            raise ValueError('Given maxBytesPerSec %s must be None or > 0' %(str(maxBytesPerSec),))
+        self.maxBytesPerSec = maxBytesPerSec
+
+        if burstSize is not None and burstSize <= 0:
+            raise ValueError('Given burstSize %s must be None or > 0' %(str(burstSize),))
+        self.burstSize = burstSize
+
+        if targetChunkLatency is not None and targetChunkLatency <= 0:
+            raise ValueError('Given targetChunkLatency %s must be None or > 0' %(str(targetChunkLatency),))
+        self.targetChunkLatency = targetChunkLatency
+
+        # Shared by every write using this profile, for #maxBytesPerSec
+        self._tokenBucket = _TokenBucket()
+
     def __getitem__(self, key):
-        if key in BackgroundIOPriority.__slots__:
+        if key in BackgroundIOPriority._FIELDS:
             return getattr(self, key)
         raise KeyError('Unknown key: %s\n' %(key,))
 
     def __setitem__(self, key, value):
-        if key in BackgroundIOPriority.__slots__:
+        if key in BackgroundIOPriority._FIELDS:
             return setattr(self, key, value)
         raise KeyError('Unknown key: %s\n' %(key,))
 
@@ -139,40 +260,64 @@ _SIZE_MEG = 1024 * 1024
 
 # BG_IO_PRIOS - Predefined I/O priorities, 1-10. The lower the number, the more throughput at the cost of interactivity
 BG_IO_PRIOS = {
-    1  : BackgroundIOPriority(.0009, _SIZE_MEG * 5,    100), # Maximum throughput, no regard for interactivity.
-    2  : BackgroundIOPriority(.0009, _SIZE_MEG * 4,     90),
-    3  : BackgroundIOPriority(.0015, _SIZE_MEG * 3,     78),
-    4  : BackgroundIOPriority(.0015, _SIZE_MEG * 2,     72),
-    5  : BackgroundIOPriority(.0019, _SIZE_MEG * 1.6,   65),
-    6  : BackgroundIOPriority(.0019, _SIZE_MEG * .75,   55),
-    7  : BackgroundIOPriority(.0024, _SIZE_MEG * .69,   45),
-    8  : BackgroundIOPriority(.0024, _SIZE_MEG * .5,    35),
-    9  : BackgroundIOPriority(.0031, _SIZE_MEG * .3,    30),
-    10 : BackgroundIOPriority(.0100, _SIZE_MEG * .25,   20), # Least throughput, most interactivity, very little throughput
+    1  : BackgroundIOPriority(.0009, _SIZE_MEG * 5,    100, targetChunkLatency=.1), # Maximum throughput, no regard for interactivity.
+    2  : BackgroundIOPriority(.0009, _SIZE_MEG * 4,     90, targetChunkLatency=.08),
+    3  : BackgroundIOPriority(.0015, _SIZE_MEG * 3,     78, targetChunkLatency=.06),
+    4  : BackgroundIOPriority(.0015, _SIZE_MEG * 2,     72, targetChunkLatency=.05),
+    5  : BackgroundIOPriority(.0019, _SIZE_MEG * 1.6,   65, targetChunkLatency=.04),
+    6  : BackgroundIOPriority(.0019, _SIZE_MEG * .75,   55, targetChunkLatency=.03),
+    7  : BackgroundIOPriority(.0024, _SIZE_MEG * .69,   45, targetChunkLatency=.025),
+    8  : BackgroundIOPriority(.0024, _SIZE_MEG * .5,    35, targetChunkLatency=.02),
+    9  : BackgroundIOPriority(.0031, _SIZE_MEG * .3,    30, targetChunkLatency=.015),
+    10 : BackgroundIOPriority(.0100, _SIZE_MEG * .25,   20, targetChunkLatency=.01), # Least throughput, most interactivity, very little throughput
 }
 
 
+def _get_io_priority(ioPrio):
+    '''
+        _get_io_priority - Get the BackgroundIOPriority for an "ioPrio" argument
+
+        @raises ValueError - If ioPrio is neither a BackgroundIOPriority nor integer 1-10 inclusive
+    '''
+    if isinstance(ioPrio, BackgroundIOPriority):
+        return ioPrio
+    try:
+        return BG_IO_PRIOS[ioPrio]
+    except KeyError:
+        raise ValueError('Invalid ioPrio: %s. Available priority levels are: %s' %(str(ioPrio), str(list(BG_IO_PRIOS.keys()))) )
+
+
 class BackgroundWriteProcess(threading.Thread):
     '''
         BackgroundWriteProcess - A thread and data store representing a background write task. You should probably use one of the bgwrite* methods and not this directly.
 
         Attributes:
 
-            remainingData  <deque> - A queue representing the data yet to be written
+            remainingData  <deque/DataChunks> - A queue representing the data yet to be written
 
             startedWriting <bool>  - Starts False, changes to True when writing has started (thread has started and any pending prior chain has completed)
 
             finished    <bool>   - Starts False, changes to True after writing has completed, and if closeWhenFinished is True the handle is also closed.
+
+            error       <None/Exception> - Starts None, and is set to any exception raised while writing (a thread started by bgwrite also raises it as before),
+                                           or if the write this was chained after failed (in which case nothing is written). finished remains False.
+
+            metrics  <None/IOMetrics> - None, or the metrics for this write if metrics were enabled when it was created. @see nonblock.metrics
+                Counters: "writes" (chunks written), "flushes", and "bytesWritten".
+                Timing histograms: "writeTime" (write and flush of each chunk), "waitTime" (waiting on a non-blocking stream), "sleepTime" (each sleep to throttle bandwidth),
+                and "chainWaitTime" (waiting on chainAfter).
+
+        Use #wait (or wait_all for several) to block until a write has completed.
     '''
 # Design question: What about errors?
 
-    def __init__(self, fileObj, dataBlocks, closeWhenFinished=False, chainAfter=None, ioPrio=4):
+    def __init__(self, fileObj, dataBlocks, closeWhenFinished=False, chainAfter=None, ioPrio=4, batchSize=None, adaptiveChunkSize=False):
         '''
             __init__ - Create the BackgroundWriteProcess thread. You should probably use bgwrite or bgwrite_chunk instead of calling this directly.
 
             @param fileObj <stream> - A stream, like a file, to write into. Hopefully it supports flushing, but it is not a requirement.
 
-            @param dataBlocks <bytes/str/list<bytes/str>> - If a list of bytes/str, those are treated as the data blocks, written in order with heuristics for interactivity in between blocks.  If bytes/str are provided not in a list form, they will be split based on the rules of the associated #ioPrio
+            @param dataBlocks <bytes/str/list<bytes/str>/DataChunks> - If a list of bytes/str, those are treated as the data blocks, written in order with heuristics for interactivity in between blocks.  If bytes/str are provided not in a list form, they will be split (lazily, @see DataChunks) based on the rules of the associated #ioPrio
 
             @param closeWhenFinished <bool> - Default False. If True, the fileObj will be closed after writing has completed.
 
@@ -180,24 +325,33 @@ class BackgroundWriteProcess(threading.Thread):
 
             @param ioPrio <int/BackgroundIOPriority> - If an integer (1-10), a predefined BackgroundIOPriority will be used. 1 is highest throughput, 10 is most interactivity. You can also pass in your own BackgroundIOPriority object if you want to define a custom profile.
 
+            @param batchSize <None/int> - Default None. If provided, consecutive data blocks are gathered into batches of up to this many bytes,
+                each written with a single os.writev to the fd of fileObj, and flushed once per batch. Each batch counts as one chunk for the #ioPrio throttling.
+                Use this when writing many small blocks (e.x. a list of records), so they take a handful of system calls instead of several each.
+                A block larger than batchSize is written alone. If fileObj is not a raw file or socket (or a BufferedWriter directly over one), e.x. a gzip.GzipFile,
+                or os.writev is unavailable, blocks are written one at a time with fileObj.write as usual. @see nonblock.common.get_raw_stream_fd
+
+            @param adaptiveChunkSize <bool> - Default False. If True, and the data is a str/bytes (or DataChunks) rather than a list of blocks, the write and flush time of each chunk is measured,
+                and the chunk size is grown or shrunk toward the size which takes the #ioPrio 's targetChunkLatency, starting from its defaultChunkSize.
+                So throughput stays near the best the destination allows, while the time spent in each write (and so interactivity) stays bounded, without hand-tuning chunk sizes.
+                Time spent waiting on a non-blocking stream is not counted.
+
 
             @raises ValueError - If ioPrio is neither a BackgroundIOPriority nor integer 1-10 inclusive
                                - If chainAfter is not a BackgroundWriteProcess or None
+                               - If batchSize is not > 0
         '''
         threading.Thread.__init__(self)
         self.fileObj = fileObj
 
-        if isinstance(ioPrio, BackgroundIOPriority):
-            self.backgroundIOPriority = ioPrio
-        else:
-            try:
-                self.backgroundIOPriority = BG_IO_PRIOS[ioPrio]
-            except KeyError:
-                raise ValueError('Invalid ioPrio: %s. Available priority levels are: %s' %(str(ioPrio), str(list(BG_IO_PRIOS.keys()))) )
+        self.backgroundIOPriority = _get_io_priority(ioPrio)
 
-        if type(dataBlocks) not in (list, tuple):
-            dataBlocks = chunk_data(dataBlocks, self.backgroundIOPriority.defaultChunkSize)
-        self.remainingData = deque(dataBlocks)
+        if isinstance(dataBlocks, DataChunks):
+            self.remainingData = dataBlocks
+        elif type(dataBlocks) in (list, tuple):
+            self.remainingData = deque(dataBlocks)
+        else:
+            self.remainingData = DataChunks(dataBlocks, self.backgroundIOPriority.defaultChunkSize)
 
         self.closeWhenFinished = closeWhenFinished
 
@@ -206,140 +360,1235 @@ class BackgroundWriteProcess(threading.Thread):
 
         self.chainAfter = chainAfter
 
+        if batchSize is not None:
+            batchSize = int(batchSize)
+            if batchSize <= 0:
+                raise ValueError('batchSize must be > 0')
+        self.batchSize = batchSize
+        self.adaptiveChunkSize = adaptiveChunkSize
+
         self.startedWriting = False
         self.finished = False
+        self.error = None
 
+        self._initCompletion()
 
-    def run(self):
+        self.metrics = get_metrics_registry().create('bgwrite')
+
+    def _initCompletion(self):
         '''
-            run - Starts the thread. bgwrite and bgwrite_chunk automatically start the thread.
+            _initCompletion - Create the event set once this write has completed (finished or failed), and the callbacks to call then.
+        '''
+        self._completed = threading.Event()
+        self._completedLock = threading.Lock()
+        self._completedCallbacks = []
+
+    def wait(self, timeout=None):
+        '''
+            wait - Block until this write has completed, or the timeout expires.
+
+                @param timeout <None/float> - Default None. Max number of seconds to wait, or None to wait forever.
+
+            @return <bool> - True if the write has completed. Check #finished and #error for whether it succeeded.
         '''
+        return bool(self._completed.wait(timeout))
 
-        # If we are chaining after another process, wait for it to complete.
-        #   We use a flag here instead of joining the thread for various reasons
+    def _whenCompleted(self, callback):
+        '''
+            _whenCompleted - Call #callback with this object once this write has completed, immediately if it already has.
+        '''
+        with self._completedLock:
+            if not self._completed.is_set():
+                self._completedCallbacks.append(callback)
+                return
+        callback(self)
+
+    def _setCompleted(self):
+        '''
+            _setCompleted - Called once writing has ended (finished or error). Wakes anything waiting on, or chained after, this write.
+        '''
+        with self._completedLock:
+            self._completed.set()
+            callbacks = self._completedCallbacks
+            self._completedCallbacks = []
+
+        for callback in callbacks:
+            callback(self)
+
+    def _waitForChain(self):
+        '''
+            _waitForChain - If we are chaining after another process, wait for it to complete.
+
+            @return <bool> - False if the prior write failed, in which case #error is set and this data must not be written
+        '''
         chainAfter = self.chainAfter
-        if chainAfter is not None:
-            chainPollTime = self.backgroundIOPriority.chainPollTime
-            while chainAfter.finished is False:
-                time.sleep(chainPollTime)
+        if chainAfter is None:
+            return True
+
+        metrics = self.metrics
+        if metrics is not None:
+            chainBefore = time.time()
+
+        chainAfter._completed.wait()
 
+        if metrics is not None:
+            metrics.time('chainWaitTime', time.time() - chainBefore)
+
+        if chainAfter.finished is False:
+            self.error = IOError('Not written, as the write this was chained after failed: %s' %(str(chainAfter.error),))
+            return False
+        return True
+
+    def run(self):
+        '''
+            run - Starts the thread. bgwrite and bgwrite_chunk automatically start the thread.
+        '''
+        try:
+            if self._waitForChain() is True:
+                self._write()
+        except Exception as e:
+            self.error = e
+            raise
+        finally:
+            self._setCompleted()
+
+    def _write(self):
+        '''
+            _write - Write all the remaining data, applying the priority
+        '''
+        metrics = self.metrics
 
         # Pull class data into locals
         fileObj = self.fileObj
-        bandwidthPct = self.backgroundIOPriority.bandwidthPct
-        bandwidthPctDec = bandwidthPct / 100.0
-
+        remainingData = self.remainingData
 
-        # Number of blocks, total (note: unused, removed)
-        #numBlocks = len(self.remainingData)
-        # Bytes written
-        dataWritten = 0
+        # Used to wait for the stream to be writable, if it is non-blocking (e.x. a socket or pipe)
+        fileFd = get_stream_fd(fileObj)
 
         # Mark that we have started writing data
         self.startedWriting = True
 
-        # Create a conditional lambda for flushing. I'd rather just only support flushable streams, but
-        #   some unfortunatly just aren't. This should be cheaper than testing with hasattr at each iteration
-        if hasattr(fileObj, 'flush'):
-            doFlush = lambda obj : obj.flush()
+        # I'd rather just only support flushable streams, but some unfortunatly just aren't.
+        canFlush = hasattr(fileObj, 'flush')
+
+        # Sleeps after each chunk to maintain the bandwidthPct
+        throttle = _ChunkThrottle(self.backgroundIOPriority, metrics)
+
+        # If adaptive, the chunks are sliced as they are written, so changing the chunk size applies from the next chunk
+        tuner = None
+        if self.adaptiveChunkSize is True and isinstance(remainingData, DataChunks):
+            tuner = _ChunkSizeTuner(self.backgroundIOPriority, remainingData.chunkSize)
+
+        try:
+            # If batching, the fd to writev to. Anything python has buffered for the stream must be written first.
+            writevFd = None
+            if self.batchSize is not None and hasattr(os, 'writev'):
+                writevFd = get_raw_stream_fd(fileObj)
+            if writevFd is not None:
+                if canFlush:
+                    _flush_all(fileObj, fileFd, throttle)
+
+            while len(remainingData) > 0:
+
+                # pop, write, flush
+                nextData = remainingData.popleft()
+                if metrics is not None or tuner is not None:
+                    writeBefore = time.time()
+                    idleBefore = throttle.timeIdle
+
+                if writevFd is not None and not isinstance(nextData, _TEXT_TYPE):
+                    # Gather following blocks into a single writev, which counts as a single chunk below
+                    blocks = _take_batch(remainingData, nextData, self.batchSize)
+                    nextDataLen = _writev_all(writevFd, blocks, throttle)
+                else:
+                    _write_all(fileObj, fileFd, nextData, throttle)
+                    nextDataLen = len(nextData)
+
+                if canFlush:
+                    _flush_all(fileObj, fileFd, throttle)
+
+                if metrics is not None:
+                    metrics.time('writeTime', time.time() - writeBefore)
+                    metrics.count('writes')
+                    metrics.count('bytesWritten', nextDataLen)
+                    if canFlush:
+                        metrics.count('flushes')
+
+                if tuner is not None:
+                    remainingData.chunkSize = tuner.update(nextDataLen, time.time() - writeBefore - (throttle.timeIdle - idleBefore))
+
+                throttle.afterChunk(nextDataLen)
+        finally:
+            throttle.stop()
+
+        if self.closeWhenFinished is True:
+            fileObj.close()
+
+        self.finished = True
+
+
+class BackgroundWriteScheduler(object):
+    '''
+        BackgroundWriteScheduler - Runs background writes on a fixed pool of worker threads, instead of starting a thread for each write.
+
+            Queued writes are served in priority order, highest bandwidthPct first (i.e. ioPrio 1 before ioPrio 10, @see BG_IO_PRIOS),
+            and in the order queued within a priority. Writes to the same file object are always written one at a time, in the order queued,
+            regardless of priority.
+
+            A write with a chainAfter is held, without taking a worker, until the write it is chained after has completed.
+
+            Use #bgwrite, or bgwrite(..., scheduler=True) for the shared scheduler. Either returns a BackgroundWriteProcess as usual,
+            which is not itself a running thread (do not start or join it).
+
+            Worker threads are started as needed, and do not keep the program running. Use #waitUntilIdle before exiting to ensure queued writes complete.
+    '''
+
+    def __init__(self, numWorkers=4):
+        '''
+            __init__ - Create a BackgroundWriteScheduler
+
+                @param numWorkers <int> - Default 4. Max number of writes performed at once.
+        '''
+        numWorkers = int(numWorkers)
+        if numWorkers < 1:
+            raise ValueError('numWorkers must be >= 1')
+        self.numWorkers = numWorkers
+
+        # Guards everything below, and is notified when a write is queued or finishes
+        self._lock = threading.Condition()
+
+        # Heap of ( -bandwidthPct, sequence, BackgroundWriteProcess ) ready to write
+        self._ready = []
+        self._sequence = 0
+
+        # id(fileObj) -> deque of writes queued behind the one ready or writing for that file. Present while a write for the file is scheduled.
+        self._fileQueues = {}
+
+        # Writes held until their chainAfter has completed
+        self._held = set()
+
+        self._workers = []
+        self._numIdle = 0
+        self._isStopped = False
+
+    def bgwrite(self, fileObj, data, closeWhenFinished=False, chainAfter=None, ioPrio=4, batchSize=None, adaptiveChunkSize=False):
+        '''
+            bgwrite - Queue a background write on this scheduler. @see bgwrite function for the parameters
+
+            @return <BackgroundWriteProcess> - The write
+        '''
+        job = BackgroundWriteProcess(fileObj, data, closeWhenFinished, chainAfter, ioPrio, batchSize, adaptiveChunkSize)
+        self.submit(job)
+        return job
+
+    def submit(self, job):
+        '''
+            submit - Queue a BackgroundWriteProcess (or BackgroundCopyProcess) which has not been started
+
+                @param job <BackgroundWriteProcess> - The write
+        '''
+        fileKey = id(job.fileObj)
+
+        with self._lock:
+            if self._isStopped:
+                raise ValueError('Cannot queue a write on a stopped BackgroundWriteScheduler')
+
+            fileQueue = self._fileQueues.get(fileKey, None)
+            if fileQueue is not None:
+                # Another write for this file is ahead, keep the order
+                fileQueue.append(job)
+            else:
+                self._fileQueues[fileKey] = deque()
+                self._schedule(job)
+
+            if self._numIdle == 0 and len(self._workers) < self.numWorkers:
+                worker = threading.Thread(target=self._runWorker)
+                worker.daemon = True
+                self._workers.append(worker)
+                worker.start()
+            else:
+                # waitUntilIdle shares this condition, so wake everyone to be sure an idle worker is among them
+                self._lock.notify_all()
+
+    def waitUntilIdle(self, timeout=None):
+        '''
+            waitUntilIdle - Block until all queued writes have finished (or failed), or the timeout expires.
+
+                @param timeout <None/float> - Default None. Max number of seconds to wait, or None to wait forever.
+
+            @return <bool> - True if all writes have finished
+        '''
+        with self._lock:
+            if timeout is not None:
+                endTime = time.time() + timeout
+
+            while self._fileQueues:
+                if timeout is None:
+                    self._lock.wait()
+                else:
+                    remaining = endTime - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._lock.wait(remaining)
+
+            return True
+
+    def stop(self):
+        '''
+            stop - Stop the worker threads after the writes in progress.
+
+              Writes still queued are never written. Each is completed with #error set, so anything waiting on (or chained after) them is released.
+        '''
+        with self._lock:
+            self._isStopped = True
+
+            notWritten = []
+            for fileQueue in self._fileQueues.values():
+                notWritten += list(fileQueue)
+                fileQueue.clear()
+
+            notScheduled = [ entry[2] for entry in self._ready ] + list(self._held)
+            self._ready = []
+            self._held.clear()
+
+            # Only the writes in progress remain scheduled, and remove their file once done
+            for job in notScheduled:
+                del self._fileQueues[id(job.fileObj)]
+            notWritten += notScheduled
+
+            self._lock.notify_all()
+
+        for job in notWritten:
+            job.error = IOError('Not written, as the BackgroundWriteScheduler was stopped')
+            job._setCompleted()
+
+    def _schedule(self, job):
+        '''
+            _schedule - Must hold self._lock. Make #job ready to write, or hold it until its chainAfter has completed.
+        '''
+        chainAfter = job.chainAfter
+        if chainAfter is not None and not chainAfter._completed.is_set():
+            self._held.add(job)
+            chainAfter._whenCompleted(lambda chainAfter : self._chainCompleted(job))
         else:
-            doFlush = lambda obj : 1
+            self._sequence += 1
+            heapq.heappush(self._ready, ( -job.backgroundIOPriority.bandwidthPct, self._sequence, job ) )
+
+    def _chainCompleted(self, job):
+        '''
+            _chainCompleted - Called when the write #job is chained after has completed, to make #job ready.
+        '''
+        with self._lock:
+            if job not in self._held:
+                # Already completed by stop
+                return
+            self._held.discard(job)
+            self._schedule(job)
+            self._lock.notify_all()
+
+    def _nextJob(self):
+        '''
+            _nextJob - Called by a worker to wait for the next write to run
+
+            @return <None/BackgroundWriteProcess> - The next write, or None if the scheduler has been stopped
+        '''
+        with self._lock:
+            while True:
+                if self._isStopped:
+                    return None
+
+                if self._ready:
+                    return heapq.heappop(self._ready)[2]
+
+                self._numIdle += 1
+                self._lock.wait()
+                self._numIdle -= 1
+
+    def _runWorker(self):
+        '''
+            _runWorker - The worker thread. Runs writes until stopped.
+        '''
+        while True:
+            job = self._nextJob()
+            if job is None:
+                return
+
+            try:
+                job.run()
+            except Exception:
+                # Recorded in job.error
+                pass
+
+            fileKey = id(job.fileObj)
+            with self._lock:
+                fileQueue = self._fileQueues[fileKey]
+                if fileQueue:
+                    self._schedule(fileQueue.popleft())
+                else:
+                    del self._fileQueues[fileKey]
+                self._lock.notify_all()
+
+
+def wait_all(handles, timeout=None):
+    '''
+        wait_all - Block until all the given background writes have completed, or the timeout expires.
+
+            @param handles <list<BackgroundWriteProcess>> - The writes (the return of bgwrite* or bgcopy functions)
+
+            @param timeout <None/float> - Default None. Max number of seconds to wait in total, or None to wait forever.
 
+        @return <bool> - True if all have completed. Check each #finished and #error for whether they succeeded.
+    '''
+    if timeout is not None:
+        endTime = time.time() + timeout
+
+    for handle in handles:
+        if timeout is None:
+            handle.wait()
+        elif not handle.wait( max(endTime - time.time(), 0) ):
+            return False
+
+    return True
+
+
+_defaultScheduler = None
+_defaultSchedulerLock = threading.Lock()
+
+def get_default_scheduler():
+    '''
+        get_default_scheduler - Get the shared BackgroundWriteScheduler, used by bgwrite(..., scheduler=True). It is created upon first call.
+
+        @return <BackgroundWriteScheduler>
+    '''
+    global _defaultScheduler
+
+    with _defaultSchedulerLock:
+        if _defaultScheduler is None:
+            _defaultScheduler = BackgroundWriteScheduler()
+        return _defaultScheduler
+
+
+class BackgroundIOBudget(object):
+    '''
+        BackgroundIOBudget - A limit on the total rate of all background writes in the process, shared among those writing at any moment.
+
+            Each active write (bgwrite, bgcopy, or a BackgroundWriter with data queued) gets a share of #maxBytesPerSec weighted by the bandwidthPct of its priority,
+            so an ioPrio 1 write (100) gets five times the share of an ioPrio 10 write (20). Shares are redistributed as writes start and finish, and are applied
+            after each chunk, on top of each write's own bandwidthPct / maxBytesPerSec. @see BackgroundIOPriority
+
+            The limit is applied with a single token bucket, refilled at #maxBytesPerSec up to #burstSize. Every chunk written by any write takes its size in tokens,
+            and once they run out, the write sleeps off its part of the debt at the rate of its share. So a write with a larger share sleeps less and writes more often,
+            and together the writes settle at #maxBytesPerSec however small each of them is.
+
+            There is a single, process-wide budget. Use set_io_budget to set its limit, and get_io_budget to get it.
+
+        Attributes:
 
-        # numChunksRateSmoothing - How often we stop for a short bit to be gracious to other running tasks.
-        #  float for division below
-        numChunksRateSmoothing = float(self.backgroundIOPriority.numChunksRateSmoothing)
+            maxBytesPerSec <None/float> - The limit on the total of all background writes, in bytes per second, or None for no limit (the default).
 
-        # i will be the counter from 1 to numChunksRateSmoothing, and then reset
-        i = 1
+            burstSize      <None/float> - The max number of bytes which may be written at full speed after the budget has been idle
 
-        # We start with using max bandwidth until we hit #numChunksRateSmoothing , at which case we recalculate
-        #  sleepTime. We sleep after every block written to maintain a desired average throughput based on
-        #  bandwidthPct
-        sleepTime = 0
+            numWriters     <int>   - The number of writes currently active
 
-        # Before represents the "start" time. When we sleep, we will increment this value
-        #  such that [ delta = (after - before) ] only accounts for time we've spent writing,
-        #  not in charity.
-        before = time.time()
+            totalWeight    <float> - The sum of the weights (bandwidthPct) of the active writes
+    '''
+
+    def __init__(self, maxBytesPerSec=None, burstSize=None):
+        self.maxBytesPerSec = None
+        self.burstSize = None
+        self.setLimit(maxBytesPerSec, burstSize)
+
+        self.numWriters = 0
+        self.totalWeight = 0.0
+
+        self._lock = threading.Lock()
+        self._tokenBucket = _TokenBucket()
+
+    def setLimit(self, maxBytesPerSec, burstSize=None):
+        '''
+            setLimit - Set the limit. This applies immediately to writes already running.
 
-        # timeSlept - Amount of time slept, which must be subtracted from total time spend
-        #  to get an accurate picture of throughput.
-        timeSlept = 0
+                @param maxBytesPerSec <None/number> - The limit in bytes per second, or None for no limit
 
-        # firstPass - Mark the first pass through, so we can get a rough calculation
-        #  of speed from the first write, and recalculate after #numChunksRateSmoothing
-        firstPass = True
+                @param burstSize <None/number> - Default None. The max number of bytes which may be written at full speed after the budget has been idle.
+                    If None, a tenth of a second's worth ( maxBytesPerSec / 10 ).
 
-        if bandwidthPct == 100:
-            shouldRecalculate = lambda i, numChunksRateSmoothing, firstPass : False
+            @raises ValueError - If maxBytesPerSec or burstSize is not None or > 0
+        '''
+        if maxBytesPerSec is not None:
+            if maxBytesPerSec <= 0:
+                raise ValueError('Given maxBytesPerSec %s must be None or > 0' %(str(maxBytesPerSec),))
+            maxBytesPerSec = float(maxBytesPerSec)
+
+            if burstSize is None:
+                burstSize = maxBytesPerSec / 10.0
+            elif burstSize <= 0:
+                raise ValueError('Given burstSize %s must be None or > 0' %(str(burstSize),))
+            else:
+                burstSize = float(burstSize)
         else:
-            shouldRecalculate = lambda i, numChunksRateSmoothing, firstPass : firstPass or i == numChunksRateSmoothing
+            burstSize = None
 
+        self.burstSize = burstSize
+        self.maxBytesPerSec = maxBytesPerSec
 
-        while len(self.remainingData) > 0:
+    def getShare(self, bandwidthPct):
+        '''
+            getShare - Get the rate an active write with the given weight may currently use
 
-            # pop, write, flush
-            nextData = self.remainingData.popleft()
-            fileObj.write(nextData)
-            doFlush(fileObj)
+                @param bandwidthPct <float> - The weight of the write, the bandwidthPct of its priority
 
-            dataWritten += len(nextData)
-            if sleepTime:
-                sleepBefore = time.time()
+            @return <None/float> - Bytes per second, or None if there is no limit
+        '''
+        maxBytesPerSec = self.maxBytesPerSec
+        if maxBytesPerSec is None:
+            return None
 
-                time.sleep(sleepTime)
+        # Read once, as a writer may start or finish at any time. If this write is not (yet) counted, treat it as the only one.
+        totalWeight = self.totalWeight
+        if totalWeight < bandwidthPct:
+            return maxBytesPerSec
+        return maxBytesPerSec * bandwidthPct / totalWeight
 
-                sleepAfter = time.time()
-                timeSlept += (sleepAfter - sleepBefore)
+    def _take(self, numBytes, bandwidthPct):
+        '''
+            _take - Take #numBytes from the shared token bucket, for a write with the given weight
 
-            if shouldRecalculate(i, numChunksRateSmoothing, firstPass) is True:
-                # if not sleeptime, we are on first
-                # We've completed a full period, time for charity
-                after = time.time()
+            @return <float> - The number of seconds the write must sleep to repay its part of the debt, or 0
+        '''
+        # Read once, as the limit may be changed at any time
+        (maxBytesPerSec, burstSize) = (self.maxBytesPerSec, self.burstSize)
+        if maxBytesPerSec is None or burstSize is None:
+            return 0
+
+        # Repay only this write's part of the debt (what it just took), at its share, so each write runs at up to its share
+        debt = min(self._tokenBucket.take(numBytes, maxBytesPerSec, burstSize), numBytes)
+        share = self.getShare(bandwidthPct)
+        if not debt or share is None:
+            return 0
+        return debt / share
+
+    def _addWriter(self, weight):
+        with self._lock:
+            self.numWriters += 1
+            self.totalWeight += weight
+
+    def _removeWriter(self, weight):
+        with self._lock:
+            self.numWriters -= 1
+            if self.numWriters == 0:
+                # Do not accumulate float error
+                self.totalWeight = 0.0
+            else:
+                self.totalWeight -= weight
+
+
+_ioBudget = BackgroundIOBudget()
+
+def get_io_budget():
+    '''
+        get_io_budget - Get the process-wide BackgroundIOBudget
 
-                delta = after - before - timeSlept
+        @return <BackgroundIOBudget>
+    '''
+    return _ioBudget
 
 
-#                if DEBUG is True:
-#                    rate = dataWritten / delta
+def set_io_budget(maxBytesPerSec, burstSize=None):
+    '''
+        set_io_budget - Limit the total rate of all background writes in the process, shared among the active writes weighted by priority. @see BackgroundIOBudget
 
-#                    sys.stdout.write('\t  I have written %d bytes in %3.3f seconds and slept %3.3f sec (%4.5f M/s over %3.3fs)\n' %(dataWritten, delta, timeSlept, (rate) / (1024*1024), delta + timeSlept  ))
-#                    sys.stdout.flush()
+            @param maxBytesPerSec <None/number> - The limit in bytes per second, or None to remove the limit
 
-                # Calculate how much time we should give up on each block to other tasks
-                sleepTime = delta * (1.00 - bandwidthPctDec)
-                sleepTime /= numChunksRateSmoothing
+            @param burstSize <None/number> - Default None. The max number of bytes written at full speed after the budget has been idle. @see BackgroundIOBudget.setLimit
+    '''
+    _ioBudget.setLimit(maxBytesPerSec, burstSize)
 
-#                if DEBUG is True:
-#                    sys.stdout.write('Calculated new sleepTime to be: %f\n' %(sleepTime,))
 
-                timeSlept = 0
-                before = time.time()
-                i = 0
-#            elif DEBUG is True and i == numChunksRateSmoothing:
-#                # When bandwidth pct is 100 (prio=1), the above DEBUG will never be hit.
-#                after = time.time()
-#
-#                delta = after - before - timeSlept
-#
-#                rate = dataWritten / delta
-#
-#                sys.stdout.write('\t  I have written %d bytes in %3.3f seconds and slept %3.3f sec (%4.5f M/s over %3.3fs)\n' %(dataWritten, delta, timeSlept, (rate) / (1024*1024), delta + timeSlept  ))
+class BackgroundWriter(object):
+    '''
+        BackgroundWriter - A long-lived background writer to a single stream, with a file-like #write / #flush / #close.
+
+            Unlike bgwrite, the data does not need to be known up front, and one thread serves every write, so it suits log-style
+            producers making many small writes. Any thread may call #write.
+
+            Written data is queued, up to #maxQueueSize bytes. When the queue is full, #write either blocks until there is space,
+            or drops the data (see #blockWhenFull).
+
+            The writer thread takes queued data in chunks of up to the #BackgroundIOPriority's defaultChunkSize, combining small writes
+            into a single chunk, and throttles to its bandwidthPct as bgwrite does. Data is written as soon as the thread is free, so writes are combined
+            when they arrive faster than they are written (including while the thread sleeps to throttle).
+
+        Attributes:
+
+            fileObj         <stream> - The stream being written into
+
+            maxQueueSize    <int>    - The max number of bytes (or characters) held in the queue
+
+            blockWhenFull   <bool>   - If True, #write blocks while the queue is full. If False, #write drops the data instead.
+
+            bytesWritten    <int>    - The number of bytes (or characters) written so far
+
+            numDropped      <int>    - The number of writes dropped because the queue was full
+
+            error           <None/Exception> - Starts None, and is set to any exception raised while writing, which stops the writer.
+                                               Further calls to #write , #flush , and #close raise it.
+
+            metrics         <None/IOMetrics> - None, or the metrics for this writer if metrics were enabled when it was created. @see nonblock.metrics
+                Counters: "writes" (chunks written), "flushes", "bytesWritten", and "dropped" (writes dropped).
+                Timing histograms: "writeTime" (write and flush of each chunk), "sleepTime" (each sleep to throttle bandwidth), and "queueWaitTime" (#write blocked on a full queue).
+
+        May be used as a context manager, which calls #close upon exit.
+    '''
+
+    def __init__(self, fileObj, ioPrio=4, maxQueueSize=None, blockWhenFull=True, closeWhenFinished=False):
+        '''
+            __init__ - Create a BackgroundWriter, and start its thread.
+
+                @param fileObj <stream> - A stream to write into. Hopefully it supports flushing, but it is not a requirement.
+
+                @param ioPrio <int/BackgroundIOPriority> - Default 4. The priority profile. @see BackgroundWriteProcess
+
+                @param maxQueueSize <None/int> - Default None. The max number of bytes (or characters) to hold in the queue.
+                    If None, 16 times the defaultChunkSize of #ioPrio . A single write larger than this is accepted only when the queue is empty.
+
+                @param blockWhenFull <bool> - Default True. If True, #write blocks while the queue is full. If False, #write drops the data instead.
+
+                @param closeWhenFinished <bool> - Default False. If True, #close also closes #fileObj
+
+            @raises ValueError - If ioPrio is neither a BackgroundIOPriority nor integer 1-10 inclusive
+                               - If maxQueueSize is not > 0
+        '''
+        self.fileObj = fileObj
+        self.backgroundIOPriority = _get_io_priority(ioPrio)
+
+        if maxQueueSize is None:
+            maxQueueSize = int(self.backgroundIOPriority.defaultChunkSize) * 16
+        else:
+            maxQueueSize = int(maxQueueSize)
+            if maxQueueSize <= 0:
+                raise ValueError('maxQueueSize must be > 0')
+
+        self.maxQueueSize = maxQueueSize
+        self.blockWhenFull = blockWhenFull
+        self.closeWhenFinished = closeWhenFinished
+
+        self.bytesWritten = 0
+        self.numDropped = 0
+        self.error = None
+
+        self.metrics = get_metrics_registry().create('bgwriter')
+
+        # Queued data, and its total length
+        self._queue = deque()
+        self._queueSize = 0
+        # Total length ever queued, so #flush knows when everything queued before it has been written
+        self._bytesQueued = 0
+
+        self._isClosing = False
+        self._lock = threading.Condition()
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    @property
+    def closed(self):
+        '''
+            closed - True once #close has been called
+        '''
+        return self._isClosing
+
+    def write(self, data):
+        '''
+            write - Queue data to be written in the background
+
+                @param data <str/bytes/bytes-like> - The data. Mutable data (e.x. a bytearray) is copied, so it may be reused after this returns.
+
+            @return <bool> - True if the data was queued, False if it was dropped because the queue was full (only when blockWhenFull is False)
+
+            @raises ValueError - If the writer has been closed
+                    Exception  - #error , if writing has failed
+        '''
+        if not isinstance(data, (bytes, _TEXT_TYPE)):
+            data = memoryview(data).tobytes()
+
+        dataLen = len(data)
+        if not dataLen:
+            return True
+
+        metrics = self.metrics
+        with self._lock:
+            self._checkWritable()
+
+            if self._queueSize and self._queueSize + dataLen > self.maxQueueSize:
+                if not self.blockWhenFull:
+                    self.numDropped += 1
+                    if metrics is not None:
+                        metrics.count('dropped')
+                    return False
+
+                if metrics is not None:
+                    waitBefore = time.time()
+
+                while self._queueSize and self._queueSize + dataLen > self.maxQueueSize:
+                    self._lock.wait()
+                    self._checkWritable()
+
+                if metrics is not None:
+                    metrics.time('queueWaitTime', time.time() - waitBefore)
+
+            self._queue.append(data)
+            self._queueSize += dataLen
+            self._bytesQueued += dataLen
+            self._lock.notify_all()
+
+        return True
+
+    def flush(self, timeout=None):
+        '''
+            flush - Block until all data queued before this call has been written (and flushed, if the stream supports it), or the timeout expires.
+
+                @param timeout <None/float> - Default None. Max number of seconds to wait, or None to wait forever.
+
+            @return <bool> - True if all the data has been written
+
+            @raises Exception - #error , if writing has failed
+        '''
+        with self._lock:
+            return self._waitForWritten(self._bytesQueued, timeout)
+
+    def close(self, timeout=None):
+        '''
+            close - Stop accepting writes, and block until all queued data has been written. If closeWhenFinished is True, #fileObj is then closed.
+                Calling again has no further effect.
+
+                @param timeout <None/float> - Default None. Max number of seconds to wait for queued data to be written, or None to wait forever.
+                    If the timeout expires, the remaining data is still written in the background.
+
+            @return <bool> - True if all the data has been written
+
+            @raises Exception - #error , if writing has failed
+        '''
+        with self._lock:
+            self._isClosing = True
+            self._lock.notify_all()
+
+        self._thread.join(timeout)
+
+        with self._lock:
+            if self.error is not None:
+                raise self.error
+            return not self._thread.is_alive()
+
+    def _checkWritable(self):
+        '''
+            _checkWritable - Must hold self._lock. Raise if no more data can be written.
+        '''
+        if self.error is not None:
+            raise self.error
+        if self._isClosing:
+            raise ValueError('I/O operation on closed BackgroundWriter')
+
+    def _waitForWritten(self, targetWritten, timeout):
+        '''
+            _waitForWritten - Must hold self._lock. Wait until #targetWritten bytes have been written, or the timeout expires.
+        '''
+        if timeout is not None:
+            endTime = time.time() + timeout
+
+        while self.bytesWritten < targetWritten:
+            if self.error is not None:
+                raise self.error
+            if timeout is None:
+                self._lock.wait()
+            else:
+                remaining = endTime - time.time()
+                if remaining <= 0:
+                    return False
+                self._lock.wait(remaining)
+
+        return True
+
+    def _takeChunk(self, chunkSize):
+        '''
+            _takeChunk - Must hold self._lock. Take the next chunk, up to #chunkSize long, from the queue.
+                Whole writes are combined while they fit, and a write longer than #chunkSize is split.
+        '''
+        queue = self._queue
+        first = queue[0]
+
+        if len(first) > chunkSize:
+            if not isinstance(first, (memoryview, _TEXT_TYPE)):
+                first = memoryview(first)
+            queue[0] = first[chunkSize:]
+            chunk = first[:chunkSize]
+        else:
+            queue.popleft()
+            parts = [first]
+            chunkLen = len(first)
+            while queue and chunkLen + len(queue[0]) <= chunkSize:
+                nextData = queue.popleft()
+                parts.append(nextData)
+                chunkLen += len(nextData)
+
+            if len(parts) == 1:
+                chunk = first
+            elif isinstance(first, _TEXT_TYPE):
+                chunk = u''.join(parts)
+            else:
+                chunk = b''.join(parts)
+
+        self._queueSize -= len(chunk)
+        return chunk
+
+    def _run(self):
+        '''
+            _run - The writer thread. Writes queued chunks until closed and the queue is empty.
+        '''
+        fileObj = self.fileObj
+        metrics = self.metrics
+        lock = self._lock
+
+        chunkSize = int(self.backgroundIOPriority.defaultChunkSize)
+        throttle = _ChunkThrottle(self.backgroundIOPriority, metrics)
+
+        fileFd = get_stream_fd(fileObj)
+        canFlush = hasattr(fileObj, 'flush')
+
+        try:
+            while True:
+                with lock:
+                    if not self._queue and not self._isClosing:
+                        # Time spent waiting for data is not time spent writing, nor does it need a share of the budget
+                        throttle.stop()
+                        idleBefore = time.time()
+                        while not self._queue and not self._isClosing:
+                            lock.wait()
+                        throttle.addIdleTime(time.time() - idleBefore)
+                        throttle.start()
+
+                    if not self._queue:
+                        break
+
+                    chunk = self._takeChunk(chunkSize)
+                    # Space has been freed for blocked writers
+                    lock.notify_all()
+
+                if metrics is not None:
+                    writeBefore = time.time()
+
+                _write_all(fileObj, fileFd, chunk, throttle)
+                if canFlush:
+                    _flush_all(fileObj, fileFd, throttle)
+
+                if metrics is not None:
+                    metrics.time('writeTime', time.time() - writeBefore)
+                    metrics.count('writes')
+                    metrics.count('bytesWritten', len(chunk))
+                    if canFlush:
+                        metrics.count('flushes')
+
+                with lock:
+                    self.bytesWritten += len(chunk)
+                    lock.notify_all()
+
+                throttle.afterChunk(len(chunk))
+
+            if self.closeWhenFinished is True:
+                fileObj.close()
+        except Exception as e:
+            with lock:
+                self.error = e
+                lock.notify_all()
+        finally:
+            throttle.stop()
+
+
+class _ChunkThrottle(object):
+    '''
+        _ChunkThrottle - Applies a BackgroundIOPriority's bandwidthPct and maxBytesPerSec to a background write, copy, or BackgroundWriter.
+
+          After every #numChunksRateSmoothing chunks (and the first), the time spent writing is measured, and the sleep after each following chunk
+          is set such that writing takes bandwidthPct of the time. Time spent waiting on non-blocking streams (or for data) is not counted as time spent writing.
+
+          maxBytesPerSec is applied with the priority's token bucket, shared by every write using that priority, holding up to burstSize tokens (bytes).
+          Each chunk takes its size in tokens, and if that leaves a debt, sleeps until it is repaid. If the shared BackgroundIOBudget has a limit,
+          each chunk is also taken from its token bucket, and this write's part of any debt there is repaid at its share of the budget. The longest sleep is taken.
+
+          Starts as an active writer of the shared BackgroundIOBudget. Call #stop once writing has ended (or while idle), and #start to resume.
+    '''
+
+    def __init__(self, ioPriority, metrics=None):
+        self.bandwidthPctDec = ioPriority.bandwidthPct / 100.0
+        self.numChunksRateSmoothing = float(ioPriority.numChunksRateSmoothing)
+        self.metrics = metrics
+
+        self.i = 1
+        self.sleepTime = 0
+        self.firstPass = True
+
+        self.before = time.time()
+        # Time slept or waited since #before, which must be subtracted to get the time spent copying
+        self.timeIdle = 0
+
+        self.maxBytesPerSec = ioPriority.maxBytesPerSec
+        if self.maxBytesPerSec is not None:
+            self.maxBytesPerSec = float(self.maxBytesPerSec)
+
+        self.burstSize = ioPriority.burstSize or int(ioPriority.defaultChunkSize)
+        self.tokenBucket = ioPriority._tokenBucket
+
+        self.budget = get_io_budget()
+        self.budgetWeight = ioPriority.bandwidthPct
+        self.isActive = False
+        self.start()
+
+    def start(self):
+        '''
+            start - Become an active writer, sharing the BackgroundIOBudget
+        '''
+        if not self.isActive:
+            self.isActive = True
+            self.budget._addWriter(self.budgetWeight)
+
+    def stop(self):
+        '''
+            stop - No longer an active writer, so the BackgroundIOBudget is shared among the others
+        '''
+        if self.isActive:
+            self.isActive = False
+            self.budget._removeWriter(self.budgetWeight)
+
+    def wait(self, readFd=None, writeFd=None):
+        '''
+            wait - Wait for the given fds to be ready for reading / writing. Each is waited upon in turn.
+        '''
+        waitBefore = time.time()
+        if readFd is not None:
+            wait_for_fds([readFd])
+        if writeFd is not None:
+            wait_for_fds([], [writeFd])
+        waited = time.time() - waitBefore
+
+        self.timeIdle += waited
+        if self.metrics is not None:
+            self.metrics.time('waitTime', waited)
+
+    def addIdleTime(self, seconds):
+        '''
+            addIdleTime - Exclude time spent otherwise idle (e.x. waiting for data to write) from the time spent writing
+        '''
+        self.timeIdle += seconds
+
+    def afterChunk(self, numBytes):
+        '''
+            afterChunk - Called after each chunk is written. Sleeps to maintain the bandwidthPct and maxBytesPerSec.
+
+                @param numBytes <int> - The size of the chunk
+        '''
+        sleepTime = self.sleepTime
+
+        budgetSleepTime = self.budget._take(numBytes, self.budgetWeight)
+        if budgetSleepTime > sleepTime:
+            sleepTime = budgetSleepTime
+
+        maxBytesPerSec = self.maxBytesPerSec
+        if maxBytesPerSec is not None:
+            # Writes sharing the bucket each sleep off the whole debt, so together they settle at the rate
+            debt = self.tokenBucket.take(numBytes, maxBytesPerSec, self.burstSize)
+            if debt / maxBytesPerSec > sleepTime:
+                sleepTime = debt / maxBytesPerSec
+
+        if sleepTime:
+            sleepBefore = time.time()
+
+            time.sleep(sleepTime)
+
+            slept = time.time() - sleepBefore
+            self.timeIdle += slept
+            if self.metrics is not None:
+                self.metrics.time('sleepTime', slept)
+
+        if self.bandwidthPctDec < 1 and (self.firstPass or self.i == self.numChunksRateSmoothing):
+            # We've completed a full period, calculate how much time we should give up on each chunk to other tasks
+            delta = time.time() - self.before - self.timeIdle
+
+            self.sleepTime = delta * (1.00 - self.bandwidthPctDec)
+            self.sleepTime /= self.numChunksRateSmoothing
+
+#            if DEBUG is True:
+#                sys.stdout.write('\t  I have written for %3.3f seconds and been idle %3.3f sec. Calculated new sleepTime to be: %f\n' %(delta, self.timeIdle, self.sleepTime))
 #                sys.stdout.flush()
-#
-#                timeSlept = 0
-#                before = time.time()
-#                i = 0
 
-            firstPass = False
+            self.timeIdle = 0
+            self.before = time.time()
+            self.i = 0
+
+        self.firstPass = False
+        self.i += 1
+
+
+class _ChunkSizeTuner(object):
+    '''
+        _ChunkSizeTuner - Tunes the chunk size of a write toward the size which takes a BackgroundIOPriority's targetChunkLatency to write and flush.
+
+          The time per byte is measured from each chunk, and smoothed over about numChunksRateSmoothing chunks. The chunk size changes by at most
+          a factor of 2 per chunk, so a single slow (or fast) chunk does not swing it, and stays within _MIN_CHUNK_SIZE and _MAX_CHUNK_SIZE.
+    '''
+
+    def __init__(self, ioPriority, chunkSize):
+        self.targetLatency = ioPriority.targetChunkLatency or _DEFAULT_TARGET_CHUNK_LATENCY
+        self.smoothing = 1.0 / max(ioPriority.numChunksRateSmoothing, 1)
+
+        self.chunkSize = chunkSize
+        # Smoothed seconds per byte, None until the first chunk is measured
+        self.secPerByte = None
+
+    def update(self, numBytes, seconds):
+        '''
+            update - Called after each chunk is written, with its size and the time it took.
+
+            @return <int> - The size for the following chunks
+        '''
+        if numBytes <= 0:
+            return self.chunkSize
+
+        sample = max(seconds, 0) / float(numBytes)
+        if self.secPerByte is None:
+            self.secPerByte = sample
+        else:
+            self.secPerByte += (sample - self.secPerByte) * self.smoothing
+
+        chunkSize = self.chunkSize
+        if self.secPerByte > 0:
+            idealSize = self.targetLatency / self.secPerByte
+        else:
+            idealSize = chunkSize * 2
+
+        idealSize = min( max( idealSize, chunkSize / 2.0 ), chunkSize * 2.0 )
+
+        self.chunkSize = int( min( max( idealSize, _MIN_CHUNK_SIZE ), _MAX_CHUNK_SIZE ) )
+        return self.chunkSize
+
+
+class DataChunks(object):
+    '''
+        DataChunks - A queue of the chunks of a str/bytes, each up to #chunkSize in length, which are sliced as they are taken.
+
+            Binary data (bytes, bytearray, memoryview, or anything else supporting the buffer protocol) is sliced with memoryview, so no data is copied.
+            Strings are sliced one chunk at a time. Either way, creating a DataChunks is O(1) regardless of the size of the data.
+
+            This is used as the "remainingData" of a BackgroundWriteProcess, in place of a deque of chunks. @see chunk_data for the list equivalent.
+
+            Since the data is not copied, it must not be modified until it has been written.
+    '''
+
+    __slots__ = ('data', 'chunkSize', 'offset', 'dataLen')
+
+    def __init__(self, data, chunkSize):
+        '''
+            __init__ - Create a DataChunks
+
+                @param data <str/bytes/bytes-like> - The data to chunk
+
+                @param chunkSize <int> - The max size of each chunk
+
+            @raises ValueError - If chunkSize is not > 0
+        '''
+        chunkSize = int(chunkSize)
+        if chunkSize <= 0:
+            raise ValueError('chunkSize must be > 0')
+
+        try:
+            view = memoryview(data)
+        except TypeError:
+            # str
+            pass
+        else:
+            if view.itemsize != 1 or view.ndim != 1:
+                view = view.cast('B')
+            data = view
+
+        self.data = data
+        self.chunkSize = chunkSize
+        # Offset of the next chunk
+        self.offset = 0
+        self.dataLen = len(data)
+
+    def __len__(self):
+        '''
+            __len__ - The number of chunks remaining
+        '''
+        remaining = self.dataLen - self.offset
+        return (remaining + self.chunkSize - 1) // self.chunkSize
+
+    def __iter__(self):
+        '''
+            __iter__ - Iterate over the remaining chunks, without taking them
+        '''
+        data = self.data
+        chunkSize = self.chunkSize
+        for i in range(self.offset, self.dataLen, chunkSize):
+            yield data[i : i + chunkSize]
+
+    def peek(self):
+        '''
+            peek - Get the next chunk, without taking it
+
+            @return <str/memoryview> - The next chunk
+
+            @raises IndexError - If there are no chunks remaining
+        '''
+        offset = self.offset
+        if offset >= self.dataLen:
+            raise IndexError('peek from an empty DataChunks')
+
+        return self.data[offset : offset + self.chunkSize]
+
+    def popleft(self):
+        '''
+            popleft - Take the next chunk
+
+            @return <str/memoryview> - The next chunk
+
+            @raises IndexError - If there are no chunks remaining
+        '''
+        offset = self.offset
+        if offset >= self.dataLen:
+            raise IndexError('pop from an empty DataChunks')
+
+        nextOffset = min(offset + self.chunkSize, self.dataLen)
+        self.offset = nextOffset
+        return self.data[offset : nextOffset]
+
+
+def _take_batch(remainingData, firstBlock, batchSize):
+    '''
+        _take_batch - Take the blocks following #firstBlock from #remainingData, while they fit within #batchSize bytes (and the max number of buffers for writev)
+
+        @return list<bytes/memoryview> - #firstBlock and the blocks taken
+    '''
+    blocks = [firstBlock]
+    batchLen = len(firstBlock)
+
+    if isinstance(remainingData, DataChunks):
+        peek = remainingData.peek
+    else:
+        peek = lambda : remainingData[0]
+
+    while len(remainingData) > 0 and len(blocks) < _IOV_MAX:
+        nextBlock = peek()
+        if isinstance(nextBlock, _TEXT_TYPE) or batchLen + len(nextBlock) > batchSize:
+            break
+
+        blocks.append(remainingData.popleft())
+        batchLen += len(nextBlock)
+
+    return blocks
 
+
+def _writev_all(fd, blocks, throttle):
+    '''
+        _writev_all - Write all of #blocks to #fd with os.writev, resuming after a partial write, and waiting (with #throttle) if #fd is non-blocking and not writable.
+
+        @return <int> - The number of bytes written
+    '''
+    total = 0
+    # Index of the first block not yet fully written
+    i = 0
+    numBlocks = len(blocks)
+
+    while i < numBlocks:
+        try:
+            count = os.writev(fd, blocks[i:] if i else blocks)
+        except (OSError, IOError) as e:
+            if e.errno not in _WOULD_BLOCK_ERRNOS:
+                raise
+            throttle.wait(None, fd)
+            continue
+
+        total += count
+
+        # Skip the blocks fully written, and slice the remainder of a partly written one
+        while i < numBlocks and count >= len(blocks[i]):
+            count -= len(blocks[i])
             i += 1
+        if count:
+            blocks[i] = memoryview(blocks[i])[count:]
 
-        if self.closeWhenFinished is True:
-            fileObj.close()
+    return total
 
-        self.finished = True
+
+def _write_all(dst, dstFd, view, throttle):
+    '''
+        _write_all - Write all of #view to #dst, resuming after a partial write, and waiting (with #throttle) if #dst is non-blocking and not writable.
+
+            Streams without a "write" (e.x. sockets) are written with "send".
+
+            @param dst <stream> - The stream to write into
+
+            @param dstFd <None/int> - The fd of #dst, or None if it has none
+
+            @param view <str/bytes/memoryview> - The data
+    '''
+    if hasattr(dst, 'write'):
+        writeFunc = dst.write
+    else:
+        writeFunc = dst.send
+
+    while view:
+        try:
+            count = writeFunc(view)
+        except (OSError, IOError) as e:
+            if dstFd is None or e.errno not in _WOULD_BLOCK_ERRNOS:
+                raise
+            # A buffered writer reports how much it accepted before it would block
+            count = getattr(e, 'characters_written', 0)
+
+        if count is None:
+            if dstFd is None or not _is_raw_stream(dst) or not is_fd_nonblocking(dstFd):
+                # Not a non-blocking raw stream, so None does not mean it would block (e.x. some file-like objects return nothing from write)
+                return
+            count = 0
+        elif count >= len(view):
+            return
+
+        if count:
+            if not isinstance(view, (memoryview, _TEXT_TYPE)):
+                # Resume from the offset without copying the remainder
+                view = memoryview(view)
+            view = view[count:]
+        else:
+            throttle.wait(None, dstFd)
+
+
+def _is_raw_stream(stream):
+    '''
+        _is_raw_stream - Check if #stream is a raw stream, whose write returns None when it would block (rather than a wrapper, which may return None regardless)
+    '''
+    return isinstance(stream, io.RawIOBase) or get_raw_stream_fd(stream) is not None
+
+
+def _flush_all(dst, dstFd, throttle):
+    '''
+        _flush_all - Flush #dst, waiting (with #throttle) and retrying if it is non-blocking and not writable.
+            A buffered writer keeps what it could not write, so retrying resumes where it stopped.
+    '''
+    while True:
+        try:
+            dst.flush()
+            return
+        except (OSError, IOError) as e:
+            if dstFd is None or e.errno not in _WOULD_BLOCK_ERRNOS:
+                raise
+        throttle.wait(None, dstFd)
 
 
 def chunk_data(data, chunkSize):
@@ -5,14 +5,31 @@
 '''
 # vim: ts=4 sw=4 expandtab
 
+import sys
 
-from .read import nonblock_read
+from .read import nonblock_read, nonblock_readinto, nonblock_read_until, NonblockReader
 
-from .BackgroundWrite import bgwrite, bgwrite_chunk, BackgroundIOPriority
+from .BackgroundWrite import bgwrite, bgwrite_chunk, BackgroundIOPriority, BackgroundWriteScheduler, BackgroundWriter, BackgroundIOBudget, DataChunks, wait_all, set_io_budget, get_io_budget
 
-from .BackgroundRead import bgread
+from .BackgroundCopy import bgcopy
 
-__all__ = ('nonblock_read', 'bgwrite', 'bgwrite_chunk', 'BackgroundIOPriority', 'bgread')
+from .BackgroundRead import bgread, BackgroundReadReactor, BackgroundReadPriority
+
+from .BackgroundProcess import bgread_process
+
+from .framing import nonblock_readline, nonblock_read_record, DelimiterFramer, FixedLengthFramer, LengthPrefixFramer
+
+from .metrics import enable_metrics, disable_metrics, snapshot_metrics
+
+__all__ = ('nonblock_read', 'nonblock_readinto', 'nonblock_read_until', 'NonblockReader', 'bgwrite', 'bgwrite_chunk', 'BackgroundIOPriority', 'BackgroundWriteScheduler', 'BackgroundWriter', 'BackgroundIOBudget', 'DataChunks', 'wait_all', 'set_io_budget', 'get_io_budget', 'bgcopy', 'bgread', 'BackgroundReadReactor', 'BackgroundReadPriority', 'bgread_process',
+    'nonblock_readline', 'nonblock_read_record', 'DelimiterFramer', 'FixedLengthFramer', 'LengthPrefixFramer',
+    'enable_metrics', 'disable_metrics', 'snapshot_metrics',
+)
+
+if sys.version_info >= (3, 5):
+    from .aio import async_nonblock_read, async_bgread
+
+    __all__ += ('async_nonblock_read', 'async_bgread')
 
 __version__ = '4.0.1'
 __version_tuple = (4, 0, 1)
@@ -0,0 +1,208 @@
+'''
+    Copyright (c) 2015-2016 Timothy Savannah under terms of LGPLv2. You should have received a copy of this LICENSE with this distribution.
+
+    aio.py Contains asyncio versions of nonblock_read and bgread. These are driven by the event loop (loop.add_reader), with no extra threads.
+
+      Requires python 3.5+ , and an event loop which supports add_reader (i.e. not the Windows ProactorEventLoop)
+'''
+# vim: ts=4 sw=4 expandtab
+
+import asyncio
+
+from .read import NonblockReader
+
+from .common import detect_stream_mode, get_stream_fd
+
+from .BackgroundRead import BackgroundReadData, _check_bgread_args
+
+__all__ = ('async_nonblock_read', 'async_bgread', 'AsyncBackgroundReadData')
+
+
+async def async_nonblock_read(stream, limit=None, forceMode=None):
+    '''
+        async_nonblock_read - Wait until data is available on the given stream, and read it. The wait is done on the event loop with add_reader.
+
+            @param stream <object> - A stream backed by a file descriptor (like a pipe or a socket)
+            @param limit <None/int> - Max number of bytes to read. If None or 0, will read as much data is available.
+            @param forceMode <None/mode string> - @see nonblock_read
+
+            @return <str or bytes depending on stream's mode> - The data available on the stream (never empty),
+                or "None" if the stream was closed on the other side and all data has already been read.
+
+            @raises ValueError - If the stream is not backed by a file descriptor
+    '''
+    fd = get_stream_fd(stream)
+    if fd is None:
+        raise ValueError('async_nonblock_read can only read streams backed by a file descriptor, %s is not.' %(repr(stream),))
+
+    # Resolve how to read the stream once, rather than on each read
+    reader = NonblockReader(stream, forceMode)
+
+    loop = asyncio.get_event_loop()
+
+    while True:
+        data = reader.read(limit)
+        if data is None or data:
+            return data
+
+        future = loop.create_future()
+        loop.add_reader(fd, _set_future_done, future)
+        try:
+            await future
+        finally:
+            loop.remove_reader(fd)
+
+
+def async_bgread(stream, blockSizeLimit=65535, closeStream=True, highWaterMark=None, framer=None):
+    '''
+        async_bgread - Read the given stream in the background on the running event loop, and automatically populate data in the returned object.
+
+            This is the asyncio equivalent of bgread. Data is read as soon as the event loop sees the stream is readable.
+            Must be called from within the event loop's thread.
+
+            @param stream <object> - A stream backed by a file descriptor. Socket, pipe, etc.
+
+            @param blockSizeLimit <None/int> - Default 65535. Max number of bytes read each time the stream becomes readable.
+
+            @param closeStream <bool> - Default True. If True, the "close" method on the stream object will be called when the other side has closed and all data has been read.
+
+            @param highWaterMark <None/int> - Default None. @see bgread
+
+            @param framer <None/framer> - Default None. @see bgread
+
+        @return <AsyncBackgroundReadData> - A BackgroundReadData which can also be iterated with "async for" to consume blocks as they arrive.
+
+        @raises ValueError - If the stream is not readable or not backed by a file descriptor, or the blockSizeLimit or highWaterMark is invalid
+    '''
+    (blockSizeLimit, highWaterMark) = _check_bgread_args(stream, blockSizeLimit, highWaterMark)
+
+    fd = get_stream_fd(stream)
+    if fd is None:
+        raise ValueError('async_bgread can only read streams backed by a file descriptor, %s is not.' %(repr(stream),))
+
+    loop = asyncio.get_event_loop()
+
+    streamMode = detect_stream_mode(stream)
+    results = AsyncBackgroundReadData(streamMode, highWaterMark, framer, loop=loop)
+
+    results._startReading(stream, fd, blockSizeLimit, closeStream)
+
+    return results
+
+
+class AsyncBackgroundReadData(BackgroundReadData):
+    '''
+        AsyncBackgroundReadData - The BackgroundReadData returned by async_bgread. @see BackgroundReadData
+
+            In addition, blocks can be consumed as they arrive with:
+
+                async for block in results:
+                    ...
+
+            and #wait can be awaited until data is available.
+    '''
+
+    def __init__(self, dataType, highWaterMark=None, framer=None, loop=None):
+        BackgroundReadData.__init__(self, dataType, highWaterMark, framer)
+
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self._loop = loop
+
+        # Future awaited for the next block, if a coroutine is waiting
+        self._waiter = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            block = self.popBlock()
+            if block is not None:
+                return block
+
+            if not await self.wait():
+                raise StopAsyncIteration
+
+    async def wait(self, timeout=None):
+        '''
+            wait - Wait until there is data to consume, reading has ended (stream finished, error, or stopped), or the timeout expires.
+
+                @param timeout <None/float> - Default None. Max number of seconds to wait, or None to wait forever.
+
+            @return <bool> - True if data is available, otherwise False
+        '''
+        while not self._hasData():
+            if self.isFinished or self.error is not None or self._stopRequested:
+                return False
+
+            waiter = self._waiter
+            if waiter is None or waiter.done():
+                waiter = self._waiter = self._loop.create_future()
+
+            try:
+                if timeout is None:
+                    await asyncio.shield(waiter)
+                else:
+                    await asyncio.wait_for(asyncio.shield(waiter), timeout)
+            except asyncio.TimeoutError:
+                return False
+
+        return True
+
+    def _wakeWaiter(self):
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def _startReading(self, stream, fd, blockSizeLimit, closeStream):
+        '''
+            _startReading - Start reading #stream on the event loop
+        '''
+        loop = self._loop
+        reader = NonblockReader(stream, self._forceMode)
+
+        def onReadable():
+            if self.isFinished or self._stopRequested:
+                return
+
+            limit = self._getReadLimit(blockSizeLimit)
+            if limit == 0:
+                # Paused for the highWaterMark. _resumeFunc will add the reader back once enough data is consumed.
+                loop.remove_reader(fd)
+                return
+
+            try:
+                if not self._readFrom(reader, limit):
+                    loop.remove_reader(fd)
+                    if closeStream and hasattr(stream, 'close'):
+                        stream.close()
+                    self._finish()
+                elif reader.hasBufferedData():
+                    # Held in the stream's buffer, so the fd will not become readable for it
+                    loop.call_soon(onReadable)
+            except Exception as e:
+                loop.remove_reader(fd)
+                self._finish(e)
+
+            self._wakeWaiter()
+
+        def startWatching():
+            loop.add_reader(fd, onReadable)
+            if reader.hasBufferedData():
+                loop.call_soon(onReadable)
+
+        def onStop():
+            loop.remove_reader(fd)
+            self._wakeWaiter()
+
+        # These may be called from other threads, via popData, stop, etc.
+        self._resumeFunc = lambda : loop.call_soon_threadsafe(startWatching)
+        self._stopFunc = lambda : loop.call_soon_threadsafe(onStop)
+
+        startWatching()
+
+
+def _set_future_done(future):
+    if not future.done():
+        future.set_result(None)
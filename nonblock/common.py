@@ -1,5 +1,17 @@
 
-__all__ = ('detect_stream_mode', )
+import io
+import math
+import os
+import select
+import socket
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows. Callers fall back to the pure-python read path.
+    fcntl = None
+
+__all__ = ('detect_stream_mode', 'resolve_stream_mode', 'get_stream_fd', 'get_raw_stream_fd', 'set_fd_nonblocking', 'is_fd_nonblocking', 'wait_for_fds')
 
 def detect_stream_mode(stream):
     '''
@@ -32,3 +44,180 @@ def detect_stream_mode(stream):
 
     # Cannot figure it out, assume bytes.
     return bytes
+
+
+def resolve_stream_mode(stream, forceMode=None):
+    '''
+        resolve_stream_mode - Get the mode to read a stream in, from the "forceMode" given to the read functions.
+
+            @param stream <object> - A stream object
+            @param forceMode <None/mode string> - 'b' for binary (bytes), 't' for text (str), or None to autodetect. @see detect_stream_mode
+
+        @return <type> - bytes or str
+    '''
+    if forceMode:
+        if 'b' in forceMode:
+            return bytes
+        elif 't' in forceMode:
+            return str
+
+    return detect_stream_mode(stream)
+
+
+def get_stream_fd(stream):
+    '''
+        get_stream_fd - Get the file descriptor backing a given stream, if there is one.
+
+            @param stream <object> - A stream object
+
+        @return <int/None> - The fd number, or None if the stream is not backed by an fd (or it is closed)
+    '''
+    fileno = getattr(stream, 'fileno', None)
+    if fileno is None:
+        return None
+    try:
+        return fileno()
+    except Exception:
+        # io.UnsupportedOperation, ValueError on closed file, etc.
+        return None
+
+
+# Streams whose data is exactly the bytes of their fd
+_RAW_STREAM_TYPES = tuple( [ streamType for streamType in (io.FileIO, socket.socket, getattr(socket, 'SocketIO', None)) if streamType is not None ] )
+
+# Buffered streams which are safe to bypass (after flushing, or draining what they hold), when directly over a raw stream
+_BUFFERED_STREAM_TYPES = (io.BufferedReader, io.BufferedWriter, io.BufferedRandom)
+
+def get_raw_stream_fd(stream):
+    '''
+        get_raw_stream_fd - Get the file descriptor backing a given stream, only if the data of the stream is exactly the bytes read from or written to the fd,
+            so it is safe to use the fd directly (e.x. with os.writev or splice).
+
+            That is a raw file (io.FileIO) or socket, or a BufferedReader / BufferedWriter / BufferedRandom directly over one (the caller must flush it, or drain
+            what it holds, first). Subclasses are not trusted, as they may transform the data (e.x. ssl.SSLSocket), nor is any other stream with a fileno,
+            such as gzip.GzipFile or a TextIOWrapper.
+
+            @param stream <object> - A stream object
+
+        @return <int/None> - The fd number, or None if the fd may not be used directly
+    '''
+    streamType = type(stream)
+    if streamType in _BUFFERED_STREAM_TYPES:
+        if type(getattr(stream, 'raw', None)) not in _RAW_STREAM_TYPES:
+            return None
+    elif streamType not in _RAW_STREAM_TYPES:
+        return None
+
+    return get_stream_fd(stream)
+
+
+def set_fd_nonblocking(fd):
+    '''
+        set_fd_nonblocking - Set O_NONBLOCK on the given fd, if it is not already set.
+
+            @param fd <int> - A file descriptor
+
+        @return <bool> - True if the fd is now non-blocking, False if this platform does not support it (no fcntl)
+    '''
+    if fcntl is None:
+        return False
+
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    if not flags & os.O_NONBLOCK:
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    return True
+
+
+def _wrap_fd_nonblocking(fd, func):
+    '''
+        _wrap_fd_nonblocking - Wrap #func, which reads from #fd, such that O_NONBLOCK is set on #fd for each call only, and its original flags restored afterwards.
+
+            So an fd the caller did not open (e.x. a tty stdin shared with other code, or other processes) is always left as it was found.
+
+            @param fd <int> - A file descriptor
+
+            @param func <function> - The function to wrap
+
+        @return <None/function> - #func itself if #fd is already non-blocking, otherwise the wrapper.
+            None if this platform does not support non-blocking fds (no fcntl)
+    '''
+    if fcntl is None:
+        return None
+
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    if flags & os.O_NONBLOCK:
+        return func
+
+    nonblockFlags = flags | os.O_NONBLOCK
+
+    def _nonblocking_call(*args):
+        fcntl.fcntl(fd, fcntl.F_SETFL, nonblockFlags)
+        try:
+            return func(*args)
+        finally:
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags)
+
+    return _nonblocking_call
+
+
+def is_fd_nonblocking(fd):
+    '''
+        is_fd_nonblocking - Check if O_NONBLOCK is set on the given fd
+
+            @param fd <int> - A file descriptor
+
+        @return <bool> - True if the fd is non-blocking, False if not (or this platform does not support it, no fcntl)
+    '''
+    if fcntl is None:
+        return False
+
+    return bool(fcntl.fcntl(fd, fcntl.F_GETFL) & os.O_NONBLOCK)
+
+
+if hasattr(select, 'poll'):
+    # Treat hangup/error as ready, so the following read/write will report EOF or the error
+    _POLL_READ_MASK = select.POLLIN | select.POLLPRI
+    _POLL_READY_READ = _POLL_READ_MASK | select.POLLHUP | select.POLLERR | select.POLLNVAL
+    _POLL_READY_WRITE = select.POLLOUT | select.POLLHUP | select.POLLERR | select.POLLNVAL
+else:
+    _POLL_READ_MASK = None
+
+def wait_for_fds(readFds, writeFds=(), timeout=None):
+    '''
+        wait_for_fds - Block until any of the given fds are ready, or the timeout expires. Uses poll where available (no limit on fd numbers), otherwise select.
+
+            @param readFds <list<int>> - fds to wait on being readable (or closed)
+
+            @param writeFds <list<int>> - fds to wait on being writable
+
+            @param timeout <None/float> - Default None. Max number of seconds to wait, or None to wait forever.
+
+        @return tuple( list<int>, list<int> ) - The fds ready for reading, and the fds ready for writing. Both empty if the timeout expired.
+    '''
+    if _POLL_READ_MASK is None:
+        (readyRead, readyWrite, junk) = select.select(readFds, writeFds, [], timeout)
+        return (readyRead, readyWrite)
+
+    masks = {}
+    for fd in readFds:
+        masks[fd] = _POLL_READ_MASK
+    for fd in writeFds:
+        masks[fd] = masks.get(fd, 0) | select.POLLOUT
+
+    poller = select.poll()
+    for (fd, mask) in masks.items():
+        poller.register(fd, mask)
+
+    if timeout is not None:
+        # Round up, so a small timeout does not become a non-blocking poll
+        timeout = int(math.ceil(timeout * 1000.0))
+
+    readyRead = []
+    readyWrite = []
+    for (fd, event) in poller.poll(timeout):
+        if event & _POLL_READY_READ and masks[fd] & _POLL_READ_MASK:
+            readyRead.append(fd)
+        if event & _POLL_READY_WRITE and masks[fd] & select.POLLOUT:
+            readyWrite.append(fd)
+
+    return (readyRead, readyWrite)
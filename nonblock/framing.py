@@ -0,0 +1,293 @@
+'''
+    Copyright (c) 2015-2016 Timothy Savannah under terms of LGPLv2. You should have received a copy of this LICENSE with this distribution.
+
+    framing.py Contains incremental framers, which split a stream into records (lines, fixed-length, or length-prefixed), and functions to read records without blocking.
+
+      A framer is given to bgread (or BackgroundReadData) to have records, instead of the raw blocks read, populated in the background.
+      nonblock_readline and nonblock_read_record use one to return complete records from a stream.
+
+      Framers are fed each block of data once, as it is read, so each byte is examined only once no matter how many records are held.
+      A framer holds the state of a single stream, so create a new one for each stream.
+'''
+# vim: ts=4 sw=4 expandtab
+
+import struct
+import threading
+import weakref
+
+from .read import nonblock_read
+
+from .common import resolve_stream_mode
+
+from .BackgroundRead import BackgroundReadData
+
+__all__ = ('DelimiterFramer', 'FixedLengthFramer', 'LengthPrefixFramer', 'nonblock_readline', 'nonblock_read_record')
+
+
+class DelimiterFramer(object):
+    '''
+        DelimiterFramer - Splits a stream into records ending with a delimiter (e.x. lines). Each record includes its delimiter.
+    '''
+
+    # Number of characters at the start of each record which are not returned as part of it
+    headerSize = 0
+
+    def __init__(self, delimiter):
+        '''
+            __init__ - Create a DelimiterFramer
+
+            @param delimiter <str/bytes> - The delimiter marking the end of each record, e.x. b'\\n'. Must be the same type as the stream's data.
+        '''
+        if not delimiter:
+            raise ValueError('delimiter must not be empty.')
+
+        self.delimiter = delimiter
+
+        self._tail = delimiter[:0]
+
+    def validate(self, dataType):
+        '''
+            validate - Check this framer can be used on data of the given type
+
+            @raises ValueError - If the delimiter is not of #dataType
+        '''
+        if type(self.delimiter) is not dataType:
+            raise ValueError('Delimiter %s must be of the stream type, %s.' %(repr(self.delimiter), dataType.__name__))
+
+    def reset(self, offset):
+        '''
+            reset - Start framing a new record at #offset. Any partial record is discarded.
+        '''
+        self._tail = self.delimiter[:0]
+
+    def feed(self, block, offset):
+        '''
+            feed - Scan the next block of data for the end of records.
+
+            @param block <str/bytes> - The next block of data
+            @param offset <int> - The offset of #block within the stream
+
+            @return list<int> - The stream offsets of the end of each record completed by this block
+        '''
+        delimiter = self.delimiter
+        delimiterLen = len(delimiter)
+
+        tail = self._tail
+        if tail:
+            # Carry over the end of the prior block, in case a multi-character delimiter spans them
+            data = tail + block
+            dataStart = offset - len(tail)
+        else:
+            data = block
+            dataStart = offset
+
+        ends = []
+        pos = 0
+        while True:
+            idx = data.find(delimiter, pos)
+            if idx == -1:
+                break
+            pos = idx + delimiterLen
+            ends.append(dataStart + pos)
+
+        if delimiterLen > 1:
+            self._tail = data[ max(pos, len(data) - (delimiterLen - 1)) : ]
+
+        return ends
+
+
+class FixedLengthFramer(object):
+    '''
+        FixedLengthFramer - Splits a stream into records of a fixed length.
+    '''
+
+    headerSize = 0
+
+    def __init__(self, recordLength):
+        '''
+            __init__ - Create a FixedLengthFramer
+
+            @param recordLength <int> - The length of each record
+        '''
+        recordLength = int(recordLength)
+        if recordLength <= 0:
+            raise ValueError('recordLength must be a positive integer.')
+
+        self.recordLength = recordLength
+
+        self._nextEnd = recordLength
+
+    def validate(self, dataType):
+        pass
+
+    def reset(self, offset):
+        self._nextEnd = offset + self.recordLength
+
+    def feed(self, block, offset):
+        '''
+            feed - @see DelimiterFramer.feed
+        '''
+        blockEnd = offset + len(block)
+        recordLength = self.recordLength
+
+        ends = []
+        nextEnd = self._nextEnd
+        while nextEnd <= blockEnd:
+            ends.append(nextEnd)
+            nextEnd += recordLength
+        self._nextEnd = nextEnd
+
+        return ends
+
+
+class LengthPrefixFramer(object):
+    '''
+        LengthPrefixFramer - Splits a binary stream into records, each starting with a header giving the length of the data which follows.
+    '''
+
+    def __init__(self, prefixFormat='>I', includePrefix=False):
+        '''
+            __init__ - Create a LengthPrefixFramer
+
+            @param prefixFormat <str> - Default '>I' (32-bit big-endian unsigned). A "struct" format of a single integer, which is the length prefix.
+
+            @param includePrefix <bool> - Default False. If True, records returned include the length prefix. Otherwise only the data following it is returned.
+        '''
+        self.prefixFormat = prefixFormat
+        self.prefixSize = struct.calcsize(prefixFormat)
+        self.includePrefix = includePrefix
+
+        if includePrefix:
+            self.headerSize = 0
+        else:
+            self.headerSize = self.prefixSize
+
+        self._header = b''
+        self._recordEnd = None
+
+    def validate(self, dataType):
+        if dataType is not bytes:
+            raise ValueError('LengthPrefixFramer can only be used on binary streams.')
+
+    def reset(self, offset):
+        self._header = b''
+        self._recordEnd = None
+
+    def feed(self, block, offset):
+        '''
+            feed - @see DelimiterFramer.feed
+        '''
+        prefixSize = self.prefixSize
+        blockLen = len(block)
+
+        ends = []
+        pos = 0
+        recordEnd = self._recordEnd
+        while pos < blockLen:
+            if recordEnd is None:
+                # Collect the header, which may span blocks
+                need = prefixSize - len(self._header)
+                self._header += block[pos : pos + need]
+                pos = min(pos + need, blockLen)
+                if len(self._header) < prefixSize:
+                    break
+
+                recordEnd = offset + pos + struct.unpack(self.prefixFormat, self._header)[0]
+                self._header = b''
+
+            if recordEnd > offset + blockLen:
+                break
+
+            ends.append(recordEnd)
+            pos = recordEnd - offset
+            recordEnd = None
+
+        self._recordEnd = recordEnd
+
+        return ends
+
+
+# Buffers holding data read past the end of the last record returned by nonblock_read_record, per stream
+_recordBuffers = weakref.WeakKeyDictionary()
+_recordBuffersLock = threading.Lock()
+
+def nonblock_read_record(stream, framer=None, forceMode=None):
+    '''
+        nonblock_read_record - Read the next complete record from the given stream without blocking.
+
+            Any data available is read, and data past the end of the record returned is held for following calls.
+
+            @param stream <object> - A stream (like a file object or a socket)
+
+            @param framer <None/framer> - The framer splitting the stream into records. Provide the same framer on each call for a stream.
+                If None, the framer already in use on this stream is used, or a new line framer ( @see nonblock_readline ).
+
+            @param forceMode <None/mode string> - Default None. @see nonblock_read
+
+        @return <str or bytes depending on stream's mode> - The next complete record, empty if no complete record is available yet,
+            or None if the stream was closed on the other side and all records have been returned.
+
+            A partial final record (i.e. the last line had no trailing newline) is returned once the stream is closed.
+    '''
+    recordBuffer = _get_record_buffer(stream, framer, forceMode)
+
+    record = recordBuffer.popBlock()
+    if record is not None:
+        return record
+
+    if recordBuffer.isFinished is False:
+        nextData = nonblock_read(stream, forceMode=recordBuffer.dataType is bytes and 'b' or 't')
+        if nextData is None:
+            recordBuffer._finish()
+        elif nextData:
+            recordBuffer.addBlock(nextData)
+            record = recordBuffer.popBlock()
+            if record is not None:
+                return record
+
+    if recordBuffer.isFinished is True:
+        remainder = recordBuffer.popData()
+        if remainder:
+            return remainder
+
+        with _recordBuffersLock:
+            _recordBuffers.pop(stream, None)
+        return None
+
+    return recordBuffer.emptyStr
+
+
+def nonblock_readline(stream, forceMode=None):
+    '''
+        nonblock_readline - Read the next complete line from the given stream without blocking.
+
+            @see nonblock_read_record
+
+        @return <str or bytes depending on stream's mode> - The next line, including the trailing newline. Empty if no complete line is available yet,
+            or None if the stream was closed on the other side and all lines have been returned.
+    '''
+    return nonblock_read_record(stream, None, forceMode)
+
+
+def _get_record_buffer(stream, framer, forceMode):
+    '''
+        _get_record_buffer - Get (or create) the BackgroundReadData holding records read from #stream by nonblock_read_record
+    '''
+    with _recordBuffersLock:
+        try:
+            recordBuffer = _recordBuffers.get(stream, None)
+        except TypeError:
+            raise ValueError('Cannot hold records for stream %s, it does not support weak references.' %(repr(stream),))
+
+        if recordBuffer is not None:
+            if framer is not None and recordBuffer.framer is not framer:
+                raise ValueError('A different framer is already in use on stream %s' %(repr(stream),))
+            return recordBuffer
+
+        streamMode = resolve_stream_mode(stream, forceMode)
+
+        if framer is None:
+            framer = DelimiterFramer(streamMode is bytes and b'\n' or '\n')
+
+        recordBuffer = _recordBuffers[stream] = BackgroundReadData(streamMode, framer=framer)
+        return recordBuffer
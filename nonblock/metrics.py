@@ -0,0 +1,278 @@
+'''
+    Copyright (c) 2015-2016 Timothy Savannah under terms of LGPLv2. You should have received a copy of this LICENSE with this distribution.
+
+    metrics.py Contains optional I/O metrics (counters and timing histograms) for the background readers and writers
+
+
+'''
+# vim: ts=4 sw=4 expandtab
+
+import threading
+import time
+
+__all__ = ('IOMetrics', 'TimingHistogram', 'MetricsRegistry', 'get_metrics_registry', 'enable_metrics', 'disable_metrics', 'snapshot_metrics')
+
+# Number of buckets in a TimingHistogram. Bucket N holds durations under 2^N microseconds, the last holds everything longer (over ~18 minutes).
+_NUM_BUCKETS = 31
+
+
+class TimingHistogram(object):
+    '''
+        TimingHistogram - A histogram of durations, with power-of-two buckets in microseconds.
+
+        Attributes:
+
+            count  <int>   - Number of durations added
+
+            total  <float> - Sum of the durations, in seconds
+
+            min    <None/float> - Shortest duration, in seconds
+
+            max    <None/float> - Longest duration, in seconds
+
+            buckets <list<int>> - Number of durations in each bucket. Bucket N holds durations of at least 2^(N-1) and under 2^N microseconds.
+    '''
+
+    __slots__ = ('count', 'total', 'min', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * _NUM_BUCKETS
+
+    def add(self, seconds):
+        '''
+            add - Add a duration to the histogram
+
+                @param seconds <float> - The duration
+        '''
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+        bucket = int(seconds * 1000000.0).bit_length() if seconds > 0 else 0
+        if bucket >= _NUM_BUCKETS:
+            bucket = _NUM_BUCKETS - 1
+        self.buckets[bucket] += 1
+
+    def merge(self, other):
+        '''
+            merge - Add all the durations of another TimingHistogram into this one
+        '''
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+        buckets = self.buckets
+        for (i, num) in enumerate(other.buckets):
+            buckets[i] += num
+
+    def snapshot(self):
+        '''
+            snapshot - Get a copy of the histogram
+
+            @return dict - count, total, min, max and mean (seconds), and "buckets" as a list of tuple( <upper bound in seconds>, <count> ) for each non-empty bucket.
+                The upper bound of the last bucket is None.
+        '''
+        buckets = []
+        for (i, num) in enumerate(self.buckets):
+            if num:
+                if i == _NUM_BUCKETS - 1:
+                    upperBound = None
+                else:
+                    upperBound = (1 << i) / 1000000.0
+                buckets.append( (upperBound, num) )
+
+        return {
+            'count' : self.count,
+            'total' : self.total,
+            'min'   : self.min,
+            'max'   : self.max,
+            'mean'  : self.count and (self.total / self.count) or None,
+            'buckets' : buckets,
+        }
+
+
+class IOMetrics(object):
+    '''
+        IOMetrics - Counters and timing histograms for a single background read or write, or the totals of a kind of operation.
+
+            These are created by the MetricsRegistry, and only while metrics are enabled. Objects which support metrics have a "metrics" attribute,
+            which is None if metrics were disabled when the object was created, so the cost of disabled metrics is a single check.
+
+            Each update is also applied to the totals in the registry for this kind.
+
+        Attributes:
+
+            kind       <str>  - The kind of operation, e.x. "bgread" or "bgwrite"
+
+            startTime  <float> - When this was created
+
+            counters   <dict<str, int>> - Counters, by name
+
+            histograms <dict<str, TimingHistogram>> - Timing histograms, by name
+
+        @see BackgroundReadData , @see BackgroundWriteProcess for the metrics each records.
+    '''
+
+    def __init__(self, kind, totals=None):
+        '''
+            __init__ - Create an IOMetrics
+
+                @param kind <str> - The kind of operation
+
+                @param totals <None/IOMetrics> - If provided, every update is also applied to this
+        '''
+        self.kind = kind
+        self.startTime = time.time()
+
+        self.counters = {}
+        self.histograms = {}
+
+        self._totals = totals
+        self._lock = threading.Lock()
+
+    def count(self, name, amount=1):
+        '''
+            count - Add to a counter
+
+                @param name <str> - The counter name
+
+                @param amount <int> - Default 1. The amount to add
+        '''
+        with self._lock:
+            counters = self.counters
+            counters[name] = counters.get(name, 0) + amount
+
+        if self._totals is not None:
+            self._totals.count(name, amount)
+
+    def time(self, name, seconds):
+        '''
+            time - Add a duration to a timing histogram
+
+                @param name <str> - The histogram name
+
+                @param seconds <float> - The duration
+        '''
+        with self._lock:
+            histogram = self.histograms.get(name, None)
+            if histogram is None:
+                histogram = self.histograms[name] = TimingHistogram()
+            histogram.add(seconds)
+
+        if self._totals is not None:
+            self._totals.time(name, seconds)
+
+    def snapshot(self):
+        '''
+            snapshot - Get a copy of the current metrics
+
+            @return dict - "kind", "elapsed" (seconds since creation), "counters" (a dict of name -> value), and "histograms" (a dict of name -> @see TimingHistogram.snapshot)
+        '''
+        with self._lock:
+            return {
+                'kind' : self.kind,
+                'elapsed' : time.time() - self.startTime,
+                'counters' : dict(self.counters),
+                'histograms' : dict( [ (name, histogram.snapshot()) for (name, histogram) in self.histograms.items() ] ),
+            }
+
+    def reset(self):
+        '''
+            reset - Clear all counters and histograms, and restart "elapsed". Does not affect the registry totals.
+        '''
+        with self._lock:
+            self.startTime = time.time()
+            self.counters = {}
+            self.histograms = {}
+
+
+class MetricsRegistry(object):
+    '''
+        MetricsRegistry - Process-wide metrics. Holds whether metrics are enabled, and the totals of each kind of operation.
+
+            Use the shared registry via #get_metrics_registry, or the enable_metrics / disable_metrics / snapshot_metrics functions.
+    '''
+
+    def __init__(self):
+        self.enabled = False
+
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def create(self, kind):
+        '''
+            create - Create the metrics for a new operation, if enabled.
+
+                @param kind <str> - The kind of operation, e.x. "bgread"
+
+            @return <None/IOMetrics> - None if metrics are disabled
+        '''
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            totals = self._totals.get(kind, None)
+            if totals is None:
+                totals = self._totals[kind] = IOMetrics(kind)
+
+        return IOMetrics(kind, totals)
+
+    def snapshot(self):
+        '''
+            snapshot - Get a copy of the totals of each kind of operation, since metrics were first enabled (or last reset)
+
+            @return dict<str, dict> - kind -> @see IOMetrics.snapshot
+        '''
+        with self._lock:
+            totals = list(self._totals.values())
+
+        return dict( [ (kindTotals.kind, kindTotals.snapshot()) for kindTotals in totals ] )
+
+    def reset(self):
+        '''
+            reset - Clear all totals
+        '''
+        with self._lock:
+            for kindTotals in self._totals.values():
+                kindTotals.reset()
+
+
+_registry = MetricsRegistry()
+
+def get_metrics_registry():
+    '''
+        get_metrics_registry - Get the process-wide MetricsRegistry
+
+        @return <MetricsRegistry>
+    '''
+    return _registry
+
+
+def enable_metrics():
+    '''
+        enable_metrics - Enable metrics. Operations started after this call will record metrics.
+    '''
+    _registry.enabled = True
+
+
+def disable_metrics():
+    '''
+        disable_metrics - Disable metrics. Operations started after this call will not record metrics, those already running continue to.
+    '''
+    _registry.enabled = False
+
+
+def snapshot_metrics():
+    '''
+        snapshot_metrics - Get a copy of the process-wide metrics. @see MetricsRegistry.snapshot
+    '''
+    return _registry.snapshot()
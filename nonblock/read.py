@@ -7,11 +7,35 @@
 '''
 # vim: ts=4 sw=4 expandtab
 
+import codecs
+import errno
+import io
+import locale
+import os
 import select
+import socket
+import threading
+import time
+import weakref
 
-from .common import detect_stream_mode
+from .common import resolve_stream_mode, get_stream_fd, get_raw_stream_fd, wait_for_fds, _wrap_fd_nonblocking
+
+__all__ = ('nonblock_read', 'nonblock_readinto', 'nonblock_read_until', 'NonblockReader')
+
+# BULK_READ_SIZE - Max number of bytes requested per read syscall on the fast path
+BULK_READ_SIZE = 65536
+
+# Errnos which mean "no data right now" on a non-blocking fd
+_WOULD_BLOCK_ERRNOS = (errno.EAGAIN, errno.EWOULDBLOCK)
+
+# The incremental decoders for text streams read in bulk, so a multibyte sequence split across reads is carried over to the next call
+_textDecoders = weakref.WeakKeyDictionary()
+_textDecodersLock = threading.Lock()
+
+# Data read past the delimiter by nonblock_read_until, per stream, returned first by the next call
+_untilHeldData = weakref.WeakKeyDictionary()
+_untilHeldDataLock = threading.Lock()
 
-__all__ = ('nonblock_read', )
 
 def nonblock_read(stream, limit=None, forceMode=None):
     '''
@@ -22,29 +46,287 @@ def nonblock_read(stream, limit=None, forceMode=None):
             @param forceMode <None/mode string> - Default None. Will be autodetected if None. If you want to explicitly force a mode, provide 'b' for binary (bytes) or 't' for text (Str). This determines the return type.
 
             @return <str or bytes depending on stream's mode> - Any data available on the stream, or "None" if the stream was closed on the other side and all data has already been read.
+
+
+        NOTE: Binary streams backed by an fd (pipes, sockets, raw and buffered files) are read in bulk, using large non-blocking reads
+          until the device reports no more data is available. For pipes and files O_NONBLOCK is set on the underlying fd for each read only,
+          and the fd's original flags restored afterwards, so an fd shared with other code (e.x. a tty stdin) is left as it was found.
+          Sockets are read using MSG_DONTWAIT where available, and otherwise only after select reports them readable.
+          Other streams, including subclasses of these (e.x. ssl.SSLSocket), fall back to checking with select and reading a single byte at a time.
+
+        NOTE: Text streams are read the same way, from the binary buffer underlying a TextIOWrapper (or from the stream itself, with forceMode='t'),
+          and decoded with an incremental decoder using the stream's encoding and errors (or the locale's preferred encoding, and "strict").
+          "limit" then applies to the bytes read, so fewer characters may be returned. A TextIOWrapper's newlines are translated as for newline=None.
+          Data already read into the TextIOWrapper itself (e.g. by an earlier stream.readline()) is not seen.
     '''
-    bytesRead = 0
-    ret = []
+    return NonblockReader(stream, forceMode).read(limit)
+
+
+def nonblock_readinto(stream, buffer):
+    '''
+        nonblock_readinto - Read any data available on the given binary stream into a caller-provided buffer, without blocking.
+
+            Data is read directly into the buffer (with readinto / recv_into) where the stream supports it, so no new bytes objects are created.
+
+            @param stream <object> - A binary stream (like a file object or a socket)
+            @param buffer <bytearray/memoryview/etc> - A writable buffer. Data is read into it from the beginning, up to its size.
+
+            @return <None/int> - The number of bytes read (0 if no data is available), or "None" if the stream was closed on the other side and all data has already been read.
+    '''
+    return NonblockReader(stream, 'b').readinto(buffer)
+
+
+def nonblock_read_until(stream, size=None, delimiter=None, timeout=None, forceMode=None):
+    '''
+        nonblock_read_until - Read from the given stream until #size bytes have been read, or #delimiter is found, or the timeout expires.
+
+            Instead of polling, this waits (with poll or select) on the stream for the remaining time whenever no data is available,
+              so it returns as soon as the condition is met, and uses no CPU time while waiting.
+
+            @param stream <object> - A stream backed by a file descriptor (like a pipe, a socket, or sys.stdin)
+
+            @param size <None/int> - Default None. Return once this many bytes (or characters) have been read.
+
+            @param delimiter <None/str/bytes> - Default None. Return once this is read, up to and including it. Must match the stream's mode.
+
+                If both size and delimiter are given, whichever is met first ends the read. At least one must be given.
+
+            @param timeout <None/float> - Default None. Max number of seconds to wait, or None to wait until the condition is met or the stream is closed.
+
+            @param forceMode <None/mode string> - Default None. @see nonblock_read
+
+            @return <str or bytes depending on stream's mode> - The data read. This may be less than requested (or empty) if the timeout expired,
+                or the stream was closed. "None" if the stream was closed on the other side and all data has already been read.
+
+            @raises ValueError - If neither size nor delimiter is given, or they are invalid, or the stream is not backed by a file descriptor
+
+
+        NOTE: Only as much as #size is ever read from the stream. When a delimiter is given, data read past it is held,
+          and returned first by the next call to nonblock_read_until on this stream (but not by nonblock_read).
+    '''
+    if size is None and delimiter is None:
+        raise ValueError('nonblock_read_until requires a size, a delimiter, or both.')
+    if size is not None and size <= 0:
+        raise ValueError('Provided size must be "None" or a positive integer.')
+
+    reader = NonblockReader(stream, forceMode)
+
+    fd = reader.fd
+    if fd is None:
+        raise ValueError('nonblock_read_until can only read streams backed by a file descriptor, %s is not.' %(repr(stream),))
+
+    emptyStr = reader.emptyStr
+    if delimiter is not None:
+        if type(delimiter) is not reader.streamMode or not delimiter:
+            raise ValueError('Provided delimiter must be a non-empty %s, to match the stream.' %(reader.streamMode.__name__,))
+        delimiterLen = len(delimiter)
+
+    with _untilHeldDataLock:
+        try:
+            nextData = _untilHeldData.pop(stream, None)
+        except TypeError:
+            raise ValueError('nonblock_read_until cannot read stream %s, it does not support weak references.' %(repr(stream),))
+
+    if timeout is not None:
+        endTime = time.time() + timeout
+
+    parts = []
+    dataLen = 0
+    # The end of the data read so far which may hold the start of a delimiter split across reads
+    tail = emptyStr
+
+    while True:
+        if nextData:
+            end = None
+
+            if delimiter is not None:
+                searchData = tail + nextData
+                idx = searchData.find(delimiter)
+                if idx != -1:
+                    end = dataLen - len(tail) + idx + delimiterLen
+                elif delimiterLen > 1:
+                    tail = searchData[-(delimiterLen - 1):]
+
+            parts.append(nextData)
+            dataLen += len(nextData)
+
+            if size is not None and dataLen >= size and (end is None or end > size):
+                end = size
+
+            if end is not None:
+                data = emptyStr.join(parts)
+                if end < dataLen:
+                    with _untilHeldDataLock:
+                        _untilHeldData[stream] = data[end:]
+                    data = data[:end]
+                return data
+
+        if size is not None:
+            nextData = reader.read(size - dataLen)
+        else:
+            nextData = reader.read()
+
+        if nextData is None:
+            # Stream has been closed
+            if not parts:
+                return None
+            break
+
+        if not nextData:
+            if timeout is None:
+                wait_for_fds([fd])
+            else:
+                remaining = endTime - time.time()
+                if remaining <= 0:
+                    break
+                wait_for_fds([fd], (), remaining)
+
+    return emptyStr.join(parts)
+
+
+class NonblockReader(object):
+    '''
+        NonblockReader - Reads a single stream without blocking. @see nonblock_read
+
+            Everything needed to read the stream - its mode, its fd, and how to read it without blocking - is resolved once, upon creation.
+            Each call to #read or #readinto then only does the I/O. Use this instead of nonblock_read when reading the same stream repeatedly.
+
+            If the stream's blocking mode or timeout is changed after creation, create a new NonblockReader.
+
+        Attributes:
+
+            stream     <object> - The stream being read
 
-    if forceMode:
-        if 'b' in forceMode:
-            streamMode = bytes
-        elif 't' in forceMode:
-            streamMode = str
+            streamMode <type>   - bytes or str, the type returned by #read
+
+            fd         <None/int> - The fd backing the stream, or None
+    '''
+
+    def __init__(self, stream, forceMode=None):
+        '''
+            __init__ - Create a NonblockReader
+
+                @param stream <object> - A stream (like a file object or a socket)
+
+                @param forceMode <None/mode string> - Default None. @see nonblock_read
+
+            @raises ValueError - If the stream implements neither "read" nor "recv"
+        '''
+        self.stream = stream
+        self.streamMode = streamMode = resolve_stream_mode(stream, forceMode)
+        self.emptyStr = streamMode()
+        self.fd = get_stream_fd(stream)
+
+        self._readChunk = None
+        self._readInto = None
+        self._readByte = None
+        self._decoder = None
+        self._drain = None
+
+        if streamMode is bytes:
+            self._readChunk = _get_bulk_read_func(stream, self)
+            if self._readChunk is not None:
+                self._readInto = _get_bulk_readinto_func(stream, self._drain)
         else:
-            streamMode = detect_stream_mode(stream)
-    else:
-        streamMode = detect_stream_mode(stream)
+            if isinstance(stream, io.TextIOBase):
+                # Read the binary buffer under the text layer, if there is one
+                binaryStream = getattr(stream, 'buffer', None)
+            else:
+                binaryStream = stream
+
+            if binaryStream is not None:
+                self._readChunk = _get_bulk_read_func(binaryStream, self)
+                if self._readChunk is not None:
+                    self._decoder = _get_text_decoder(stream)
+
+        if self._readChunk is None:
+            # Determine if our function is "read" (file-like objects) or "recv" (socket-like objects)
+            if hasattr(stream, 'read'):
+                self._readByte = lambda : stream.read(1)
+            elif hasattr(stream, 'recv'):
+                self._readByte = lambda : stream.recv(1)
+            else:
+                raise ValueError('Cannot determine how to read from provided stream, %s.' %(repr(stream),))
+
+    def hasBufferedData(self):
+        '''
+            hasBufferedData - Check if data is held in the stream's (python) buffer, which has not been returned yet.
+                This is only possible when a read was limited to less than what the buffer held. Waiting on #fd does not see this data,
+                so callers waiting for the stream to be readable must check this first.
+
+            @return <bool> - True if the next read will return data without reading the fd
+        '''
+        return self._drain is not None and self._drain.numBuffered > 0
 
-    emptyStr = streamMode()
+    def read(self, limit=None):
+        '''
+            read - Read any data available on the stream without blocking.
 
-    # Determine if our function is "read" (file-like objects) or "recv" (socket-like objects)
-    if hasattr(stream, 'read'):
-        readByte = lambda : stream.read(1)
-    elif hasattr(stream, 'recv'):
-        readByte = lambda : stream.recv(1)
-    else:
-        raise ValueError('Cannot determine how to read from provided stream, %s.' %(repr(stream),))
+                @param limit <None/int> - Max number of bytes to read. If None or 0, will read as much data is available.
+
+            @return <str or bytes depending on stream's mode> - Any data available on the stream, or "None" if the stream was closed on the other side and all data has already been read.
+        '''
+        if self._readChunk is not None:
+            if self._decoder is not None:
+                return _decoding_bulk_read(self._readChunk, self._decoder, limit)
+            return _bulk_read(self._readChunk, limit)
+
+        return _bytewise_read(self.stream, self._readByte, self.emptyStr, limit)
+
+    def readinto(self, buffer):
+        '''
+            readinto - Read any data available on the stream into a caller-provided buffer, without blocking. Binary streams only.
+
+                @param buffer <bytearray/memoryview/etc> - A writable buffer. Data is read into it from the beginning, up to its size.
+
+            @return <None/int> - The number of bytes read (0 if no data is available), or "None" if the stream was closed on the other side and all data has already been read.
+
+            @raises ValueError - If the stream is not in binary mode
+        '''
+        if self.streamMode is not bytes:
+            raise ValueError('readinto is only available on binary streams.')
+
+        view = memoryview(buffer)
+        if view.itemsize != 1 or view.ndim != 1:
+            view = view.cast('B')
+
+        readInto = self._readInto
+        if readInto is None:
+            # Stream does not support reading into a buffer without blocking, copy in what read gives
+            data = self.read(len(view))
+            if data is None:
+                return None
+            dataLen = len(data)
+            view[:dataLen] = data
+            return dataLen
+
+        size = len(view)
+        bytesRead = 0
+        while bytesRead < size:
+            count = readInto(view[bytesRead:])
+            if count is None:
+                # No more data available right now
+                break
+            if count == 0:
+                # Stream has been closed
+                if bytesRead == 0:
+                    return None
+                break
+            bytesRead += count
+
+        return bytesRead
+
+
+def _bytewise_read(stream, readByte, emptyStr, limit):
+    '''
+        _bytewise_read - The pure-python read path. Checks with select if data is available, and reads one byte (or character) at a time.
+
+            Used for streams which cannot be read in bulk.
+
+            @see nonblock_read
+    '''
+    bytesRead = 0
+    ret = []
 
     while True:
         # Check if data on stream is immediately available
@@ -71,3 +353,272 @@ def nonblock_read(stream, limit=None, forceMode=None):
     return emptyStr.join(ret)
 
 
+def _bulk_read(readChunk, limit):
+    '''
+        _bulk_read - The fast read path. Calls #readChunk with a large size until it reports no more data is available.
+
+            @param readChunk <function> - A function returned by #_get_bulk_read_func
+
+            @param limit <None/int> - Max number of bytes to read. None or 0 for everything available.
+
+            @see nonblock_read
+    '''
+    bytesRead = 0
+    ret = []
+
+    while True:
+        if limit:
+            readSize = min(limit - bytesRead, BULK_READ_SIZE)
+        else:
+            readSize = BULK_READ_SIZE
+
+        data = readChunk(readSize)
+        if data is None:
+            # No more data available right now
+            break
+
+        if not data:
+            # Stream has been closed
+            if not ret:
+                return None
+            # Return data collected. Next call will return None.
+            break
+
+        bytesRead += len(data)
+        ret.append(data)
+
+        if limit and bytesRead >= limit:
+            break
+
+    if len(ret) == 1:
+        return ret[0]
+    return b''.join(ret)
+
+
+def _decoding_bulk_read(readChunk, decoder, limit):
+    '''
+        _decoding_bulk_read - The fast read path for text streams. Reads bytes in bulk and decodes them with #decoder.
+
+            @param decoder <codecs.IncrementalDecoder> - A decoder returned by #_get_text_decoder
+
+            @see _bulk_read
+    '''
+    data = _bulk_read(readChunk, limit)
+    if data is None:
+        # Stream has been closed, return anything still held by the decoder. An incomplete sequence raises UnicodeDecodeError if errors="strict".
+        return decoder.decode(b'', True) or None
+
+    return decoder.decode(data)
+
+
+def _get_text_decoder(stream):
+    '''
+        _get_text_decoder - Get (or create) the incremental decoder for a text stream read in bulk.
+
+            The decoder is shared by all readers of #stream, so a partial multibyte sequence carries over between calls to nonblock_read.
+    '''
+    with _textDecodersLock:
+        try:
+            decoder = _textDecoders.get(stream, None)
+        except TypeError:
+            # Stream does not support weak references, so the decoder is only kept by this reader
+            return _create_text_decoder(stream)
+
+        if decoder is None:
+            decoder = _textDecoders[stream] = _create_text_decoder(stream)
+
+        return decoder
+
+
+def _create_text_decoder(stream):
+    '''
+        _create_text_decoder - Create an incremental decoder using the encoding and errors of #stream
+    '''
+    encoding = getattr(stream, 'encoding', None) or locale.getpreferredencoding(False)
+    errors = getattr(stream, 'errors', None) or 'strict'
+
+    decoder = codecs.getincrementaldecoder(encoding)(errors)
+    if isinstance(stream, io.TextIOBase):
+        # Match the universal newlines a TextIOWrapper performs by default
+        decoder = io.IncrementalNewlineDecoder(decoder, True)
+
+    return decoder
+
+
+def _get_bulk_read_func(stream, nonblockReader=None):
+    '''
+        _get_bulk_read_func - Determine how to read the given stream in bulk without blocking.
+
+            @param stream <object> - A binary stream
+
+            @param nonblockReader <None/NonblockReader> - If provided and #stream is a buffered reader, its "_drain" is set to the _BufferedDrain used
+
+        @return <None/function> - None if the stream does not support bulk non-blocking reads, otherwise a function which takes a size,
+            and returns up to that many bytes, an empty bytes on end-of-stream, or None if no data is available right now.
+
+        Only streams whose data is exactly the bytes of their fd are read this way (@see nonblock.common.get_raw_stream_fd), as the fd is read directly.
+          Subclasses (e.x. ssl.SSLSocket, or a RawIOBase with its own read) and other wrappers use the pure-python path.
+    '''
+    fd = get_raw_stream_fd(stream)
+    if fd is None:
+        return None
+
+    if type(stream) is socket.socket:
+        timeout = stream.gettimeout()
+        if timeout is None and hasattr(socket, 'MSG_DONTWAIT'):
+            # Blocking socket, do a one-off non-blocking recv without changing the socket's state
+            return lambda size : _call_nonblocking(stream.recv, size, socket.MSG_DONTWAIT)
+        if timeout == 0:
+            # Already non-blocking
+            return lambda size : _call_nonblocking(stream.recv, size)
+        # Socket has a timeout (python will wait on the socket within recv), so only recv when select says it is ready
+        return lambda size : _select_then_read(stream, stream.recv, size)
+
+    if isinstance(stream, io.RawIOBase):
+        readFunc = _wrap_fd_nonblocking(fd, os.read)
+        if readFunc is None:
+            return None
+        return lambda size : _call_nonblocking(readFunc, fd, size)
+
+    if hasattr(stream, 'peek') and hasattr(stream, 'raw'):
+        # Buffered reader - we must first drain anything already in its buffer, or we would lose (or reorder) that data.
+        readFunc = _wrap_fd_nonblocking(fd, os.read)
+        if readFunc is None:
+            return None
+        drain = _BufferedDrain(stream, fd)
+        if nonblockReader is not None:
+            nonblockReader._drain = drain
+        return lambda size : _read_buffered_then_fd(drain, readFunc, fd, size)
+
+    return None
+
+
+def _get_bulk_readinto_func(stream, drain=None):
+    '''
+        _get_bulk_readinto_func - Determine how to read the given stream into a buffer without blocking.
+
+            @param stream <object> - A binary stream
+
+            @param drain <None/_BufferedDrain> - If #stream is a buffered reader, the _BufferedDrain already created for it by #_get_bulk_read_func
+
+        @return <None/function> - None if the stream does not support this, otherwise a function which takes a memoryview to fill, and returns
+            the number of bytes read, 0 on end-of-stream, or None if no data is available right now. @see _get_bulk_read_func
+    '''
+    fd = get_raw_stream_fd(stream)
+    if fd is None:
+        return None
+
+    if type(stream) is socket.socket:
+        timeout = stream.gettimeout()
+        if timeout is None and hasattr(socket, 'MSG_DONTWAIT'):
+            return lambda view : _call_nonblocking(stream.recv_into, view, 0, socket.MSG_DONTWAIT)
+        if timeout == 0:
+            return lambda view : _call_nonblocking(stream.recv_into, view)
+        return lambda view : _select_then_read(stream, stream.recv_into, view)
+
+    if isinstance(stream, io.RawIOBase):
+        readintoFunc = _wrap_fd_nonblocking(fd, stream.readinto)
+        if readintoFunc is None:
+            return None
+        # Non-blocking raw readinto returns None when no data is available
+        return lambda view : _call_nonblocking(readintoFunc, view)
+
+    if hasattr(stream, 'peek') and hasattr(stream, 'raw'):
+        readintoFunc = _wrap_fd_nonblocking(fd, stream.raw.readinto)
+        if readintoFunc is None:
+            return None
+        if drain is None:
+            drain = _BufferedDrain(stream, fd)
+        return lambda view : _readinto_buffered_then_raw(drain, readintoFunc, view)
+
+    return None
+
+
+def _call_nonblocking(func, *args):
+    '''
+        _call_nonblocking - Call a non-blocking read function, translating "would block" errors into a return of None
+    '''
+    try:
+        return func(*args)
+    except (OSError, IOError, socket.error) as e:
+        if e.args and e.args[0] in _WOULD_BLOCK_ERRNOS:
+            return None
+        raise
+
+
+def _select_then_read(stream, readFunc, size):
+    '''
+        _select_then_read - Read up to #size bytes with a single call to #readFunc, only if select reports #stream is readable.
+    '''
+    (readyToRead, junk1, junk2) = select.select([stream], [], [], 0)
+    if not readyToRead:
+        return None
+    return readFunc(size)
+
+
+class _BufferedDrain(object):
+    '''
+        _BufferedDrain - The data a buffered reader held when reading it without blocking began, which must be returned before anything read directly from its fd.
+
+            The buffer is measured once, upon creation (if empty, peek fills it with a single read of the non-blocking fd), and never refilled afterwards,
+            as all further reads go directly to the fd. So the only data left in the buffer, where waiting on the fd would not see it, is #numBuffered.
+    '''
+
+    __slots__ = ('stream', 'numBuffered')
+
+    def __init__(self, stream, fd):
+        self.stream = stream
+        self.numBuffered = _wrap_fd_nonblocking(fd, _peek_buffered)(stream)
+
+    def read(self, size):
+        '''
+            read - Read up to #size bytes of the held data. No syscall is made, as no more than is held is requested.
+        '''
+        data = self.stream.read(min(self.numBuffered, size))
+        self.numBuffered -= len(data)
+        return data
+
+    def readinto(self, view):
+        '''
+            readinto - Copy up to len(#view) bytes of the held data into #view
+        '''
+        if self.numBuffered < len(view):
+            view = view[:self.numBuffered]
+        count = self.stream.readinto(view)
+        self.numBuffered -= count
+        return count
+
+
+def _read_buffered_then_fd(drain, readFunc, fd, size):
+    '''
+        _read_buffered_then_fd - Return data held in a buffered reader's buffer (@see _BufferedDrain), otherwise read directly from the fd with #readFunc (a non-blocking os.read).
+    '''
+    if drain.numBuffered:
+        return drain.read(size)
+
+    return _call_nonblocking(readFunc, fd, size)
+
+
+def _readinto_buffered_then_raw(drain, readintoFunc, view):
+    '''
+        _readinto_buffered_then_raw - Copy data held in a buffered reader's buffer into #view (@see _BufferedDrain), otherwise read directly into it with #readintoFunc (a non-blocking raw readinto).
+    '''
+    if drain.numBuffered:
+        return drain.readinto(view)
+
+    return _call_nonblocking(readintoFunc, view)
+
+
+def _peek_buffered(stream):
+    '''
+        _peek_buffered - Get the number of bytes held in a buffered reader's buffer.
+
+            peek returns what is buffered, or performs a single (non-blocking) read to fill the buffer if it is empty. So this must only be used
+            before reading the fd directly, never after, or data it reads into the buffer would be invisible to anything waiting on the fd.
+    '''
+    try:
+        return len(stream.peek(0))
+    except (OSError, IOError) as e:
+        if e.args and e.args[0] in _WOULD_BLOCK_ERRNOS:
+            return 0
+        raise
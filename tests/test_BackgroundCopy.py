@@ -0,0 +1,71 @@
+'''
+    Tests for nonblock.BackgroundCopy
+'''
+# vim: ts=4 sw=4 expandtab
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from nonblock import bgcopy
+
+
+class TestBackgroundCopy(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.data = os.urandom(100000) * 3
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def _path(self, name):
+        return os.path.join(self.tempDir, name)
+
+    def test_copyRawFiles(self):
+        with open(self._path('src'), 'wb') as f:
+            f.write(self.data)
+
+        with open(self._path('src'), 'rb') as src:
+            with open(self._path('dst'), 'wb') as dst:
+                t = bgcopy(src, dst, ioPrio=1)
+                t.join()
+        self.assertTrue(t.finished)
+        self.assertNotEqual(t.copyMethod, 'buffer')
+
+        with open(self._path('dst'), 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_copyFromGzip(self):
+        with gzip.open(self._path('src.gz'), 'wb') as f:
+            f.write(self.data)
+
+        src = gzip.open(self._path('src.gz'), 'rb')
+        with open(self._path('dst'), 'wb') as dst:
+            t = bgcopy(src, dst, ioPrio=1, closeSource=True)
+            t.join()
+        self.assertTrue(t.finished)
+        self.assertEqual(t.copyMethod, 'buffer')
+
+        with open(self._path('dst'), 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_copyToGzip(self):
+        with open(self._path('src'), 'wb') as f:
+            f.write(self.data)
+
+        with open(self._path('src'), 'rb') as src:
+            dst = gzip.open(self._path('dst.gz'), 'wb')
+            t = bgcopy(src, dst, ioPrio=1, closeWhenFinished=True)
+            t.join()
+        self.assertTrue(t.finished)
+        self.assertEqual(t.copyMethod, 'buffer')
+
+        with gzip.open(self._path('dst.gz'), 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
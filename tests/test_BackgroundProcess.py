@@ -0,0 +1,73 @@
+'''
+    Tests for nonblock.BackgroundProcess
+'''
+# vim: ts=4 sw=4 expandtab
+
+import io
+import os
+import subprocess
+import sys
+import unittest
+
+from nonblock import bgread_process, BackgroundReadReactor
+
+
+def _popen(code, **kwargs):
+    return subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs)
+
+
+class TestBgreadProcess(unittest.TestCase):
+
+    def setUp(self):
+        self.reactor = BackgroundReadReactor()
+
+    def tearDown(self):
+        self.reactor.stop()
+
+    def test_outputAndReturncode(self):
+        code = 'import sys; sys.stdout.write("out" * 30000); sys.stderr.write("err"); sys.exit(3)'
+        results = bgread_process(_popen(code), reactor=self.reactor)
+
+        self.assertTrue(results.wait(10))
+        self.assertTrue(results.error is None)
+        self.assertEqual(results.returncode, 3)
+        self.assertEqual(results.stdout.data, b'out' * 30000)
+        self.assertEqual(results.stderr.data, b'err')
+        self.assertTrue(results.stdout.isFinished)
+
+    def test_tee(self):
+        teeStdout = io.BytesIO()
+        teeStderr = io.BytesIO()
+        code = 'import sys; sys.stdout.write("out"); sys.stdout.flush(); sys.stderr.write("err")'
+        results = bgread_process(_popen(code), teeStdout=teeStdout, teeStderr=teeStderr, reactor=self.reactor)
+
+        self.assertTrue(results.wait(10))
+        self.assertEqual(results.returncode, 0)
+        self.assertEqual(teeStdout.getvalue(), b'out')
+        self.assertEqual(teeStderr.getvalue(), b'err')
+        # Teeing does not consume the data
+        self.assertEqual(results.stdout.data, b'out')
+
+    def test_onlyStdoutPiped(self):
+        with open(os.devnull, 'wb') as devnull:
+            popen = subprocess.Popen([sys.executable, '-c', 'print("hi")'], stdout=subprocess.PIPE, stderr=devnull)
+            results = bgread_process(popen, reactor=self.reactor)
+
+            self.assertTrue(results.wait(10))
+
+        self.assertTrue(results.stderr is None)
+        self.assertEqual(results.stdout.data.strip(), b'hi')
+
+    def test_waitTimeout(self):
+        popen = _popen('import time; time.sleep(5)')
+        try:
+            results = bgread_process(popen, reactor=self.reactor)
+            self.assertFalse(results.wait(.05))
+            self.assertTrue(results.returncode is None)
+        finally:
+            popen.kill()
+        self.assertTrue(results.wait(10))
+
+
+if __name__ == '__main__':
+    unittest.main()
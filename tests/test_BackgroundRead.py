@@ -0,0 +1,273 @@
+'''
+    Tests for nonblock.BackgroundRead
+'''
+# vim: ts=4 sw=4 expandtab
+
+import os
+import time
+import unittest
+
+from nonblock import bgread, BackgroundReadReactor, BackgroundReadPriority
+from nonblock.BackgroundRead import BackgroundReadData
+
+
+def _wait_for(func, timeout=5):
+    endTime = time.time() + timeout
+    while time.time() < endTime:
+        if func():
+            return True
+        time.sleep(.01)
+    return func()
+
+
+class TestPausedWriter(unittest.TestCase):
+    '''
+        The writer sends data and pauses without closing, so everything must be delivered without waiting for more to arrive
+    '''
+
+    def setUp(self):
+        (self.readFd, self.writeFd) = os.pipe()
+        self.stream = os.fdopen(self.readFd, 'rb')
+        self.reactor = None
+        self.results = None
+
+    def tearDown(self):
+        os.close(self.writeFd)
+        # Let the reader see the end of the stream and close it, so its fd cannot be reused by the next test while still being read
+        if self.results is not None:
+            _wait_for(lambda : self.results.isFinished)
+        if self.reactor is not None:
+            self.reactor.stop()
+
+    def _checkAllRead(self, **kwargs):
+        self.results = results = bgread(self.stream, **kwargs)
+        os.write(self.writeFd, b'x' * 65536)
+
+        self.assertTrue(_wait_for(lambda : len(results) == 65536), 'Only read %d of 65536' %(len(results),))
+
+    def test_polling(self):
+        self._checkAllRead()
+
+    def test_eventDriven(self):
+        self._checkAllRead(eventDriven=True)
+
+    def test_reactor(self):
+        self.reactor = BackgroundReadReactor()
+        self._checkAllRead(reactor=self.reactor)
+
+    def test_reactorHighWaterMark(self):
+        self.reactor = BackgroundReadReactor()
+        self.results = results = self.reactor.bgread(self.stream, highWaterMark=10)
+        os.write(self.writeFd, b'x' * 64000)
+
+        # Consume as it arrives, until all is read or no progress is made for a while
+        received = 0
+        lastProgress = time.time()
+        while received < 64000 and time.time() - lastProgress < 2:
+            data = results.popData()
+            if data:
+                received += len(data)
+                lastProgress = time.time()
+            else:
+                time.sleep(.0001)
+
+        self.assertEqual(received, 64000)
+
+
+class TestEventDriven(unittest.TestCase):
+
+    def setUp(self):
+        (self.readFd, self.writeFd) = os.pipe()
+
+    def tearDown(self):
+        os.close(self.writeFd)
+
+    def _timeUntilRead(self, results, numWrites):
+        start = time.time()
+        for i in range(numWrites):
+            os.write(self.writeFd, b'x')
+            while len(results) < i + 1:
+                time.sleep(.0005)
+        return time.time() - start
+
+    def test_lowLatencyByDefault(self):
+        results = bgread(os.fdopen(self.readFd, 'rb'), eventDriven=True)
+        # Each of these took at least the .03 pollTime when it was used as a batching delay
+        elapsed = self._timeUntilRead(results, 10)
+        self.assertTrue(elapsed < .25, 'Took %f seconds' %(elapsed,))
+
+    def test_batchDelay(self):
+        results = bgread(os.fdopen(self.readFd, 'rb'), eventDriven=True, batchDelay=.05)
+        elapsed = self._timeUntilRead(results, 2)
+        self.assertTrue(elapsed >= .1, 'Took only %f seconds' %(elapsed,))
+
+    def test_batchDelayRequiresEventDriven(self):
+        stream = os.fdopen(self.readFd, 'rb')
+        try:
+            self.assertRaises(ValueError, bgread, stream, batchDelay=.05)
+        finally:
+            stream.close()
+
+
+class TestBinaryData(unittest.TestCase):
+    '''
+        Data copied out of the binary buffer must be the contents, not a repr of the view
+    '''
+
+    def test_copiedData(self):
+        (readFd, writeFd) = os.pipe()
+        results = bgread(os.fdopen(readFd, 'rb'), eventDriven=True)
+        os.write(writeFd, b'first')
+        self.assertTrue(_wait_for(lambda : len(results) == 5))
+        os.write(writeFd, b'second')
+        os.close(writeFd)
+        self.assertTrue(_wait_for(lambda : results.isFinished))
+
+        self.assertEqual(results.data, b'firstsecond')
+        self.assertEqual(results.blocks, [b'first', b'second'])
+        self.assertEqual(results.popBlock(), b'first')
+        self.assertEqual(results.data, b'second')
+
+    def test_blocksSnapshot(self):
+        (readFd, writeFd) = os.pipe()
+        results = bgread(os.fdopen(readFd, 'rb'), eventDriven=True)
+        os.write(writeFd, b'first')
+        self.assertTrue(_wait_for(lambda : len(results) == 5))
+
+        blocks = results.blocks
+        self.assertEqual(blocks, [b'first'])
+        # Cached while nothing new has been read
+        self.assertTrue(results.blocks is blocks)
+
+        os.write(writeFd, b'second')
+        self.assertTrue(_wait_for(lambda : len(results) == 11))
+        self.assertEqual(results.blocks, [b'first', b'second'])
+        # The earlier snapshot is unchanged
+        self.assertEqual(blocks, [b'first'])
+
+        self.assertEqual(results.popBlock(), b'first')
+        self.assertEqual(results.blocks, [b'second'])
+
+        os.write(writeFd, b'third')
+        os.close(writeFd)
+        self.assertTrue(_wait_for(lambda : results.isFinished))
+        self.assertEqual(results.blocks, [b'second', b'third'])
+
+
+class TestSpill(unittest.TestCase):
+    '''
+        Once past the spillThreshold the data is held in a file, and must read back the same as if held in memory
+    '''
+
+    def test_spilledData(self):
+        results = BackgroundReadData(bytes, spillThreshold=10000)
+        results.addBlock(b'a' * 1000)
+        self.assertFalse(results.isSpilled)
+
+        # The buffer must grow beyond the threshold to hold this
+        results.addBlock(b'b' * 8000)
+        self.assertTrue(results.isSpilled)
+        self.assertEqual(len(results), 9000)
+        self.assertEqual(bytes(results.data), b'a' * 1000 + b'b' * 8000)
+
+        popped = results.popData()
+        self.assertEqual(popped, b'a' * 1000 + b'b' * 8000)
+        self.assertEqual(len(results), 0)
+
+        # Reading more after the pop must not change what was popped
+        results.addBlock(b'c' * 5000)
+        self.assertEqual(bytes(results.data), b'c' * 5000)
+        self.assertEqual(popped, b'a' * 1000 + b'b' * 8000)
+        self.assertEqual(results.popBlock(), b'c' * 5000)
+
+    def test_bgread(self):
+        (readFd, writeFd) = os.pipe()
+        results = bgread(os.fdopen(readFd, 'rb'), eventDriven=True, spillThreshold=1 << 16)
+        expected = bytes(bytearray(range(256))) * 1024
+        os.write(writeFd, expected)
+        os.close(writeFd)
+
+        self.assertTrue(_wait_for(lambda : results.isFinished))
+        self.assertTrue(results.isSpilled)
+        self.assertEqual(bytes(results.data), expected)
+        self.assertEqual(results.popData(), expected)
+
+
+class TestReadPriority(unittest.TestCase):
+
+    def _timeRead(self, ioPrio, size):
+        (readFd, writeFd) = os.pipe()
+        start = time.time()
+        results = bgread(os.fdopen(readFd, 'rb'), ioPrio=ioPrio)
+        os.write(writeFd, b'x' * size)
+        os.close(writeFd)
+        self.assertTrue(_wait_for(lambda : len(results) == size))
+        elapsed = time.time() - start
+        self.assertTrue(_wait_for(lambda : results.isFinished))
+        return elapsed
+
+    def test_maxBytesPerSec(self):
+        ioPrio = BackgroundReadPriority(.01, 65535, 100, maxBytesPerSec=100000)
+        # All but the first block must wait for the rate
+        elapsed = self._timeRead(ioPrio, 50000)
+        self.assertTrue(elapsed >= .4, 'Read 50000 bytes at 100000/s in only %f seconds' %(elapsed,))
+        self.assertTrue(elapsed < 1.5, 'Took %f seconds' %(elapsed,))
+
+    def test_unlimited(self):
+        ioPrio = BackgroundReadPriority(.01, 65535, 100)
+        elapsed = self._timeRead(ioPrio, 50000)
+        self.assertTrue(elapsed < .3, 'Took %f seconds' %(elapsed,))
+
+
+class TestReactorRobustness(unittest.TestCase):
+    '''
+        Problems with one stream must not stop the reactor from serving the others
+    '''
+
+    def setUp(self):
+        self.reactor = BackgroundReadReactor()
+
+    def tearDown(self):
+        self.reactor.stop()
+
+    def test_stopAfterFinished(self):
+        (readFd, writeFd) = os.pipe()
+        results = self.reactor.bgread(os.fdopen(readFd, 'rb'))
+        os.write(writeFd, b'done')
+        os.close(writeFd)
+        self.assertTrue(_wait_for(lambda : results.isFinished))
+
+        # The stream has been closed and unregistered, so there is nothing left to remove
+        results.stop()
+
+        (readFd, writeFd) = os.pipe()
+        otherResults = self.reactor.bgread(os.fdopen(readFd, 'rb'))
+        os.write(writeFd, b'still serving')
+        os.close(writeFd)
+
+        self.assertTrue(_wait_for(lambda : otherResults.isFinished))
+        self.assertEqual(otherResults.data, b'still serving')
+
+    def test_failingStream(self):
+        (readFd, writeFd) = os.pipe()
+        badResults = self.reactor.bgread(os.fdopen(readFd, 'rb'))
+
+        def _fail(*args, **kwargs):
+            raise RuntimeError('Cannot read')
+        badResults._getReadLimit = _fail
+        os.write(writeFd, b'x')
+
+        self.assertTrue(_wait_for(lambda : badResults.error is not None))
+        os.close(writeFd)
+
+        (readFd, writeFd) = os.pipe()
+        otherResults = self.reactor.bgread(os.fdopen(readFd, 'rb'))
+        os.write(writeFd, b'still serving')
+        os.close(writeFd)
+
+        self.assertTrue(_wait_for(lambda : otherResults.isFinished))
+        self.assertEqual(otherResults.data, b'still serving')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,522 @@
+'''
+    Tests for nonblock.BackgroundWrite
+'''
+# vim: ts=4 sw=4 expandtab
+
+import array
+import gzip
+import io
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from nonblock.common import set_fd_nonblocking
+from nonblock.BackgroundWrite import _ChunkSizeTuner, _MIN_CHUNK_SIZE, _MAX_CHUNK_SIZE
+from nonblock import bgwrite, wait_all, set_io_budget, BackgroundIOPriority, BackgroundWriteScheduler, BackgroundWriter, DataChunks
+
+
+class TestBatchedWrite(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.records = [ ('record %d\n' %(i,)).encode('ascii') for i in range(5000) ]
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_batchedRawFile(self):
+        path = os.path.join(self.tempDir, 'raw')
+        with open(path, 'wb') as f:
+            f.write(b'HEAD')
+            t = bgwrite(f, self.records, ioPrio=1, batchSize=4096)
+            t.join()
+        self.assertTrue(t.finished)
+
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'HEAD' + b''.join(self.records))
+
+    def test_batchedGzipFile(self):
+        # GzipFile has a fileno, but its data is not the bytes of the fd
+        path = os.path.join(self.tempDir, 'records.gz')
+        f = gzip.open(path, 'wb')
+        t = bgwrite(f, self.records, ioPrio=1, batchSize=4096, closeWhenFinished=True)
+        t.join()
+        self.assertTrue(t.finished)
+
+        with gzip.open(path, 'rb') as f:
+            self.assertEqual(f.read(), b''.join(self.records))
+
+    def test_batchedBytesIO(self):
+        out = io.BytesIO()
+        t = bgwrite(out, self.records, ioPrio=1, batchSize=4096)
+        t.join()
+        self.assertEqual(out.getvalue(), b''.join(self.records))
+
+
+class _NoneReturningWriter(object):
+    '''
+        A file-like wrapper with a fileno, whose write returns None (as python 2 files and many wrappers do)
+    '''
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.numWrites = 0
+
+    def fileno(self):
+        return self.fd
+
+    def write(self, data):
+        self.numWrites += 1
+        os.write(self.fd, data)
+
+
+def _read_all_later(readFunc, delay=.05):
+    '''
+        Start a thread which waits #delay (so the writer fills the pipe or socket, and sees it would block), then reads until end of stream.
+
+        @return - A function to join the thread and get the data read
+    '''
+    received = []
+
+    def _reader():
+        time.sleep(delay)
+        while True:
+            data = readFunc(65536)
+            if not data:
+                break
+            received.append(data)
+
+    thread = threading.Thread(target=_reader)
+    thread.start()
+
+    def _join():
+        thread.join(10)
+        return b''.join(received)
+    return _join
+
+
+class TestNonblockingWrite(unittest.TestCase):
+    '''
+        Writes to non-blocking streams resume after partial writes, and wait out EAGAIN, instead of losing or repeating data
+    '''
+
+    def setUp(self):
+        self.data = os.urandom(1024 * 1024)
+
+    def test_wrapperReturningNone(self):
+        (readFd, writeFd) = os.pipe()
+        set_fd_nonblocking(writeFd)
+        writer = _NoneReturningWriter(writeFd)
+        try:
+            t = bgwrite(writer, b'hello', ioPrio=1)
+            self.assertTrue(t.wait(5))
+            self.assertTrue(t.finished)
+            self.assertEqual(writer.numWrites, 1)
+            self.assertEqual(os.read(readFd, 100), b'hello')
+        finally:
+            os.close(readFd)
+            os.close(writeFd)
+
+    def test_socketSend(self):
+        (sender, receiver) = socket.socketpair()
+        sender.setblocking(False)
+        try:
+            join = _read_all_later(receiver.recv)
+            t = bgwrite(sender, self.data, ioPrio=1, closeWhenFinished=True)
+            self.assertTrue(t.wait(10))
+            self.assertTrue(t.finished)
+            self.assertEqual(join(), self.data)
+        finally:
+            receiver.close()
+
+    def test_bufferedWriter(self):
+        # A BufferedWriter raises BlockingIOError, with characters_written set to how much it accepted
+        (readFd, writeFd) = os.pipe()
+        set_fd_nonblocking(writeFd)
+        reader = os.fdopen(readFd, 'rb', 0)
+        try:
+            join = _read_all_later(reader.read)
+            t = bgwrite(os.fdopen(writeFd, 'wb'), self.data, ioPrio=1, closeWhenFinished=True)
+            self.assertTrue(t.wait(10))
+            self.assertTrue(t.finished, str(t.error))
+            self.assertEqual(join(), self.data)
+        finally:
+            reader.close()
+
+    def test_rawFile(self):
+        (readFd, writeFd) = os.pipe()
+        set_fd_nonblocking(writeFd)
+        reader = os.fdopen(readFd, 'rb', 0)
+        try:
+            join = _read_all_later(reader.read)
+            t = bgwrite(os.fdopen(writeFd, 'wb', 0), self.data, ioPrio=1, closeWhenFinished=True)
+            self.assertTrue(t.wait(10))
+            self.assertTrue(t.finished, str(t.error))
+            self.assertEqual(join(), self.data)
+        finally:
+            reader.close()
+
+    def test_writev(self):
+        blocks = [ self.data[i : i + 1000] for i in range(0, len(self.data), 1000) ]
+        (readFd, writeFd) = os.pipe()
+        set_fd_nonblocking(writeFd)
+        reader = os.fdopen(readFd, 'rb', 0)
+        try:
+            join = _read_all_later(reader.read)
+            t = bgwrite(os.fdopen(writeFd, 'wb', 0), blocks, ioPrio=1, batchSize=100000, closeWhenFinished=True)
+            self.assertTrue(t.wait(10))
+            self.assertTrue(t.finished, str(t.error))
+            self.assertEqual(join(), self.data)
+        finally:
+            reader.close()
+
+
+class _BlockedFile(object):
+    '''
+        A file whose writes block until released
+    '''
+
+    def __init__(self):
+        self.released = threading.Event()
+        self.written = []
+
+    def write(self, data):
+        self.released.wait()
+        self.written.append(bytes(data))
+        return len(data)
+
+
+class TestSchedulerStop(unittest.TestCase):
+
+    def test_queuedWritesCompleted(self):
+        scheduler = BackgroundWriteScheduler(numWorkers=1)
+        blocked = _BlockedFile()
+        other = io.BytesIO()
+
+        inProgress = scheduler.bgwrite(blocked, [b'first'])
+        while not inProgress.startedWriting:
+            time.sleep(.001)
+        ready = scheduler.bgwrite(other, [b'ready'])
+        sameFile = scheduler.bgwrite(blocked, [b'second'])
+        chained = scheduler.bgwrite(io.BytesIO(), [b'chained'], chainAfter=ready)
+
+        scheduler.stop()
+
+        for job in (ready, sameFile, chained):
+            self.assertTrue(job.wait(5))
+            self.assertFalse(job.finished)
+            self.assertTrue(job.error is not None)
+
+        blocked.released.set()
+        self.assertTrue(inProgress.wait(5))
+        self.assertTrue(inProgress.finished)
+        self.assertTrue(scheduler.waitUntilIdle(5))
+
+        self.assertEqual(blocked.written, [b'first'])
+        self.assertEqual(other.getvalue(), b'')
+
+
+class _FailingFile(object):
+    '''
+        A file whose writes always fail
+    '''
+
+    def write(self, data):
+        raise IOError('Cannot write')
+
+
+class TestChain(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = BackgroundWriteScheduler(numWorkers=2)
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def test_order(self):
+        blocked = _BlockedFile()
+        out = io.BytesIO()
+        first = self.scheduler.bgwrite(blocked, [b'first'])
+        second = bgwrite(out, [b'second'], chainAfter=first)
+
+        # Nothing is written until the write it is chained after has completed
+        time.sleep(.05)
+        self.assertFalse(second.startedWriting)
+        self.assertEqual(out.getvalue(), b'')
+
+        blocked.released.set()
+        self.assertTrue(wait_all([first, second], 5))
+        self.assertTrue(first.finished)
+        self.assertTrue(second.finished)
+        self.assertEqual(out.getvalue(), b'second')
+
+    def test_failurePropagated(self):
+        failed = self.scheduler.bgwrite(_FailingFile(), [b'first'])
+        out = io.BytesIO()
+        chained = bgwrite(out, [b'second'], chainAfter=failed)
+        chainedAgain = self.scheduler.bgwrite(io.BytesIO(), [b'third'], chainAfter=chained)
+
+        self.assertTrue(wait_all([failed, chained, chainedAgain], 5))
+        self.assertFalse(failed.finished)
+        self.assertTrue(isinstance(failed.error, IOError))
+
+        for job in (chained, chainedAgain):
+            self.assertFalse(job.finished)
+            self.assertTrue(job.error is not None)
+        self.assertEqual(out.getvalue(), b'')
+
+    def test_waitAllTimeout(self):
+        blocked = _BlockedFile()
+        jobs = [ self.scheduler.bgwrite(io.BytesIO(), [b'done']), self.scheduler.bgwrite(blocked, [b'blocked']) ]
+
+        start = time.time()
+        self.assertFalse(wait_all(jobs, .1))
+        elapsed = time.time() - start
+        self.assertTrue(.1 <= elapsed < 1, 'Waited %f seconds' %(elapsed,))
+
+        blocked.released.set()
+        self.assertTrue(wait_all(jobs, 5))
+        self.assertTrue(all([ job.finished for job in jobs ]))
+
+
+class _ClosingBytesIO(io.BytesIO):
+    '''
+        A BytesIO which keeps its contents once closed
+    '''
+
+    def close(self):
+        self.finalValue = self.getvalue()
+        io.BytesIO.close(self)
+
+
+class TestBackgroundWriter(unittest.TestCase):
+
+    def _fillQueue(self, blockWhenFull):
+        '''
+            Get the writer thread blocked writing, with a full queue behind it
+        '''
+        blocked = _BlockedFile()
+        writer = BackgroundWriter(blocked, ioPrio=1, maxQueueSize=10, blockWhenFull=blockWhenFull)
+        self.assertTrue(writer.write(b'busy'))
+        # Wait for the thread to take it off the queue
+        endTime = time.time() + 5
+        while writer._queue and time.time() < endTime:
+            time.sleep(.001)
+        self.assertTrue(writer.write(b'queued'))
+        return (blocked, writer)
+
+    def test_dropWhenFull(self):
+        (blocked, writer) = self._fillQueue(False)
+        self.assertFalse(writer.write(b'dropped'))
+        self.assertEqual(writer.numDropped, 1)
+
+        blocked.released.set()
+        self.assertTrue(writer.close(5))
+        self.assertEqual(blocked.written, [b'busy', b'queued'])
+
+    def test_blockWhenFull(self):
+        (blocked, writer) = self._fillQueue(True)
+        writeThread = threading.Thread(target=writer.write, args=(b'waiting',))
+        writeThread.start()
+
+        writeThread.join(.05)
+        self.assertTrue(writeThread.is_alive())
+
+        blocked.released.set()
+        writeThread.join(5)
+        self.assertFalse(writeThread.is_alive())
+        self.assertTrue(writer.close(5))
+        self.assertEqual(b''.join(blocked.written), b'busyqueuedwaiting')
+        self.assertEqual(writer.numDropped, 0)
+
+    def test_flush(self):
+        out = io.BytesIO()
+        writer = BackgroundWriter(out, ioPrio=1)
+        writer.write(b'first')
+        writer.write(bytearray(b'second'))
+        self.assertTrue(writer.flush(5))
+        self.assertEqual(out.getvalue(), b'firstsecond')
+        self.assertEqual(writer.bytesWritten, 11)
+        writer.close()
+
+    def test_flushTimeout(self):
+        blocked = _BlockedFile()
+        writer = BackgroundWriter(blocked, ioPrio=1)
+        writer.write(b'data')
+        self.assertFalse(writer.flush(.05))
+
+        blocked.released.set()
+        self.assertTrue(writer.flush(5))
+        writer.close()
+
+    def test_close(self):
+        out = _ClosingBytesIO()
+        writer = BackgroundWriter(out, ioPrio=1, closeWhenFinished=True)
+        writer.write(b'a' * 100000)
+        self.assertTrue(writer.close(5))
+
+        self.assertTrue(writer.closed)
+        self.assertTrue(out.closed)
+        self.assertEqual(out.finalValue, b'a' * 100000)
+        self.assertRaises(ValueError, writer.write, b'more')
+        # Closing again has no further effect
+        self.assertTrue(writer.close(5))
+
+    def test_error(self):
+        writer = BackgroundWriter(_FailingFile(), ioPrio=1)
+        writer.write(b'data')
+        self.assertRaises(IOError, writer.flush, 5)
+        self.assertRaises(IOError, writer.write, b'more')
+        self.assertRaises(IOError, writer.close, 5)
+
+
+class _SlowFile(io.BytesIO):
+    '''
+        A file which takes a fixed time per byte to write, and records the size of each write
+    '''
+
+    def __init__(self, secPerByte):
+        io.BytesIO.__init__(self)
+        self.secPerByte = secPerByte
+        self.writeSizes = []
+
+    def write(self, data):
+        time.sleep(len(data) * self.secPerByte)
+        self.writeSizes.append(len(data))
+        return io.BytesIO.write(self, data)
+
+
+class TestAdaptiveChunkSize(unittest.TestCase):
+
+    def setUp(self):
+        self.ioPrio = BackgroundIOPriority(.01, 65536, 100, targetChunkLatency=.05)
+
+    def test_lowerBound(self):
+        tuner = _ChunkSizeTuner(self.ioPrio, 65536)
+        sizes = [ tuner.update(tuner.chunkSize, 10) for i in range(10) ]
+        # Halved at most each chunk, down to the minimum
+        self.assertEqual(sizes[:4], [32768, 16384, 8192, 4096])
+        self.assertEqual(min(sizes), _MIN_CHUNK_SIZE)
+        self.assertEqual(sizes[-1], _MIN_CHUNK_SIZE)
+
+    def test_upperBound(self):
+        tuner = _ChunkSizeTuner(self.ioPrio, _MAX_CHUNK_SIZE // 4)
+        sizes = [ tuner.update(tuner.chunkSize, 0) for i in range(5) ]
+        self.assertEqual(sizes[:2], [_MAX_CHUNK_SIZE // 2, _MAX_CHUNK_SIZE])
+        self.assertEqual(max(sizes), _MAX_CHUNK_SIZE)
+        self.assertEqual(sizes[-1], _MAX_CHUNK_SIZE)
+
+    def test_towardTarget(self):
+        # At 1MB/s, .05 seconds is 50000 bytes
+        tuner = _ChunkSizeTuner(self.ioPrio, _MIN_CHUNK_SIZE)
+        for i in range(20):
+            tuner.update(tuner.chunkSize, tuner.chunkSize / 1000000.0)
+        self.assertEqual(tuner.chunkSize, 50000)
+
+    def test_emptyChunk(self):
+        tuner = _ChunkSizeTuner(self.ioPrio, 65536)
+        self.assertEqual(tuner.update(0, 1), 65536)
+        self.assertTrue(tuner.secPerByte is None)
+
+    def test_bgwrite(self):
+        ioPrio = BackgroundIOPriority(.01, _MIN_CHUNK_SIZE, 100, targetChunkLatency=.01)
+        # At 1MB/s, .01 seconds is 10000 bytes
+        out = _SlowFile(.000001)
+        data = bytes(bytearray(range(256))) * 800
+        t = bgwrite(out, data, ioPrio=ioPrio, adaptiveChunkSize=True)
+        t.join()
+
+        self.assertTrue(t.finished)
+        self.assertEqual(out.getvalue(), data)
+        self.assertEqual(out.writeSizes[0], _MIN_CHUNK_SIZE)
+        # Sleeps run long rather than short, so allow for the chunks being somewhat smaller than the target
+        self.assertTrue(5000 <= out.writeSizes[-2] <= 12000, 'Chunk sizes: %s' %(str(out.writeSizes),))
+
+
+class TestRateLimit(unittest.TestCase):
+
+    def _timeWrites(self, ioPrio, numWrites, size):
+        outputs = [ io.BytesIO() for i in range(numWrites) ]
+        start = time.time()
+        handles = [ bgwrite(out, b'x' * size, ioPrio=ioPrio) for out in outputs ]
+        self.assertTrue(wait_all(handles, 10))
+        elapsed = time.time() - start
+
+        for out in outputs:
+            self.assertEqual(len(out.getvalue()), size)
+        return elapsed
+
+    def test_profileLimitShared(self):
+        # Each write alone fits in the burst, but the limit is on all writes using the profile
+        ioPrio = BackgroundIOPriority(.001, 16 * 1024, 100, maxBytesPerSec=256 * 1024, burstSize=16 * 1024)
+
+        elapsed = self._timeWrites(ioPrio, 4, 16 * 1024)
+        # 48K beyond the burst, at 256K/s
+        self.assertTrue(elapsed >= .15, 'Took only %f seconds' %(elapsed,))
+        self.assertTrue(elapsed < 2, 'Took %f seconds' %(elapsed,))
+
+    def test_budgetShared(self):
+        set_io_budget(256 * 1024, burstSize=16 * 1024)
+        try:
+            elapsed = self._timeWrites(1, 4, 16 * 1024)
+        finally:
+            set_io_budget(None)
+
+        # 48K beyond the burst, at 256K/s for all writes together
+        self.assertTrue(elapsed >= .15, 'Took only %f seconds' %(elapsed,))
+        self.assertTrue(elapsed < 2, 'Took %f seconds' %(elapsed,))
+
+
+class TestDataChunks(unittest.TestCase):
+
+    def test_zeroCopy(self):
+        data = bytearray(b'0123456789')
+        chunks = DataChunks(data, 4)
+        self.assertEqual(len(chunks), 3)
+
+        first = chunks.popleft()
+        self.assertTrue(isinstance(first, memoryview))
+        self.assertTrue(first.obj is data)
+        self.assertEqual(bytes(first), b'0123')
+
+        # A view of the data, not a copy
+        data[4] = ord('X')
+        self.assertEqual(bytes(chunks.peek()), b'X567')
+
+        self.assertEqual([ bytes(chunk) for chunk in chunks ], [b'X567', b'89'])
+        self.assertEqual(bytes(chunks.popleft()), b'X567')
+        self.assertEqual(bytes(chunks.popleft()), b'89')
+        self.assertEqual(len(chunks), 0)
+        self.assertRaises(IndexError, chunks.popleft)
+        self.assertRaises(IndexError, chunks.peek)
+
+    def test_castToBytes(self):
+        data = array.array('i', [1, 2, 3])
+        chunks = DataChunks(data, 5)
+        self.assertEqual(len(chunks), (len(data) * data.itemsize + 4) // 5)
+        self.assertEqual(b''.join([ bytes(chunks.popleft()) for i in range(len(chunks)) ]), data.tobytes())
+
+    def test_text(self):
+        chunks = DataChunks(u'abcdefg', 3)
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(chunks.popleft(), u'abc')
+        self.assertEqual(list(chunks), [u'def', u'g'])
+
+    def test_invalidChunkSize(self):
+        self.assertRaises(ValueError, DataChunks, b'data', 0)
+
+    def test_bgwrite(self):
+        data = bytes(bytearray(range(256))) * 1000
+        out = io.BytesIO()
+        t = bgwrite(out, data, ioPrio=1)
+        t.join()
+        self.assertTrue(isinstance(t.remainingData, DataChunks))
+        self.assertEqual(out.getvalue(), data)
+
+
+if __name__ == '__main__':
+    unittest.main()
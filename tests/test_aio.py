@@ -0,0 +1,106 @@
+'''
+    Tests for nonblock.aio
+'''
+# vim: ts=4 sw=4 expandtab
+
+import asyncio
+import os
+import unittest
+
+from nonblock.aio import async_nonblock_read, async_bgread
+
+
+class _LoopTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        (self.readFd, self.writeFd) = os.pipe()
+        self.stream = os.fdopen(self.readFd, 'rb')
+
+    def tearDown(self):
+        if self.writeFd is not None:
+            os.close(self.writeFd)
+        self.stream.close()
+        self.loop.close()
+
+    def _closeWriter(self):
+        os.close(self.writeFd)
+        self.writeFd = None
+
+    def _run(self, coroutine):
+        return self.loop.run_until_complete(asyncio.wait_for(coroutine, 5))
+
+
+class TestAsyncNonblockRead(_LoopTestCase):
+
+    def test_waitsForData(self):
+        self.loop.call_later(.02, os.write, self.writeFd, b'data')
+
+        self.assertEqual(self._run(async_nonblock_read(self.stream)), b'data')
+
+    def test_eof(self):
+        os.write(self.writeFd, b'last')
+        self.loop.call_later(.02, self._closeWriter)
+
+        self.assertEqual(self._run(async_nonblock_read(self.stream)), b'last')
+        # Waits for the close, rather than returning empty
+        self.assertEqual(self._run(async_nonblock_read(self.stream)), None)
+
+
+class TestAsyncBgread(_LoopTestCase):
+
+    def test_iterateUntilEof(self):
+        async def _collect():
+            results = async_bgread(self.stream)
+
+            self.loop.call_later(.01, os.write, self.writeFd, b'one')
+            self.loop.call_later(.03, os.write, self.writeFd, b'two')
+            self.loop.call_later(.05, self._closeWriter)
+
+            blocks = []
+            async for block in results:
+                blocks.append(block)
+            return (results, blocks)
+
+        (results, blocks) = self._run(_collect())
+
+        self.assertEqual(b''.join(blocks), b'onetwo')
+        self.assertTrue(results.isFinished)
+        self.assertTrue(self.stream.closed)
+
+    def test_highWaterMark(self):
+        data = b'x' * 100000
+
+        async def _collect():
+            results = async_bgread(self.stream, highWaterMark=1000)
+
+            received = []
+            def _writeAll():
+                os.write(self.writeFd, data[:50000])
+                os.write(self.writeFd, data[50000:])
+                os.close(self.writeFd)
+                self.writeFd = None
+            # Pipes hold 64K, so write from a thread while the loop consumes
+            writer = self.loop.run_in_executor(None, _writeAll)
+
+            while await results.wait():
+                self.assertTrue(len(results) <= 1000 + 65535)
+                received.append(results.popData())
+
+            await writer
+            return b''.join(received)
+
+        self.assertEqual(self._run(_collect()), data)
+
+    def test_waitTimeout(self):
+        async def _wait():
+            results = async_bgread(self.stream)
+            waited = await results.wait(.02)
+            results.stop()
+            return waited
+
+        self.assertFalse(self._run(_wait()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+'''
+    Tests for nonblock.framing
+'''
+# vim: ts=4 sw=4 expandtab
+
+import os
+import struct
+import unittest
+
+from nonblock.BackgroundRead import BackgroundReadData
+from nonblock.framing import DelimiterFramer, FixedLengthFramer, LengthPrefixFramer, nonblock_readline, nonblock_read_record
+
+
+def _frame(framer, blocks):
+    '''
+        Feed #blocks to a BackgroundReadData with #framer, and return it
+    '''
+    results = BackgroundReadData(bytes, framer=framer)
+    for block in blocks:
+        results.addBlock(block)
+    return results
+
+
+def _pop_all(results):
+    records = []
+    while True:
+        record = results.popBlock()
+        if record is None:
+            return records
+        records.append(record)
+
+
+class TestDelimiterFramer(unittest.TestCase):
+
+    def test_delimiterSplitAcrossBlocks(self):
+        results = _frame(DelimiterFramer(b'\r\n'), [b'one\r', b'\ntwo', b'\r', b'\nthree\r'])
+
+        self.assertEqual(_pop_all(results), [b'one\r\n', b'two\r\n'])
+        # The partial record, including the start of a delimiter, is still held
+        self.assertEqual(results.data, b'three\r')
+
+        results.addBlock(b'\n')
+        self.assertEqual(_pop_all(results), [b'three\r\n'])
+
+    def test_delimiterOfManyCharacters(self):
+        results = _frame(DelimiterFramer(b'<END>'), [b'a<E', b'N', b'D>b<END', b'>'])
+
+        self.assertEqual(_pop_all(results), [b'a<END>', b'b<END>'])
+
+
+class TestFixedLengthFramer(unittest.TestCase):
+
+    def test_recordsAcrossBlocks(self):
+        results = _frame(FixedLengthFramer(4), [b'ab', b'cdefgh', b'ij'])
+
+        self.assertEqual(_pop_all(results), [b'abcd', b'efgh'])
+        self.assertEqual(results.data, b'ij')
+
+
+class TestLengthPrefixFramer(unittest.TestCase):
+
+    @staticmethod
+    def _record(data):
+        return struct.pack('>I', len(data)) + data
+
+    def test_zeroLengthRecord(self):
+        stream = self._record(b'first') + self._record(b'') + self._record(b'last')
+        results = _frame(LengthPrefixFramer(), [stream])
+
+        self.assertEqual(_pop_all(results), [b'first', b'', b'last'])
+
+    def test_headerSplitAcrossBlocks(self):
+        stream = self._record(b'first') + self._record(b'second')
+        results = _frame(LengthPrefixFramer(), [ stream[i : i + 1] for i in range(len(stream)) ])
+
+        self.assertEqual(_pop_all(results), [b'first', b'second'])
+
+    def test_includePrefix(self):
+        results = _frame(LengthPrefixFramer(includePrefix=True), [self._record(b'data')])
+
+        self.assertEqual(_pop_all(results), [self._record(b'data')])
+
+    def test_partialTrailingRecord(self):
+        results = _frame(LengthPrefixFramer(), [self._record(b'whole') + self._record(b'partial')[:-2]])
+
+        self.assertEqual(_pop_all(results), [b'whole'])
+        self.assertEqual(len(results), 4 + len(b'partial') - 2)
+
+
+class TestReadRecord(unittest.TestCase):
+
+    def setUp(self):
+        (self.readFd, self.writeFd) = os.pipe()
+        self.stream = os.fdopen(self.readFd, 'rb')
+
+    def tearDown(self):
+        self.stream.close()
+
+    def test_readline(self):
+        os.write(self.writeFd, b'one\ntw')
+        self.assertEqual(nonblock_readline(self.stream), b'one\n')
+        self.assertEqual(nonblock_readline(self.stream), b'')
+
+        os.write(self.writeFd, b'o\nthree')
+        self.assertEqual(nonblock_readline(self.stream), b'two\n')
+
+        # A partial trailing record is returned once the stream is closed, then None
+        os.close(self.writeFd)
+        self.assertEqual(nonblock_readline(self.stream), b'three')
+        self.assertEqual(nonblock_readline(self.stream), None)
+
+    def test_readRecord(self):
+        framer = LengthPrefixFramer()
+        os.write(self.writeFd, struct.pack('>I', 3) + b'ab')
+        self.assertEqual(nonblock_read_record(self.stream, framer), b'')
+
+        os.write(self.writeFd, b'c' + struct.pack('>I', 0))
+        self.assertEqual(nonblock_read_record(self.stream, framer), b'abc')
+        self.assertEqual(nonblock_read_record(self.stream, framer), b'')
+
+        os.close(self.writeFd)
+        self.assertEqual(nonblock_read_record(self.stream, framer), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+'''
+    Tests for nonblock.metrics
+'''
+# vim: ts=4 sw=4 expandtab
+
+import io
+import os
+import time
+import unittest
+
+from nonblock import bgread, bgwrite, enable_metrics, disable_metrics, snapshot_metrics
+
+
+def _wait_for(func, timeout=5):
+    endTime = time.time() + timeout
+    while time.time() < endTime:
+        if func():
+            return True
+        time.sleep(.01)
+    return func()
+
+
+def _total(kind, name):
+    return snapshot_metrics().get(kind, {}).get('counters', {}).get(name, 0)
+
+
+class TestMetricsEnabled(unittest.TestCase):
+
+    def setUp(self):
+        enable_metrics()
+
+    def tearDown(self):
+        disable_metrics()
+
+    def test_bgwrite(self):
+        totalBefore = _total('bgwrite', 'bytesWritten')
+        out = io.BytesIO()
+        t = bgwrite(out, [b'first', b'second', b'third'], ioPrio=1)
+        t.join()
+
+        self.assertTrue(t.finished)
+        counters = t.metrics.snapshot()['counters']
+        self.assertEqual(counters['writes'], 3)
+        self.assertEqual(counters['bytesWritten'], 16)
+        self.assertEqual(_total('bgwrite', 'bytesWritten') - totalBefore, 16)
+
+    def test_bgread(self):
+        totalBefore = _total('bgread', 'bytesRead')
+        (readFd, writeFd) = os.pipe()
+        results = bgread(os.fdopen(readFd, 'rb'), eventDriven=True)
+        os.write(writeFd, b'x' * 1000)
+        os.close(writeFd)
+        self.assertTrue(_wait_for(lambda : results.isFinished))
+
+        counters = results.metrics.snapshot()['counters']
+        self.assertEqual(counters['bytesRead'], 1000)
+        self.assertTrue(counters['reads'] >= 2, 'Only %d reads, including the one at the end of the stream' %(counters['reads'],))
+        self.assertEqual(_total('bgread', 'bytesRead') - totalBefore, 1000)
+
+
+class TestMetricsDisabled(unittest.TestCase):
+
+    def test_noMetrics(self):
+        disable_metrics()
+        totalBefore = _total('bgwrite', 'bytesWritten')
+
+        t = bgwrite(io.BytesIO(), b'data', ioPrio=1)
+        t.join()
+        self.assertTrue(t.metrics is None)
+        self.assertEqual(_total('bgwrite', 'bytesWritten'), totalBefore)
+
+        (readFd, writeFd) = os.pipe()
+        results = bgread(os.fdopen(readFd, 'rb'))
+        os.close(writeFd)
+        self.assertTrue(results.metrics is None)
+        self.assertTrue(_wait_for(lambda : results.isFinished))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,212 @@
+'''
+    Tests for nonblock.read
+'''
+# vim: ts=4 sw=4 expandtab
+
+import io
+import os
+import socket
+import threading
+import time
+import unittest
+
+from nonblock import nonblock_read, nonblock_readinto, nonblock_read_until
+from nonblock.common import is_fd_nonblocking, set_fd_nonblocking
+
+
+class TestFdLeftBlocking(unittest.TestCase):
+    '''
+        Reading without blocking must not leave O_NONBLOCK set on an fd the caller opened (e.x. a tty stdin)
+    '''
+
+    def setUp(self):
+        (self.readFd, self.writeFd) = os.pipe()
+
+    def tearDown(self):
+        os.close(self.writeFd)
+
+    def _checkRead(self, stream, readFunc):
+        try:
+            self.assertEqual(readFunc(stream), b'')
+            os.write(self.writeFd, b'data')
+            self.assertEqual(readFunc(stream), b'data')
+            self.assertFalse(is_fd_nonblocking(self.readFd))
+        finally:
+            stream.close()
+
+    def test_rawRead(self):
+        self._checkRead(os.fdopen(self.readFd, 'rb', 0), nonblock_read)
+
+    def test_bufferedRead(self):
+        self._checkRead(os.fdopen(self.readFd, 'rb'), nonblock_read)
+
+    def test_bufferedReadinto(self):
+        def _readinto(stream):
+            buf = bytearray(16)
+            count = nonblock_readinto(stream, buf)
+            return bytes(buf[:count])
+
+        self._checkRead(os.fdopen(self.readFd, 'rb'), _readinto)
+
+    def test_alreadyNonblocking(self):
+        set_fd_nonblocking(self.readFd)
+        stream = os.fdopen(self.readFd, 'rb')
+        try:
+            self.assertEqual(nonblock_read(stream), b'')
+            self.assertTrue(is_fd_nonblocking(self.readFd))
+        finally:
+            stream.close()
+
+
+class TestTextRead(unittest.TestCase):
+
+    def test_multibyteSplitAcrossReads(self):
+        (readFd, writeFd) = os.pipe()
+        stream = io.open(readFd, 'r', encoding='utf-8')
+        encoded = u'a\u20ac'.encode('utf-8')
+        try:
+            # The euro sign is 3 bytes, write only the first of them
+            os.write(writeFd, encoded[:2])
+            self.assertEqual(nonblock_read(stream), u'a')
+
+            os.write(writeFd, encoded[2:3])
+            self.assertEqual(nonblock_read(stream), u'')
+
+            os.write(writeFd, encoded[3:] + u'b'.encode('utf-8'))
+            self.assertEqual(nonblock_read(stream), u'\u20acb')
+        finally:
+            os.close(writeFd)
+            stream.close()
+
+
+class _FlaglessSocket(socket.socket):
+    '''
+        A socket subclass which, like ssl.SSLSocket, does not accept flags to recv / recv_into
+    '''
+
+    def recv(self, size, flags=0):
+        if flags:
+            raise ValueError('non-zero flags not allowed')
+        return socket.socket.recv(self, size)
+
+    def recv_into(self, buffer, size=0, flags=0):
+        if flags:
+            raise ValueError('non-zero flags not allowed')
+        return socket.socket.recv_into(self, buffer, size)
+
+
+class _UpperRawReader(io.RawIOBase):
+    '''
+        A RawIOBase subclass with its own readinto, which transforms the data of its fd
+    '''
+
+    def __init__(self, fd):
+        self.fd = fd
+
+    def fileno(self):
+        return self.fd
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = os.read(self.fd, len(buffer)).upper()
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class TestWrappedStreams(unittest.TestCase):
+    '''
+        Subclasses of raw streams may transform the data, so must be read with their own methods rather than from the fd
+    '''
+
+    def test_socketSubclass(self):
+        (sender, receiver) = socket.socketpair()
+        wrapped = _FlaglessSocket(fileno=receiver.detach())
+        try:
+            sender.sendall(b'data')
+            self.assertEqual(nonblock_read(wrapped), b'data')
+        finally:
+            sender.close()
+            wrapped.close()
+
+    def test_rawSubclass(self):
+        (readFd, writeFd) = os.pipe()
+        try:
+            os.write(writeFd, b'data')
+            self.assertEqual(nonblock_read(_UpperRawReader(readFd), forceMode='b'), b'DATA')
+        finally:
+            os.close(readFd)
+            os.close(writeFd)
+
+
+class TestReadUntil(unittest.TestCase):
+
+    def setUp(self):
+        (readFd, self.writeFd) = os.pipe()
+        self.stream = os.fdopen(readFd, 'rb', 0)
+
+    def tearDown(self):
+        if self.writeFd is not None:
+            os.close(self.writeFd)
+        self.stream.close()
+
+    def test_size(self):
+        os.write(self.writeFd, b'0123456789')
+        self.assertEqual(nonblock_read_until(self.stream, size=4), b'0123')
+        # Only as much as the size is read, so nothing is held
+        self.assertEqual(nonblock_read(self.stream), b'456789')
+
+    def test_delimiter(self):
+        os.write(self.writeFd, b'one\ntwo\nthr')
+        self.assertEqual(nonblock_read_until(self.stream, delimiter=b'\n'), b'one\n')
+        # The data read past the delimiter is held, and returned first by the next call
+        self.assertEqual(nonblock_read_until(self.stream, delimiter=b'\n'), b'two\n')
+        self.assertEqual(nonblock_read_until(self.stream, delimiter=b'\n', timeout=.05), b'thr')
+
+    def test_delimiterAndSize(self):
+        os.write(self.writeFd, b'one\ntwo\n')
+        self.assertEqual(nonblock_read_until(self.stream, size=2, delimiter=b'\n'), b'on')
+        self.assertEqual(nonblock_read_until(self.stream, size=100, delimiter=b'\n'), b'e\n')
+
+    def test_delimiterSplitAcrossReads(self):
+        os.write(self.writeFd, b'ab\r')
+        writer = threading.Timer(.05, os.write, (self.writeFd, b'\ncd'))
+        writer.start()
+        try:
+            self.assertEqual(nonblock_read_until(self.stream, delimiter=b'\r\n', timeout=2), b'ab\r\n')
+        finally:
+            writer.join()
+        self.assertEqual(nonblock_read_until(self.stream, size=2, timeout=2), b'cd')
+
+    def test_timeout(self):
+        start = time.time()
+        self.assertEqual(nonblock_read_until(self.stream, size=4, timeout=.1), b'')
+        self.assertTrue(time.time() - start >= .1)
+
+        os.write(self.writeFd, b'ab')
+        self.assertEqual(nonblock_read_until(self.stream, size=4, timeout=.05), b'ab')
+
+    def test_waitsForData(self):
+        writer = threading.Timer(.05, os.write, (self.writeFd, b'late'))
+        writer.start()
+        try:
+            self.assertEqual(nonblock_read_until(self.stream, size=4), b'late')
+        finally:
+            writer.join()
+
+    def test_closed(self):
+        os.write(self.writeFd, b'end')
+        os.close(self.writeFd)
+        self.writeFd = None
+        self.assertEqual(nonblock_read_until(self.stream, delimiter=b'\n'), b'end')
+        self.assertTrue(nonblock_read_until(self.stream, delimiter=b'\n') is None)
+
+    def test_invalidArguments(self):
+        self.assertRaises(ValueError, nonblock_read_until, self.stream)
+        self.assertRaises(ValueError, nonblock_read_until, self.stream, size=0)
+        self.assertRaises(ValueError, nonblock_read_until, self.stream, delimiter=u'\n')
+
+
+if __name__ == '__main__':
+    unittest.main()